@@ -0,0 +1,125 @@
+"""
+Admission control for expensive endpoints.
+
+Work admitted by an AdmissionController runs on its own bounded thread pool,
+so a slow model backend cannot take the event loop or the threads that serve
+cheap endpoints with it. Requests beyond the concurrency limit wait in a
+bounded queue; a request is shed with Overloaded as soon as its expected
+queue wait would exceed the deadline, instead of piling up until the process
+runs out of memory or connections. A request whose client goes away keeps
+its slot until its thread finishes, so the bound holds during disconnect
+storms too.
+"""
+
+import asyncio
+import contextvars
+import math
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict
+
+from metrics import admission_wait_seconds, admission_requests_total
+
+
+class Overloaded(Exception):
+    """Raised when a request is shed; retry_after is a hint in seconds"""
+
+    def __init__(self, retry_after: int):
+        super().__init__(f"Server overloaded, retry after {retry_after}s")
+        self.retry_after = retry_after
+
+
+class AdmissionController:
+    def __init__(self, name: str, max_concurrency: int, max_queue: int, queue_deadline_seconds: float):
+        self.name = name
+        self.max_concurrency = max_concurrency
+        self.max_queue = max_queue
+        self.queue_deadline_seconds = queue_deadline_seconds
+        self._executor = ThreadPoolExecutor(
+            max_workers=max_concurrency, thread_name_prefix=f"{name}-worker")
+        self._semaphore = None
+        self._lock = threading.Lock()
+
+        self.in_flight = 0
+        self.queued = 0
+        self.admitted_total = 0
+        self.shed_total = 0
+        self.queue_wait_seconds_total = 0.0
+        self.last_queue_wait_seconds = 0.0
+        # Smoothed service time, used to predict how long a new request would wait
+        self.avg_service_seconds = 0.0
+
+    def _predicted_wait(self) -> float:
+        if self.in_flight < self.max_concurrency:
+            return 0.0
+        return (self.queued + 1) / self.max_concurrency * self.avg_service_seconds
+
+    def _shed(self, predicted_wait: float):
+        with self._lock:
+            self.shed_total += 1
+        admission_requests_total.inc(controller=self.name, outcome="shed")
+        retry_after = max(1, math.ceil(
+            predicted_wait or self.queue_deadline_seconds))
+        raise Overloaded(retry_after)
+
+    async def run(self, fn: Callable, *args) -> Any:
+        """Run fn(*args) on the controller's thread pool once admitted"""
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+
+        predicted_wait = self._predicted_wait()
+        if self.queued >= self.max_queue or predicted_wait > self.queue_deadline_seconds:
+            self._shed(predicted_wait)
+
+        self.queued += 1
+        enqueued_at = time.monotonic()
+        try:
+            await asyncio.wait_for(self._semaphore.acquire(), timeout=self.queue_deadline_seconds)
+        except asyncio.TimeoutError:
+            self._shed(self._predicted_wait())
+        finally:
+            self.queued -= 1
+
+        waited = time.monotonic() - enqueued_at
+        with self._lock:
+            self.admitted_total += 1
+            self.queue_wait_seconds_total += waited
+            self.last_queue_wait_seconds = waited
+        admission_wait_seconds.observe(waited, controller=self.name)
+        admission_requests_total.inc(controller=self.name, outcome="admitted")
+        self.in_flight += 1
+        started_at = time.monotonic()
+
+        def finished(_):
+            # The slot is held until the thread is done, even if the caller was cancelled
+            elapsed = time.monotonic() - started_at
+            self.avg_service_seconds = elapsed if not self.avg_service_seconds else (
+                0.8 * self.avg_service_seconds + 0.2 * elapsed)
+            self.in_flight -= 1
+            self._semaphore.release()
+
+        # Copy the context so request-scoped context variables follow the work
+        ctx = contextvars.copy_context()
+        loop = asyncio.get_running_loop()
+        future = loop.run_in_executor(self._executor, ctx.run, fn, *args)
+        future.add_done_callback(finished)
+        # A cancelled caller stops waiting; the work itself cannot be interrupted
+        return await asyncio.shield(future)
+
+    def stats(self) -> Dict[str, Any]:
+        """Queue depth, wait times and shed count for capacity planning"""
+        return {
+            "name": self.name,
+            "max_concurrency": self.max_concurrency,
+            "max_queue": self.max_queue,
+            "queue_deadline_seconds": self.queue_deadline_seconds,
+            "in_flight": self.in_flight,
+            "queue_depth": self.queued,
+            "admitted_total": self.admitted_total,
+            "shed_total": self.shed_total,
+            "last_queue_wait_seconds": round(self.last_queue_wait_seconds, 4),
+            "avg_queue_wait_seconds": round(
+                self.queue_wait_seconds_total / self.admitted_total, 4) if self.admitted_total else 0.0,
+            "avg_service_seconds": round(self.avg_service_seconds, 4),
+        }
@@ -0,0 +1,139 @@
+"""
+Per-session model allocation.
+
+Instead of running every registered model for every session, the allocator
+decides which subset to run with Thompson sampling over each model's
+selection rate (how often users pick a model's therapist when it is shown).
+Paid models are added in order of their sampled rate while they fit in the
+per-session cost budget. The random control is included at a fixed rate that
+does not depend on the bandit, so it remains a valid baseline.
+
+For every session the allocator records each model's inclusion probability
+(estimated by simulating the sampler) in model_allocations, so selection
+rates can be compared with inverse-propensity weighting even though
+allocation is adaptive.
+"""
+
+import json
+import logging
+import os
+import random
+import threading
+import time
+from typing import Dict, List, Tuple
+
+from sqlalchemy.orm import Session
+
+from database import ModelAllocation
+from matching import MATCHING_MODELS
+from rollups import model_totals
+
+logger = logging.getLogger(__name__)
+
+# "bandit" allocates a subset per session, "all" runs every registered model
+ALLOCATION_STRATEGY = os.getenv("MODEL_ALLOCATION", "bandit")
+# Relative cost of one call to each model
+MODEL_COSTS = json.loads(os.getenv("MODEL_COSTS", json.dumps({
+    "gemini-2.5-flash": 1.0,
+    "gemini-2.5-flash-lite": 0.3,
+    "random": 0.0,
+    "local-tfidf": 0.0,
+})))
+SESSION_COST_BUDGET = float(os.getenv("SESSION_COST_BUDGET", 1.0))
+CONTROL_MODEL = "random"
+CONTROL_RATE = float(os.getenv("RANDOM_CONTROL_RATE", 1.0))
+# Share of sessions allocated uniformly at random so no model starves
+EXPLORATION_RATE = float(os.getenv("ALLOCATION_EXPLORATION_RATE", 0.1))
+STATS_TTL_SECONDS = float(os.getenv("ALLOCATION_STATS_TTL_SECONDS", 300))
+PROPENSITY_SIMULATIONS = 200
+
+
+class ModelAllocator:
+    def __init__(self, models: List[str] = MATCHING_MODELS, costs: Dict[str, float] = MODEL_COSTS,
+                 budget: float = SESSION_COST_BUDGET, control_rate: float = CONTROL_RATE,
+                 exploration_rate: float = EXPLORATION_RATE):
+        self.models = models
+        self.costs = costs
+        self.budget = budget
+        self.control_rate = control_rate
+        self.exploration_rate = exploration_rate
+        self.paid_models = [m for m in models if m != CONTROL_MODEL]
+        self._stats: Dict[str, Tuple[int, int]] = {}
+        self._stats_loaded_at = None
+        self._lock = threading.Lock()
+
+    def _load_stats(self, db: Session) -> Dict[str, Tuple[int, int]]:
+        """(times shown, times selected) per model, cached for STATS_TTL_SECONDS"""
+        with self._lock:
+            if self._stats_loaded_at is not None and time.monotonic() - self._stats_loaded_at < STATS_TTL_SECONDS:
+                return self._stats
+
+        totals = model_totals(db)
+        stats = {
+            m: (totals.get(m, {}).get("shown", 0),
+                totals.get(m, {}).get("selected", 0))
+            for m in self.models
+        }
+
+        with self._lock:
+            self._stats = stats
+            self._stats_loaded_at = time.monotonic()
+        return stats
+
+    def _sample_paid(self, stats: Dict[str, Tuple[int, int]], rng: random.Random) -> List[str]:
+        """Draw one allocation of paid models within the budget"""
+        if rng.random() < self.exploration_rate:
+            order = self.paid_models[:]
+            rng.shuffle(order)
+        else:
+            draws = {}
+            for model in self.paid_models:
+                shown, selected = stats.get(model, (0, 0))
+                selected = min(selected, shown)
+                draws[model] = rng.betavariate(
+                    1 + selected, 1 + shown - selected)
+            order = sorted(self.paid_models, key=draws.get, reverse=True)
+
+        chosen, spent = [], 0.0
+        for model in order:
+            cost = self.costs.get(model, 1.0)
+            if spent + cost <= self.budget:
+                chosen.append(model)
+                spent += cost
+        if not chosen and order:
+            # Always run at least one paid model so there is something to compare
+            chosen.append(min(order, key=lambda m: self.costs.get(m, 1.0)))
+        return chosen
+
+    def allocate(self, db: Session, comparison_id: str) -> List[str]:
+        """Choose the models to run for a session and stage its allocation rows"""
+        if ALLOCATION_STRATEGY == "all":
+            return list(self.models)
+
+        stats = self._load_stats(db)
+        rng = random.Random()
+        chosen = set(self._sample_paid(stats, rng))
+        if CONTROL_MODEL in self.models and rng.random() < self.control_rate:
+            chosen.add(CONTROL_MODEL)
+
+        # Inclusion probabilities under the current posterior, for weighting
+        inclusion = {m: 0 for m in self.paid_models}
+        for _ in range(PROPENSITY_SIMULATIONS):
+            for model in self._sample_paid(stats, rng):
+                inclusion[model] += 1
+        probabilities = {m: n / PROPENSITY_SIMULATIONS for m,
+                         n in inclusion.items()}
+        if CONTROL_MODEL in self.models:
+            probabilities[CONTROL_MODEL] = self.control_rate
+
+        for model in self.models:
+            db.add(ModelAllocation(
+                comparison_id=comparison_id,
+                model_name=model,
+                inclusion_probability=probabilities[model],
+                allocated=model in chosen
+            ))
+
+        models = [m for m in self.models if m in chosen]
+        logger.info(f"Allocated models for session {comparison_id}: {models}")
+        return models
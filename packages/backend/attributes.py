@@ -0,0 +1,160 @@
+"""
+Therapist list fields as indexed rows.
+
+specialties, therapeutic_approaches, therapeutic_style, age_groups and
+languages are JSON columns, so a question like "therapists who speak English
+and treat anxiety" meant loading every therapist into Python. Each label is
+also stored in therapist_attributes as an (attribute, concept id, therapist
+id) row, the table's primary key, so such a filter is an intersection of index
+range scans. Values are vocabulary concept ids (vocabulary.py): "Inglés" and
+"English", or "Ansiedad y estrés" and "ansiedad", are the same value. The
+rows are written with the therapist on registration and bulk import, removed
+with it, and backfilled by migrate.py.
+
+With LANGUAGE_HARD_FILTER=1, patients' language answers are a hard
+requirement: the models only see active therapists who speak one of the
+languages picked (unless none does). It is off by default, so the language
+answers only count towards the models' ranking.
+"""
+
+import logging
+import os
+from typing import Any, Dict, Iterable, List, Mapping, Optional, Set
+
+from sqlalchemy import delete, exists, insert, intersect, select
+from sqlalchemy.sql import Select
+
+import vocabulary
+from database import Therapist, TherapistAttribute
+
+logger = logging.getLogger(__name__)
+
+# Therapist columns stored as attributes
+ATTRIBUTE_FIELDS = tuple(vocabulary.FIELD_PREFIXES)
+# Restrict candidates to therapists speaking one of the patient's languages
+LANGUAGE_HARD_FILTER = os.getenv(
+    "LANGUAGE_HARD_FILTER", "").lower() in ("1", "true", "yes")
+# Attributes the patient's answers restrict candidates by
+REQUIRED_FIELDS = ("languages",)
+# Answers longer than this are prose, not a choice of language
+MAX_CHOICE_WORDS = 4
+
+
+def label_values(field: str, label: str) -> Set[str]:
+    """Concept ids stored for one label of a therapist field"""
+    prefix = f"{vocabulary.FIELD_PREFIXES[field]}:"
+    values = {c for c in vocabulary.base().label_concepts(field, label) if c.startswith(prefix)}
+    if vocabulary.fold(label):
+        # Labels outside the vocabulary are also values of their own
+        values.add(vocabulary.concept_id(field, label))
+    return values
+
+
+def attribute_rows(therapist: Mapping[str, Any]) -> List[Dict[str, str]]:
+    rows = []
+    for field in ATTRIBUTE_FIELDS:
+        values = set()
+        for label in therapist.get(field) or ():
+            if isinstance(label, str):
+                values |= label_values(field, label)
+        rows.extend({"attribute": field, "value": value, "therapist_id": therapist["id"]}
+                    for value in sorted(values))
+    return rows
+
+
+def write(db, therapists: Iterable[Mapping[str, Any]]) -> int:
+    """Insert the attribute rows of new therapists; db may be a Session or a Connection"""
+    rows = [row for therapist in therapists for row in attribute_rows(therapist)]
+    if rows:
+        db.execute(insert(TherapistAttribute.__table__), rows)
+    return len(rows)
+
+
+def remove(db, therapist_ids: List[str]) -> None:
+    table = TherapistAttribute.__table__
+    db.execute(delete(table).where(table.c.therapist_id.in_(therapist_ids)))
+
+
+def backfill_attributes(connection, batch_size: int = 1000) -> int:
+    """Write the attributes of therapists that have none; returns therapists written.
+
+    Registered in migrate.MIGRATIONS.
+    """
+    therapists = Therapist.__table__
+    attributes = TherapistAttribute.__table__
+    missing = ~exists().where(attributes.c.therapist_id == therapists.c.id)
+    columns = [therapists.c.id] + [therapists.c[field] for field in ATTRIBUTE_FIELDS]
+    written = 0
+    last_id = ""
+    while True:
+        rows = connection.execute(
+            select(*columns).where(missing, therapists.c.id > last_id)
+            .order_by(therapists.c.id).limit(batch_size)).all()
+        if not rows:
+            break
+        batch = [dict(row._mapping) for row in rows]
+        written += sum(1 for t in batch if attribute_rows(t))
+        write(connection, batch)
+        last_id = rows[-1].id
+    if written:
+        logger.info(f"Indexed attributes of {written} therapists")
+    return written
+
+
+def filter_query(required: Mapping[str, Iterable[str]]) -> Select:
+    """Ids of therapists with at least one of the values of every attribute"""
+    table = TherapistAttribute.__table__
+    selects = [select(table.c.therapist_id).where(
+        table.c.attribute == field, table.c.value.in_(sorted(values)))
+        for field, values in sorted(required.items())]
+    return selects[0] if len(selects) == 1 else intersect(*selects)
+
+
+def candidates_query(required: Mapping[str, Iterable[str]]) -> Select:
+    """Ids of the active therapists among filter_query's"""
+    therapists = Therapist.__table__
+    return select(therapists.c.id).where(
+        therapists.c.id.in_(filter_query(required)), therapists.c.is_active == True)
+
+
+def label_filter(field: str, labels: Iterable[str]) -> Set[str]:
+    """Concept ids a filter on labels (or synonyms like "english") matches"""
+    prefix = f"{vocabulary.FIELD_PREFIXES[field]}:"
+    values = set()
+    for label in labels:
+        values |= label_values(field, label)
+        values.update(c for c in vocabulary.base().concepts(label) if c.startswith(prefix))
+    return values
+
+
+def required(user_answers: List[Dict[str, Any]]) -> Dict[str, Set[str]]:
+    """Attribute values the patient picked that candidates must have"""
+    vocab = vocabulary.base()
+    found: Dict[str, Set[str]] = {}
+    for item in user_answers:
+        answer = item.get("answer")
+        for value in answer if isinstance(answer, list) else [answer]:
+            if not isinstance(value, str) or len(value.split()) > MAX_CHOICE_WORDS:
+                continue
+            for concept in vocab.concepts(value):
+                for field in REQUIRED_FIELDS:
+                    if concept.startswith(f"{vocabulary.FIELD_PREFIXES[field]}:"):
+                        found.setdefault(field, set()).add(concept)
+    return found
+
+
+def candidate_ids(db, user_answers: List[Dict[str, Any]]) -> Optional[Set[str]]:
+    """Ids of the active therapists meeting the patient's requirements; None if there are none to meet
+
+    Always None unless LANGUAGE_HARD_FILTER is on.
+    """
+    if not LANGUAGE_HARD_FILTER:
+        return None
+    requirements = required(user_answers)
+    if not requirements:
+        return None
+    ids = {therapist_id for (therapist_id,) in db.execute(candidates_query(requirements))}
+    if not ids:
+        logger.info(f"No active therapist meets {requirements}, not restricting candidates")
+        return None
+    return ids
@@ -0,0 +1,339 @@
+#!/usr/bin/env python3
+"""
+Weekly availability as 168-bit hour bitmaps.
+
+Therapists describe their schedule in free Spanish text ("Lunes a viernes de
+9:00 AM a 6:00 PM", "Lunes: 09:00-13:00, 15:00-19:00; Sábado: 10:00-14:00").
+parse_schedule turns it into a bitmap with one bit per hour of the week: bit
+day * 24 + hour, Monday = day 0. The bitmap is computed at registration and
+stored in therapists.availability_mask as MASK_BYTES little-endian bytes; an
+empty bitmap means the schedule could not be read.
+
+Patients' availability answers ("Tardes entre semana", "Fines de semana")
+go through the same parser, so overlap is a bitwise AND and a popcount.
+
+Understood, accent- and case-insensitively:
+
+- days, day ranges ("lunes a viernes"), "entre semana", "fines de semana",
+  "todos los días" and exclusions ("excepto miércoles");
+- hour ranges in 24h or am/pm ("09:00-17:00", "9 a 6 pm", "de 2 a 7"),
+  including overnight ones ("de 8 pm a 2 am"), whose hours after midnight
+  fall on the next day;
+- parts of the day ("mañanas", "tardes", "noches", "todo el día").
+
+Days without hours get the whole working day; hours without days apply to
+every day. Plain numbers ("13-17") only count as hours next to a day or a
+part of the day, or after "de", "desde" or "entre", so answers like
+"Adolescentes (13–17)" are ignored.
+
+To compute masks for therapists registered before this existed (also run by
+migrate.py), or to re-parse every schedule after changing the parser:
+
+    python availability.py [--all]
+"""
+
+import argparse
+import logging
+import re
+import sys
+import unicodedata
+from typing import Any, Dict, Iterable, List, Optional, Set, Tuple
+
+logger = logging.getLogger(__name__)
+
+HOURS_PER_DAY = 24
+DAYS_PER_WEEK = 7
+HOURS_PER_WEEK = HOURS_PER_DAY * DAYS_PER_WEEK
+MASK_BYTES = HOURS_PER_WEEK // 8
+WEEK_MASK = (1 << HOURS_PER_WEEK) - 1
+
+# Longest patient answer, in words, read as an availability answer
+MAX_PATIENT_ANSWER_WORDS = 12
+
+DAYS = ["lunes", "martes", "miercoles", "jueves", "viernes", "sabado", "domingo"]
+WEEKDAYS = set(range(5))
+WEEKEND = {5, 6}
+ALL_DAYS = set(range(DAYS_PER_WEEK))
+
+# [start, end) hours of the parts of the day
+DAY_PARTS = {
+    "manana": (8, 12),
+    "mediodia": (12, 14),
+    "tarde": (12, 18),
+    "noche": (18, 22),
+    "todo el dia": (8, 22),
+}
+# Hours assumed for days given without hours
+DEFAULT_HOURS = DAY_PARTS["todo el dia"]
+
+_DAY = (r"(lunes|martes|miercoles|jueves|viernes|sabados?|domingos?"
+        r"|lun|mar|mie|jue|vie|sab|dom)\.?")
+_TIME = r"(?P<h{n}>\d{{1,2}})(?:[:h.](?P<m{n}>\d{{2}}))?\s*(?P<s{n}>am|pm|hrs|hs|h)?\b"
+_TOKEN = re.compile("|".join([
+    rf"\b(?P<dayrange>{_DAY}\s*(?:a|al|hasta|-)\s*(?:el\s+)?{_DAY})\b",
+    r"\b(?P<weekend>fines? de semana)\b",
+    r"\b(?P<weekdays>entre semana|dias (?:laborables|habiles|de semana))\b",
+    r"\b(?P<everyday>todos los dias|toda la semana|diario|diariamente|cualquier dia)\b",
+    rf"\b(?P<day>{_DAY})\b",
+    r"\b(?P<lead>de|desde|entre)\s+(?:las?\s+)?(?=\d)",
+    r"\b(?P<timerange>" + _TIME.format(n=1)
+    + r"\s*(?:-|a|al|hasta|y)\s*(?:las?\s+)?" + _TIME.format(n=2) + ")",
+    r"\b(?P<part>todo el dia|mananas?|mediodia|tardes?|noches?)\b",
+    r"\b(?P<exclude>excepto|menos|salvo|sin)\b",
+]))
+
+
+def _normalize(text: str) -> str:
+    text = unicodedata.normalize("NFKD", text or "")
+    text = "".join(c for c in text if not unicodedata.combining(c)).casefold()
+    text = re.sub("[\u2010-\u2015]", "-", text)
+    # "a. m.", "p.m." -> "am", "pm"
+    return re.sub(r"\b([ap])\.?\s?m\b\.?", r"\1m", text)
+
+
+def _day_index(word: str) -> int:
+    """0-6 for a day name, plural or abbreviation ("sábados", "mié.")"""
+    word = word.rstrip(".")
+    return next(i for i, day in enumerate(DAYS) if day.startswith(word[:3]))
+
+
+def _hour(hour: str, minute: Optional[str], suffix: Optional[str], is_end: bool) -> Optional[int]:
+    """Whole hour a range starts at (floor) or ends at (ceil), or None if invalid"""
+    h, m = int(hour), int(minute or 0)
+    if h > 24 or m >= 60:
+        return None
+    if suffix == "pm" and h < 12:
+        h += 12
+    elif suffix == "am" and h == 12:
+        h = 0
+    elif suffix is None and minute is None and not hour.startswith("0") and 1 <= h <= 7:
+        # "de 2 a 7" means the afternoon
+        h += 12
+    if is_end and m:
+        h += 1
+    return min(h, HOURS_PER_DAY)
+
+
+def _time_range(match: re.Match) -> Optional[Tuple[int, int]]:
+    """[start, end) hours of a range; end is past 24 when it runs into the next day"""
+    s1, s2 = match.group("s1"), match.group("s2")
+    if s2 in ("am", "pm") and s1 is None and int(match.group("h1")) <= int(match.group("h2")):
+        # "2 a 6 pm": the suffix covers both ends
+        s1 = s2
+    start = _hour(match.group("h1"), match.group("m1"), s1, False)
+    end = _hour(match.group("h2"), match.group("m2"), s2, True)
+    if start is None or end is None:
+        return None
+    if end == 0:
+        end = HOURS_PER_DAY  # "hasta las 00:00"
+    if end <= start and s2 is None and end + 12 > start and end + 12 <= HOURS_PER_DAY:
+        end += 12  # "9 a 6"
+    if end <= start:
+        # Overnight, "de 8 pm a 2 am" or "22:00 a 02:00": the end is on the next day
+        end = _hour(match.group("h2"), match.group("m2"), s2 or "h", True)
+        if end >= start:
+            return None
+        end += HOURS_PER_DAY
+    return start, end
+
+
+def _tokens(clause: str) -> List[Tuple[str, Any]]:
+    """("days", set of days) and ("hours", (start, end)) in the order they appear"""
+    tokens = []
+    bare = []  # Indexes of hour ranges given as plain numbers
+    exclude = False
+    lead = False
+    for match in _TOKEN.finditer(clause):
+        # The named alternative encloses every other group, so it closes last
+        kind = match.lastgroup
+        if kind == "exclude":
+            exclude = True
+            continue
+        if kind == "lead":
+            lead = True
+            continue
+        if kind == "timerange":
+            hours = _time_range(match)
+            if hours:
+                if not (lead or any(match.group(g) for g in ("m1", "m2", "s1", "s2"))):
+                    bare.append(len(tokens))
+                tokens.append(("hours", hours))
+        elif kind == "part":
+            word = match.group("part")
+            tokens.append(("hours", DAY_PARTS[word if word == "todo el dia" else word.rstrip("s")]))
+        else:
+            if kind == "dayrange":
+                first, last = re.findall(_DAY, match.group("dayrange"))
+                start, end = _day_index(first), _day_index(last)
+                days = {(start + i) % DAYS_PER_WEEK
+                        for i in range((end - start) % DAYS_PER_WEEK + 1)}
+            elif kind == "weekend":
+                days = set(WEEKEND)
+            elif kind == "weekdays":
+                days = set(WEEKDAYS)
+            elif kind == "everyday":
+                days = set(ALL_DAYS)
+            else:
+                days = {_day_index(match.group("day"))}
+            tokens.append(("exclude" if exclude else "days", days))
+        exclude = lead = False
+    if bare and len(bare) == len(tokens):
+        # Nothing but plain numbers, like "Adolescentes (13–17)"
+        return []
+    return tokens
+
+
+def _groups(tokens: List[Tuple[str, Any]]) -> List[Tuple[str, Any]]:
+    """Merge consecutive tokens of the same kind: ("days", set) / ("hours", [ranges])"""
+    groups: List[Tuple[str, Any]] = []
+    excluded: Set[int] = set()
+    for kind, value in tokens:
+        if kind == "exclude":
+            excluded |= value
+            continue
+        if groups and groups[-1][0] == kind:
+            if kind == "days":
+                groups[-1][1].update(value)
+            else:
+                groups[-1][1].append(value)
+        else:
+            groups.append((kind, set(value) if kind == "days" else [value]))
+    for kind, value in groups:
+        if kind == "days":
+            value -= excluded
+    if excluded and not any(kind == "days" for kind, _ in groups):
+        # "todos menos el domingo" style: exclusions from the whole week
+        groups.insert(0, ("days", ALL_DAYS - excluded))
+    return groups
+
+
+def _pairs(groups: List[Tuple[str, Any]]) -> Iterable[Tuple[Set[int], List[Tuple[int, int]]]]:
+    """(days, hour ranges) pairs described by a clause"""
+    day_groups = [value for kind, value in groups if kind == "days"]
+    if len(day_groups) <= 1:
+        # "Mañanas entre semana (8:00–12:00)": every hour applies to the only days
+        days = day_groups[0] if day_groups else ALL_DAYS
+        hours = [r for kind, value in groups if kind == "hours" for r in value]
+        yield days, hours or [DEFAULT_HOURS]
+        return
+    # Several day groups: each takes the hours on its side, in the clause's order
+    leading = groups[0][0]
+    for i, (kind, value) in enumerate(groups):
+        if kind != leading:
+            continue
+        other = groups[i + 1][1] if i + 1 < len(groups) else None
+        if leading == "days":
+            yield value, other or [DEFAULT_HOURS]
+        else:
+            yield other if other is not None else ALL_DAYS, value
+
+
+def slot_mask(days: Iterable[int], start: int, end: int) -> int:
+    """Bitmap of hours [start, end) on each of days; hours past 24 fall on the next day"""
+    hours = ((1 << (end - start)) - 1) << start
+    mask = 0
+    for day in days:
+        mask |= hours << (day * HOURS_PER_DAY)
+    # Sunday night runs into Monday
+    return (mask | mask >> HOURS_PER_WEEK) & WEEK_MASK
+
+
+def parse_schedule(text: Optional[str]) -> int:
+    """Hour bitmap of a schedule written in Spanish; 0 when nothing in it is understood"""
+    mask = 0
+    for clause in re.split(r"[;\n|]", _normalize(text or "")):
+        groups = _groups(_tokens(clause))
+        if not groups:
+            continue
+        for days, hours in _pairs(groups):
+            for start, end in hours:
+                mask |= slot_mask(days, start, end)
+    return mask
+
+
+def encode(mask: int) -> bytes:
+    return mask.to_bytes(MASK_BYTES, "little")
+
+
+def decode(data: Optional[bytes]) -> int:
+    """Bitmap from the stored bytes; 0 for NULL"""
+    return int.from_bytes(data, "little") if data else 0
+
+
+def encode_schedule(text: Optional[str]) -> Optional[bytes]:
+    """therapists.availability_mask for a weekly_availability text; NULL stays NULL"""
+    return None if text is None else encode(parse_schedule(text))
+
+
+def patient_mask(user_answers: Iterable[Dict[str, Any]]) -> int:
+    """Hours a patient said they are available, from their short text and choice answers"""
+    mask = 0
+    for item in user_answers:
+        answer = item.get("answer")
+        for value in answer if isinstance(answer, list) else [answer]:
+            if isinstance(value, str) and len(value.split()) <= MAX_PATIENT_ANSWER_WORDS:
+                mask |= parse_schedule(value)
+    return mask
+
+
+def overlap_hours(masks: List[int], wanted: int) -> List[int]:
+    """Hours each mask shares with wanted, in one pass over the catalog"""
+    return [(mask & wanted).bit_count() for mask in masks]
+
+
+def backfill_masks(connection, batch_size: int = 1000, reparse: bool = False) -> int:
+    """Parse weekly_availability of therapists without a mask (all with reparse); returns rows updated.
+
+    Registered in migrate.MIGRATIONS. Reads and writes in id order, batch_size rows at a time.
+    """
+    from sqlalchemy import bindparam, select, update
+
+    from database import Therapist
+
+    table = Therapist.__table__
+    query = select(table.c.id, table.c.weekly_availability).where(
+        table.c.weekly_availability.isnot(None)).order_by(table.c.id).limit(batch_size)
+    if not reparse:
+        query = query.where(table.c.availability_mask.is_(None))
+    stmt = update(table).where(table.c.id == bindparam("therapist_id")).values(
+        availability_mask=bindparam("availability_mask"))
+    updated = 0
+    last_id = None
+    while True:
+        batch = query if last_id is None else query.where(table.c.id > last_id)
+        rows = connection.execute(batch).all()
+        if not rows:
+            break
+        connection.execute(stmt, [
+            {"therapist_id": therapist_id, "availability_mask": encode_schedule(text)}
+            for therapist_id, text in rows])
+        updated += len(rows)
+        last_id = rows[-1][0]
+    if updated:
+        logger.info(f"Parsed availability of {updated} therapists")
+    return updated
+
+
+def main(argv=None):
+    """Main function"""
+    import cache_versions
+    from database import engine
+
+    parser = argparse.ArgumentParser(description="Compute therapist availability bitmaps")
+    parser.add_argument("--all", action="store_true",
+                        help="Re-parse every schedule, not only those without a mask")
+    parser.add_argument("--batch-size", type=int, default=1000)
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO)
+    with engine.begin() as connection:
+        updated = backfill_masks(connection, args.batch_size, reparse=args.all)
+        if updated:
+            # Running servers drop their cached catalog
+            cache_versions.bump(connection, "therapists")
+    print(f"✓ Availability parsed for {updated} therapists")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
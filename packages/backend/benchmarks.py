@@ -0,0 +1,208 @@
+#!/usr/bin/env python3
+"""
+Microbenchmarks for the CPU-bound parts of the submit and results paths.
+
+Each benchmark runs against in-memory catalogs of several sizes, without a
+database: ORM-to-dict conversion (therapist_to_dict), TherapistMatch
+construction and get_matches per model, the matches dict build and sort
+(matches_to_dicts) and ComparisonResponse serialization as get_results does
+it, with up to MAX_STORED_MATCHES matches per model. Timings are the best of
+--repeat rounds, per call.
+
+Usage:
+    python benchmarks.py run --save benchmark_results/baseline.json
+    python benchmarks.py compare benchmark_results/baseline.json --tolerance 0.15
+"""
+
+import argparse
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import time
+from datetime import datetime
+from typing import Callable, Dict, List
+
+os.environ.setdefault("GEMINI_API_KEY", "benchmark")
+os.environ["GEMINI_SIMULATED_LATENCY_MS"] = "0"
+
+from fastapi.encoders import jsonable_encoder  # noqa: E402
+
+from database import Therapist, ModelResult  # noqa: E402
+from gemini_service import GeminiMatchingService  # noqa: E402
+from matching import (  # noqa: E402
+    MATCHING_MODELS, build_comparison_response, matches_to_dicts, therapist_to_dict)
+from schemas import TherapistMatch  # noqa: E402
+from synthetic_data import SyntheticData  # noqa: E402
+
+DEFAULT_SIZES = [100, 1000, 10000, 100000]
+MIN_ROUND_SECONDS = 0.05
+MAX_STORED_MATCHES = 1000
+
+
+def make_catalog(size: int, seed: int = 42) -> List[Therapist]:
+    """Transient Therapist rows; attribute access goes through the ORM instrumentation"""
+    data = SyntheticData(seed)
+    return [Therapist(**data.therapist(i)) for i in range(size)]
+
+
+def make_matches(therapist_dicts: List[Dict], seed: int = 42) -> List[TherapistMatch]:
+    rng = random.Random(seed)
+    return [
+        TherapistMatch(
+            id=str(t["id"]), name=t["name"], specialties=t["specialties"],
+            therapeutic_approaches=t["therapeutic_approaches"], session_price=t["session_price"],
+            country=t["country"], city=t["city"], remote=t["remote"], on_site=t["on_site"],
+            bio=t["bio"], match_score=rng.randint(1, 100),
+            match_reason="Especialización en ansiedad y técnicas de CBT coinciden con tus necesidades reportadas",
+            confidence_score=rng.randint(75, 95))
+        for t in therapist_dicts
+    ]
+
+
+def measure(fn: Callable[[], object], repeat: int) -> Dict[str, float]:
+    """Best and median seconds per call over `repeat` rounds of auto-sized loops"""
+    loops = 1
+    while True:
+        started = time.perf_counter()
+        for _ in range(loops):
+            fn()
+        elapsed = time.perf_counter() - started
+        if elapsed >= MIN_ROUND_SECONDS:
+            break
+        loops *= 10
+    rounds = [elapsed / loops]
+    for _ in range(repeat - 1):
+        started = time.perf_counter()
+        for _ in range(loops):
+            fn()
+        rounds.append((time.perf_counter() - started) / loops)
+    rounds.sort()
+    return {"best_seconds": rounds[0], "median_seconds": rounds[len(rounds) // 2], "loops": loops}
+
+
+def benchmarks_for(size: int) -> Dict[str, Callable[[], object]]:
+    catalog = make_catalog(size)
+    therapist_dicts = [therapist_to_dict(t) for t in catalog]
+    matches = make_matches(therapist_dicts)
+    user_answers = [{"question": "q1", "answer": ["Ansiedad y estrés"]}]
+    service = GeminiMatchingService()
+
+    # One stored result per model; results never hold more than a page of matches
+    stored_matches = matches_to_dicts(matches[:MAX_STORED_MATCHES])
+    stored = [ModelResult(model_name=model, matches=stored_matches, processing_time_ms=12.5)
+              for model in MATCHING_MODELS]
+
+    cases = {
+        "therapist_to_dict": lambda: [therapist_to_dict(t) for t in catalog],
+        "therapist_match_construction": lambda: make_matches(therapist_dicts),
+        "matches_to_dicts": lambda: matches_to_dicts(matches),
+        "serialize_comparison_response": lambda: json.dumps(
+            jsonable_encoder(build_comparison_response("bench", stored))),
+    }
+    for model in MATCHING_MODELS:
+        cases[f"get_matches[{model}]"] = (
+            lambda model=model: service.get_matches(therapist_dicts, user_answers, model))
+    return cases
+
+
+def git_revision() -> Dict[str, object]:
+    def git(*args):
+        try:
+            return subprocess.run(["git", *args], capture_output=True, text=True,
+                                  cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+        except OSError:
+            return ""
+    return {"commit": git("rev-parse", "HEAD"), "dirty": bool(git("status", "--porcelain", "--untracked-files=no"))}
+
+
+def run_benchmarks(sizes: List[int], repeat: int, only: str = None) -> Dict[str, object]:
+    results = {}
+    for size in sizes:
+        for name, fn in benchmarks_for(size).items():
+            if only and only not in name:
+                continue
+            key = f"{name}/{size}"
+            results[key] = measure(fn, repeat)
+            print(f"{key:55} {results[key]['best_seconds'] * 1000:>12.4f}ms", flush=True)
+    return {
+        "git": git_revision(),
+        "created_at": datetime.utcnow().isoformat(),
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "repeat": repeat,
+        "results": results,
+    }
+
+
+def run(args) -> int:
+    report = run_benchmarks(args.sizes, args.repeat, args.only)
+    if args.save:
+        os.makedirs(os.path.dirname(os.path.abspath(args.save)), exist_ok=True)
+        with open(args.save, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"Results written to {args.save}")
+    return 0
+
+
+def compare(args) -> int:
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    sizes = sorted({int(key.rsplit("/", 1)[1])
+                   for key in baseline["results"]})
+    current = run_benchmarks(args.sizes or sizes, args.repeat, args.only)
+
+    regressions = []
+    print(f"\n{'benchmark':55} {'baseline':>12} {'current':>12} {'change':>8}")
+    for key, before in baseline["results"].items():
+        after = current["results"].get(key)
+        if after is None:
+            continue
+        change = after["best_seconds"] / before["best_seconds"] - 1
+        flag = ""
+        if change > args.tolerance:
+            regressions.append(key)
+            flag = "  REGRESSION"
+        print(f"{key:55} {before['best_seconds'] * 1000:>10.4f}ms {after['best_seconds'] * 1000:>10.4f}ms {change:>+7.1%}{flag}")
+
+    if regressions:
+        print(
+            f"\n{len(regressions)} benchmark(s) slower than the baseline by more than {args.tolerance:.0%}")
+        return 1
+    return 0
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    def common(p):
+        p.add_argument("--sizes", type=lambda s: [int(x) for x in s.split(",")],
+                       help="Comma-separated catalog sizes (default 100,1000,10000,100000)")
+        p.add_argument("--repeat", type=int, default=5)
+        p.add_argument("--only", help="Run benchmarks whose name contains this")
+
+    p = sub.add_parser("run", help="Run the benchmarks")
+    common(p)
+    p.add_argument("--save", help="Write results as JSON, e.g. a new baseline")
+    p.set_defaults(func=run)
+
+    p = sub.add_parser(
+        "compare", help="Run the benchmarks and fail on regressions against a baseline")
+    p.add_argument("baseline")
+    common(p)
+    p.add_argument("--tolerance", type=float, default=0.15,
+                   help="Allowed relative slowdown before failing")
+    p.set_defaults(func=compare)
+
+    args = parser.parse_args()
+    if args.command == "run" and not args.sizes:
+        args.sizes = DEFAULT_SIZES
+    return args.func(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,111 @@
+"""
+Cross-process cache invalidation through the cache_versions table.
+
+Every process (web workers and matching workers) keeps its own in-memory
+caches. A write that changes cached data calls bump() in the same transaction,
+which increments the cache's row in cache_versions. A poller thread in each
+process reads the whole table every CACHE_VERSION_POLL_SECONDS (one small
+primary-key scan) and invalidates the local caches whose version moved, so
+other processes serve stale data for at most one poll interval.
+"""
+
+import logging
+import os
+import threading
+from datetime import datetime
+from typing import Callable, Dict, List, Optional
+
+from sqlalchemy.dialects import postgresql, sqlite
+
+from database import CacheVersion
+from metrics import REGISTRY
+
+logger = logging.getLogger(__name__)
+
+CACHE_VERSION_POLL_SECONDS = float(
+    os.getenv("CACHE_VERSION_POLL_SECONDS", 1.0))
+
+cache_invalidations_total = REGISTRY.counter(
+    "kuna_cache_invalidations_total", "Cache invalidations by cache and origin", ("cache", "origin"))
+
+_handlers: Dict[str, List[Callable[[], None]]] = {}
+
+
+def register(name: str, invalidate: Callable[[], None]) -> None:
+    """Call invalidate when another process bumps the named cache"""
+    _handlers.setdefault(name, []).append(invalidate)
+
+
+def bump(db, *names: str) -> None:
+    """Increment the version of each named cache; committed with the caller's transaction.
+
+    db may be a Session or a Connection.
+    """
+    dialect = db.get_bind().dialect.name if hasattr(
+        db, "get_bind") else db.dialect.name
+    insert = postgresql.insert if dialect == "postgresql" else sqlite.insert
+    now = datetime.utcnow()
+    for name in names:
+        stmt = insert(CacheVersion.__table__).values(
+            name=name, version=1, updated_at=now)
+        db.execute(stmt.on_conflict_do_update(
+            index_elements=["name"],
+            set_={"version": CacheVersion.__table__.c.version + 1, "updated_at": now}))
+        cache_invalidations_total.inc(cache=name, origin="local")
+
+
+def current(db, name: str) -> int:
+    """Version of the named cache; 0 if it was never bumped"""
+    version = db.query(CacheVersion.version).filter(
+        CacheVersion.name == name).scalar()
+    return version or 0
+
+
+class VersionPoller:
+    def __init__(self, session_factory, interval_seconds: float = CACHE_VERSION_POLL_SECONDS):
+        self.session_factory = session_factory
+        self.interval_seconds = interval_seconds
+        self._seen: Optional[Dict[str, int]] = None
+        self._stop = threading.Event()
+        self._thread = None
+
+    def poll_once(self) -> List[str]:
+        """Invalidate caches whose version changed since the last poll; returns their names"""
+        db = self.session_factory()
+        try:
+            versions = dict(db.query(CacheVersion.name, CacheVersion.version).all())
+        finally:
+            db.close()
+
+        if self._seen is None:
+            # First poll: the caches are loaded after it, nothing is stale yet
+            self._seen = versions
+            return []
+        changed = [name for name, version in versions.items()
+                   if self._seen.get(name, 0) != version]
+        for name in changed:
+            for invalidate in _handlers.get(name, ()):
+                invalidate()
+            cache_invalidations_total.inc(cache=name, origin="remote")
+        self._seen = versions
+        return changed
+
+    def start(self) -> None:
+        """Poll in a daemon thread; call after forking, threads do not survive fork"""
+        if self._thread is not None:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(
+            target=self._run, name="cache-version-poller", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        self._thread = None
+
+    def _run(self):
+        while not self._stop.wait(self.interval_seconds):
+            try:
+                self.poll_once()
+            except Exception as e:
+                logger.warning(f"Cache version poll failed: {str(e)}")
@@ -0,0 +1,138 @@
+"""
+Process-local caches for data read on every request.
+
+The active therapist catalog (as matching dicts, or rows of the shared
+snapshot in columnar_catalog.py) and the questionnaire are loaded once and
+reused until CATALOG_CACHE_TTL_SECONDS pass or the cache is invalidated. Complete session results and known session ids are kept in
+bounded LRUs. Writes invalidate the local copy and bump the cache's version
+(cache_versions.py) so other processes drop theirs too. Cached values are
+shared between requests and must not be mutated.
+"""
+
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, List, Optional
+
+from sqlalchemy.orm import Session
+
+import cache_versions
+import columnar_catalog
+from database import Question, SessionLocal
+
+logger = logging.getLogger(__name__)
+
+CATALOG_CACHE_TTL_SECONDS = float(os.getenv("CATALOG_CACHE_TTL_SECONDS", 60))
+RESULT_CACHE_SIZE = int(os.getenv("RESULT_CACHE_SIZE", 1000))
+KNOWN_SESSION_CACHE_SIZE = int(os.getenv("KNOWN_SESSION_CACHE_SIZE", 100000))
+
+
+class CachedQuery:
+    def __init__(self, name: str, loader: Callable[[Session], Any], ttl_seconds: float = CATALOG_CACHE_TTL_SECONDS):
+        self.name = name
+        self.loader = loader
+        self.ttl_seconds = ttl_seconds
+        self._value = None
+        self._loaded_at: Optional[float] = None
+        self._lock = threading.Lock()
+
+    @property
+    def loaded(self) -> bool:
+        """Whether a value was ever loaded; stays true after invalidation"""
+        return self._value is not None
+
+    def _fresh(self) -> bool:
+        return self._loaded_at is not None and time.monotonic() - self._loaded_at < self.ttl_seconds
+
+    def get(self, db: Session) -> Any:
+        """Cached value, reloaded with db when expired or invalidated"""
+        if self._fresh():
+            return self._value
+        with self._lock:
+            # Another thread may have reloaded while we waited
+            if not self._fresh():
+                started = time.perf_counter()
+                self._value = self.loader(db)
+                self._loaded_at = time.monotonic()
+                logger.debug(
+                    f"Loaded {self.name} cache in {(time.perf_counter() - started) * 1000:.1f}ms")
+            return self._value
+
+    def invalidate(self) -> None:
+        self._loaded_at = None
+
+
+def load_question_dicts(db: Session) -> List[Dict[str, Any]]:
+    """Active questions in display order, as QuestionResponse fields"""
+    questions = db.query(Question).filter(
+        Question.is_active == True).order_by(Question.display_order).all()
+    return [
+        {
+            "id": q.id,
+            "question_text": q.question_text,
+            "question_type": q.question_type,
+            "options": q.options,
+            "display_order": q.display_order,
+            "is_active": q.is_active,
+        }
+        for q in questions
+    ]
+
+
+class LRUCache:
+    """Bounded mapping that evicts the least recently used entry"""
+
+    def __init__(self, name: str, maxsize: int):
+        self.name = name
+        self.maxsize = maxsize
+        self._entries: "OrderedDict[str, Any]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[Any]:
+        with self._lock:
+            value = self._entries.get(key)
+            if value is not None:
+                self._entries.move_to_end(key)
+            return value
+
+    def put(self, key: str, value: Any) -> None:
+        if self.maxsize <= 0:
+            return
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def invalidate(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+
+# Mapped from the shared columnar snapshot when CATALOG_SNAPSHOT_PATH is set
+therapists = CachedQuery("therapists", columnar_catalog.load)
+questions = CachedQuery("questions", load_question_dicts)
+# Responses of sessions whose models have all finished, by session id
+results = LRUCache("results", RESULT_CACHE_SIZE)
+# Session ids known to exist, so selections skip the existence query
+sessions = LRUCache("sessions", KNOWN_SESSION_CACHE_SIZE)
+
+CACHES = [therapists, questions]
+
+for _cache in (therapists, questions, results, sessions):
+    cache_versions.register(_cache.name, _cache.invalidate)
+
+# Started after warm-up in each process (after the fork under gunicorn)
+poller = cache_versions.VersionPoller(SessionLocal)
+
+
+def warm(db: Session) -> None:
+    """Load every cache; used at startup before reporting ready"""
+    for cache in CACHES:
+        cache.get(db)
+
+
+def is_warm() -> bool:
+    return all(cache.loaded for cache in CACHES)
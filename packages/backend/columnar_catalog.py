@@ -0,0 +1,371 @@
+#!/usr/bin/env python3
+"""
+Columnar snapshot of the active therapist catalog, shared between processes.
+
+Without it every web and matching worker holds its own copy of the catalog as
+Python dicts. With CATALOG_SNAPSHOT_PATH set, the catalog is written once to a
+file that each process maps read-only, so they all share its pages:
+
+- numbers (price, coordinates, years of experience) are fixed-width arrays
+- booleans take one byte per therapist
+- list fields (specialties, approaches, languages, styles, age groups) are
+  multi-hot bitmaps over a dictionary of their labels
+- availability bitmaps take availability.MASK_BYTES per therapist
+- strings are an array of offsets into one UTF-8 blob
+
+Columns with missing values also get a null byte per therapist. A JSON header
+describes each column and records the "therapists" cache version
+(cache_versions.py) the snapshot was built at. When a process (re)loads the
+catalog and the snapshot's version is still current it only maps the file, so
+cold workers start without querying the therapists table. Otherwise it loads
+the table and writes a new snapshot under a temporary name, then renames it
+into place: readers see a whole file, old or new, and processes still mapping
+the old one keep reading it until they reload. Writes that skip the version
+bump are picked up once the snapshot is CATALOG_SNAPSHOT_MAX_AGE_SECONDS old.
+
+Rows are read-only mappings with the keys of matching.therapist_to_dict that
+decode a field when it is read. List fields come back in dictionary order,
+without duplicates.
+
+Usage:
+    python columnar_catalog.py    # write the snapshot from the database now
+"""
+
+import argparse
+import array
+import json
+import logging
+import mmap
+import os
+import struct
+import sys
+import time
+from collections.abc import Mapping, Sequence
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from sqlalchemy.orm import Session
+
+import cache_versions
+from availability import MASK_BYTES
+from matching import load_therapist_dicts
+
+logger = logging.getLogger(__name__)
+
+# Empty disables the snapshot; each process then keeps its catalog as dicts
+CATALOG_SNAPSHOT_PATH = os.getenv("CATALOG_SNAPSHOT_PATH", "")
+CATALOG_SNAPSHOT_MAX_AGE_SECONDS = float(
+    os.getenv("CATALOG_SNAPSHOT_MAX_AGE_SECONDS", 3600))
+
+MAGIC = b"KUNACAT\x00"
+FORMAT_VERSION = 1
+# Column data starts at multiples of this, so arrays can be cast in place
+ALIGNMENT = 8
+
+STRING = "string"
+FLOAT = "float"
+INT = "int"
+BOOL = "bool"
+LABELS = "labels"
+BITMAP = "bitmap"
+
+# Fields of matching.therapist_to_dict, in its order
+COLUMNS = [
+    ("id", STRING),
+    ("name", STRING),
+    ("professional_titles", STRING),
+    ("professional_id_number", STRING),
+    ("specialties", LABELS),
+    ("therapeutic_approaches", LABELS),
+    ("session_price", FLOAT),
+    ("country", STRING),
+    ("city", STRING),
+    ("latitude", FLOAT),
+    ("longitude", FLOAT),
+    ("remote", BOOL),
+    ("on_site", BOOL),
+    ("hybrid", BOOL),
+    ("bio", STRING),
+    ("years_experience", INT),
+    ("languages", LABELS),
+    ("therapeutic_style", LABELS),
+    ("age_groups", LABELS),
+    ("weekly_availability", STRING),
+    ("availability_mask", BITMAP),
+    ("commitment_level", STRING),
+    ("additional_info", STRING),
+]
+
+
+def _labels_of(value: Any) -> List[str]:
+    if value is None:
+        return []
+    return [v for v in (value if isinstance(value, list) else [value]) if isinstance(v, str)]
+
+
+def _encode_column(name: str, kind: str, values: List[Any], add: Callable[[bytes], int]) -> Dict[str, Any]:
+    column: Dict[str, Any] = {"name": name, "kind": kind, "nulls": None}
+    if any(v is None for v in values):
+        column["nulls"] = add(bytes(v is None for v in values))
+    if kind == STRING:
+        blobs = [b"" if v is None else str(v).encode("utf-8") for v in values]
+        offsets = array.array("Q", [0])
+        for blob in blobs:
+            offsets.append(offsets[-1] + len(blob))
+        column["offsets"] = add(offsets.tobytes())
+        column["blob"] = add(b"".join(blobs))
+    elif kind == FLOAT:
+        column["data"] = add(array.array("d", [0.0 if v is None else float(v) for v in values]).tobytes())
+    elif kind == INT:
+        column["data"] = add(array.array("q", [0 if v is None else int(v) for v in values]).tobytes())
+    elif kind == BOOL:
+        column["data"] = add(bytes(bool(v) for v in values))
+    elif kind == LABELS:
+        # Dictionary in order of first appearance
+        labels: Dict[str, int] = {}
+        masks = []
+        for value in values:
+            mask = 0
+            for label in _labels_of(value):
+                mask |= 1 << labels.setdefault(label, len(labels))
+            masks.append(mask)
+        width = (len(labels) + 7) // 8
+        column["labels"] = list(labels)
+        column["width"] = width
+        column["data"] = add(b"".join(m.to_bytes(width, "little") for m in masks))
+    elif kind == BITMAP:
+        column["width"] = MASK_BYTES
+        column["data"] = add(b"".join((v or 0).to_bytes(MASK_BYTES, "little") for v in values))
+    else:
+        raise ValueError(f"Unknown column kind: {kind}")
+    return column
+
+
+def encode(therapists: List[Dict[str, Any]], version: int) -> bytes:
+    """Snapshot file contents for therapist dicts at a catalog version"""
+    segments: List[bytes] = []
+    size = 0
+
+    def add(data: bytes) -> int:
+        nonlocal size
+        padding = -size % ALIGNMENT
+        segments.append(b"\0" * padding)
+        offset = size + padding
+        segments.append(data)
+        size = offset + len(data)
+        return offset
+
+    # Offsets are relative to the end of the header, which is aligned too
+    columns = [_encode_column(name, kind, [t.get(name) for t in therapists], add)
+               for name, kind in COLUMNS]
+    header = json.dumps({
+        "format": FORMAT_VERSION,
+        "byteorder": sys.byteorder,
+        "version": version,
+        "created_at": time.time(),
+        "rows": len(therapists),
+        "columns": columns,
+    }, ensure_ascii=False).encode("utf-8")
+    prefix = MAGIC + struct.pack("<I", len(header)) + header
+    prefix += b"\0" * (-len(prefix) % ALIGNMENT)
+    return prefix + b"".join(segments)
+
+
+def write(path: str, therapists: List[Dict[str, Any]], version: int) -> int:
+    """Atomically replace the snapshot at path; returns its size in bytes"""
+    data = encode(therapists, version)
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    temporary = f"{path}.{os.getpid()}.tmp"
+    with open(temporary, "wb") as f:
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+    # Other processes may write the same version; the last complete file wins
+    os.replace(temporary, path)
+    return len(data)
+
+
+class Row(Mapping):
+    """One therapist of a Catalog, read from the mapped columns"""
+
+    __slots__ = ("_catalog", "_index")
+
+    def __init__(self, catalog: "Catalog", index: int):
+        self._catalog = catalog
+        self._index = index
+
+    def __getitem__(self, key: str) -> Any:
+        return self._catalog._readers[key](self._index)
+
+    def __iter__(self):
+        return iter(self._catalog.fields)
+
+    def __len__(self) -> int:
+        return len(self._catalog.fields)
+
+    def __repr__(self) -> str:
+        return f"Row({self['id']!r})"
+
+
+class Catalog(Sequence):
+    """A snapshot file mapped read-only, as a sequence of therapist rows"""
+
+    def __init__(self, path: str):
+        with open(path, "rb") as f:
+            stat = os.fstat(f.fileno())
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        self.identity = (stat.st_dev, stat.st_ino)
+        self.size = stat.st_size
+        buffer = memoryview(self._mmap)
+        if bytes(buffer[:len(MAGIC)]) != MAGIC:
+            raise ValueError("not a catalog snapshot")
+        (length,) = struct.unpack_from("<I", buffer, len(MAGIC))
+        start = len(MAGIC) + 4
+        header = json.loads(bytes(buffer[start:start + length]))
+        if header["format"] != FORMAT_VERSION or header["byteorder"] != sys.byteorder:
+            raise ValueError(f"snapshot format {header['format']} ({header['byteorder']}-endian)")
+        start += length
+        data = buffer[start + (-start % ALIGNMENT):]
+
+        self.version: int = header["version"]
+        self.created_at: float = header["created_at"]
+        self._rows: int = header["rows"]
+        self._readers: Dict[str, Callable[[int], Any]] = {
+            column["name"]: self._reader(data, column) for column in header["columns"]}
+        self.fields: Tuple[str, ...] = tuple(self._readers)
+        # Decoded once: every request looks therapists up by id
+        ids = [self._readers["id"](i) for i in range(self._rows)]
+        self._readers["id"] = ids.__getitem__
+
+    def _reader(self, data: memoryview, column: Dict[str, Any]) -> Callable[[int], Any]:
+        rows = self._rows
+        kind = column["kind"]
+        nulls = None if column["nulls"] is None else data[column["nulls"]:column["nulls"] + rows]
+
+        if kind == STRING:
+            offsets = data[column["offsets"]:column["offsets"] + 8 * (rows + 1)].cast("Q")
+            blob = data[column["blob"]:column["blob"] + (offsets[rows] if rows else 0)]
+
+            def read(i):
+                return str(blob[offsets[i]:offsets[i + 1]], "utf-8")
+        elif kind in (FLOAT, INT):
+            values = data[column["data"]:column["data"] + 8 * rows].cast("d" if kind == FLOAT else "q")
+            read = values.__getitem__
+        elif kind == BOOL:
+            values = data[column["data"]:column["data"] + rows]
+
+            def read(i):
+                return values[i] == 1
+        elif kind in (LABELS, BITMAP):
+            width = column["width"]
+            values = data[column["data"]:column["data"] + width * rows]
+            labels = column.get("labels")
+
+            def read(i):
+                mask = int.from_bytes(values[i * width:(i + 1) * width], "little")
+                if labels is None:
+                    return mask
+                found = []
+                while mask:
+                    low = mask & -mask
+                    found.append(labels[low.bit_length() - 1])
+                    mask ^= low
+                return found
+        else:
+            raise ValueError(f"Unknown column kind: {kind}")
+
+        if nulls is None:
+            return read
+        return lambda i: None if nulls[i] else read(i)
+
+    def __len__(self) -> int:
+        return self._rows
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [Row(self, i) for i in range(*index.indices(self._rows))]
+        if index < 0:
+            index += self._rows
+        if not 0 <= index < self._rows:
+            raise IndexError("catalog index out of range")
+        return Row(self, index)
+
+    def __iter__(self):
+        return (Row(self, i) for i in range(self._rows))
+
+
+# The snapshot this process last mapped
+_current: Optional[Catalog] = None
+
+
+def _open(path: str, version: int) -> Optional[Catalog]:
+    """The snapshot at path if it was built at version and is recent enough"""
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return None
+    catalog = _current
+    if catalog is None or catalog.identity != (stat.st_dev, stat.st_ino):
+        try:
+            catalog = Catalog(path)
+        except (OSError, ValueError, KeyError) as e:
+            logger.warning(f"Unreadable catalog snapshot {path}, rewriting it: {str(e)}")
+            return None
+    if catalog.version != version or time.time() - catalog.created_at > CATALOG_SNAPSHOT_MAX_AGE_SECONDS:
+        return None
+    return catalog
+
+
+def load(db: Session, path: Optional[str] = None) -> Sequence:
+    """The active therapists: from the snapshot when it is current, else from the table"""
+    global _current
+    path = CATALOG_SNAPSHOT_PATH if path is None else path
+    if not path:
+        return load_therapist_dicts(db)
+    # Read before the rows, so a write racing the load leaves an older tag on newer data
+    version = cache_versions.current(db, "therapists")
+    catalog = _open(path, version)
+    if catalog is None:
+        started = time.perf_counter()
+        therapists = load_therapist_dicts(db)
+        try:
+            size = write(path, therapists, version)
+        except OSError as e:
+            logger.warning(f"Could not write catalog snapshot {path}: {str(e)}")
+            return therapists
+        catalog = _open(path, version)
+        if catalog is None:
+            # Replaced by a newer version in the meantime
+            return therapists
+        logger.info(
+            f"Wrote catalog snapshot v{version} ({len(therapists)} therapists, {size // 1024}KB) "
+            f"in {(time.perf_counter() - started) * 1000:.0f}ms")
+    _current = catalog
+    return catalog
+
+
+def main(argv=None):
+    """Main function"""
+    from database import SessionLocal
+
+    parser = argparse.ArgumentParser(description="Write the therapist catalog snapshot")
+    parser.add_argument("--path", default=CATALOG_SNAPSHOT_PATH,
+                        help="Snapshot file (default: CATALOG_SNAPSHOT_PATH)")
+    args = parser.parse_args(argv)
+    if not args.path:
+        print("✗ Set CATALOG_SNAPSHOT_PATH or pass --path")
+        return 1
+
+    logging.basicConfig(level=logging.INFO)
+    db = SessionLocal()
+    try:
+        version = cache_versions.current(db, "therapists")
+        therapists = load_therapist_dicts(db)
+    finally:
+        db.close()
+    size = write(args.path, therapists, version)
+    print(f"✓ Wrote {len(therapists)} therapists to {args.path} ({size // 1024}KB, version {version})")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,37 @@
+"""
+Shared fixtures for the backend tests.
+
+Each test gets its own SQLite database with the current schema, so tests
+never touch the development database or each other's data.
+"""
+
+import os
+import tempfile
+
+import pytest
+
+# Modules read their configuration at import time
+os.environ["DATABASE_URL"] = f"sqlite:///{tempfile.mkdtemp(prefix='kuna-tests-')}/tests.db"
+os.environ.setdefault("GEMINI_API_KEY", "tests")
+
+
+@pytest.fixture
+def engine(tmp_path):
+    from sqlalchemy import create_engine
+
+    from database import Base
+
+    engine = create_engine(f"sqlite:///{tmp_path}/test.db",
+                           connect_args={"check_same_thread": False})
+    Base.metadata.create_all(bind=engine)
+    yield engine
+    engine.dispose()
+
+
+@pytest.fixture
+def db(engine):
+    from sqlalchemy.orm import sessionmaker
+
+    session = sessionmaker(autocommit=False, autoflush=False, bind=engine)()
+    yield session
+    session.close()
@@ -1,4 +1,4 @@
-from sqlalchemy import create_engine, Column, String, Integer, Float, DateTime, Text, Boolean, ForeignKey, JSON
+from sqlalchemy import create_engine, Column, String, Integer, Float, Date, DateTime, Text, Boolean, ForeignKey, JSON, LargeBinary, UniqueConstraint, Index
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker, relationship
 import uuid
@@ -6,6 +6,8 @@ from datetime import datetime
 import os
 from dotenv import load_dotenv
 
+from query_stats import instrument_engine
+
 load_dotenv()
 
 Base = declarative_base()
@@ -27,6 +29,11 @@ class ModelComparison(Base):
 
 class ModelResult(Base):
     __tablename__ = "model_results"
+    # One result per model and session, so re-running a job overwrites it
+    __table_args__ = (
+        UniqueConstraint("comparison_id", "model_name",
+                         name="uq_model_results_comparison_model"),
+    )
 
     id = Column(String, primary_key=True, default=lambda: str(uuid.uuid4()))
     comparison_id = Column(String, ForeignKey("model_comparisons.id"))
@@ -57,6 +64,95 @@ class UserSelection(Base):
         "ModelComparison", back_populates="user_selections")
 
 
+class MatchingJob(Base):
+    __tablename__ = "matching_jobs"
+    __table_args__ = (
+        UniqueConstraint("comparison_id", "model_name",
+                         name="uq_matching_jobs_comparison_model"),
+        Index("ix_matching_jobs_claim", "status", "run_after"),
+    )
+
+    id = Column(String, primary_key=True, default=lambda: str(uuid.uuid4()))
+    comparison_id = Column(String, ForeignKey(
+        "model_comparisons.id"), nullable=False, index=True)
+    model_name = Column(String, nullable=False)
+    # pending, running, done, failed
+    status = Column(String, nullable=False, default="pending")
+    attempts = Column(Integer, nullable=False, default=0)
+    run_after = Column(DateTime, default=datetime.utcnow)
+    lease_owner = Column(String)  # Worker id currently holding the job
+    lease_expires_at = Column(DateTime)
+    heartbeat_at = Column(DateTime)
+    last_error = Column(Text)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    updated_at = Column(DateTime, default=datetime.utcnow)
+
+
+class ModelAllocation(Base):
+    __tablename__ = "model_allocations"
+
+    id = Column(String, primary_key=True, default=lambda: str(uuid.uuid4()))
+    comparison_id = Column(String, ForeignKey(
+        "model_comparisons.id"), nullable=False, index=True)
+    model_name = Column(String, nullable=False)
+    # Probability the allocator had of running this model for the session
+    inclusion_probability = Column(Float, nullable=False)
+    allocated = Column(Boolean, nullable=False)
+    created_at = Column(DateTime, default=datetime.utcnow)
+
+
+class ModelDailyRollup(Base):
+    __tablename__ = "model_daily_rollups"
+
+    day = Column(Date, primary_key=True)
+    model_name = Column(String, primary_key=True)
+    results_count = Column(Integer, nullable=False, default=0)
+    empty_results_count = Column(Integer, nullable=False, default=0)
+    selections_count = Column(Integer, nullable=False, default=0)
+    latency_sum_ms = Column(Float, nullable=False, default=0.0)
+
+
+class ModelLatencyBucket(Base):
+    __tablename__ = "model_latency_buckets"
+
+    day = Column(Date, primary_key=True)
+    model_name = Column(String, primary_key=True)
+    # Index into rollups.LATENCY_BUCKET_BOUNDS_MS
+    bucket = Column(Integer, primary_key=True)
+    count = Column(Integer, nullable=False, default=0)
+
+
+class CacheVersion(Base):
+    """Version counter per cache, bumped by writes so other processes drop stale copies"""
+    __tablename__ = "cache_versions"
+
+    name = Column(String, primary_key=True)
+    version = Column(Integer, nullable=False, default=0)
+    updated_at = Column(DateTime, default=datetime.utcnow)
+
+
+class IdempotencyKey(Base):
+    """Submission key mapped to the session its first request created"""
+    __tablename__ = "idempotency_keys"
+
+    key = Column(String, primary_key=True)
+    comparison_id = Column(String, nullable=False)
+    # pending while the first request runs, done once the session is committed
+    status = Column(String, nullable=False, default="pending")
+    created_at = Column(DateTime, default=datetime.utcnow)
+    expires_at = Column(DateTime, nullable=False, index=True)
+
+
+class ArchivedSession(Base):
+    """Session moved out of the live tables by retention.py, and the file that holds it"""
+    __tablename__ = "archived_sessions"
+
+    id = Column(String, primary_key=True)  # The session's model_comparisons.id
+    path = Column(String, nullable=False)  # Relative to retention.ARCHIVE_DIR
+    created_at = Column(DateTime)  # When the session was created
+    archived_at = Column(DateTime, default=datetime.utcnow)
+
+
 class Question(Base):
     __tablename__ = "questions"
 
@@ -85,6 +181,9 @@ class Therapist(Base):
     price_negotiable = Column(Boolean, default=False)
     country = Column(String)
     city = Column(String)
+    # Coordinates of the city from the bundled gazetteer (geo.py), NULL if unknown
+    latitude = Column(Float)
+    longitude = Column(Float)
     remote = Column(Boolean, default=False)
     on_site = Column(Boolean, default=False)
     hybrid = Column(Boolean, default=False)  # Nueva modalidad híbrida
@@ -94,12 +193,28 @@ class Therapist(Base):
     therapeutic_style = Column(JSON)  # Array of therapeutic styles (up to 2)
     age_groups = Column(JSON)  # Array of age groups they prefer to work with
     weekly_availability = Column(Text)  # Días y horarios aproximados
+    # weekly_availability as a 168-bit hour bitmap (availability.py), NULL if not given
+    availability_mask = Column(LargeBinary)
     commitment_level = Column(String)  # Nivel de compromiso con Kuna
     additional_info = Column(Text)  # Campo libre opcional
     is_active = Column(Boolean, default=True)
     created_at = Column(DateTime, default=datetime.utcnow)
 
 
+class TherapistAttribute(Base):
+    """One vocabulary concept of a therapist's list field (attributes.py)"""
+    __tablename__ = "therapist_attributes"
+    __table_args__ = (
+        # The primary key (attribute, value, therapist_id) serves filters; this serves deletes
+        Index("ix_therapist_attributes_therapist", "therapist_id"),
+    )
+
+    attribute = Column(String, primary_key=True)  # Therapist column, e.g. "languages"
+    value = Column(String, primary_key=True)  # Concept id, e.g. "language:ingles"
+    therapist_id = Column(String, ForeignKey(
+        "therapists.id", ondelete="CASCADE"), primary_key=True)
+
+
 # Database connection (SQLite for development, PostgreSQL for production)
 DATABASE_URL = os.getenv("DATABASE_URL", "sqlite:///./therapist_matching.db")
 
@@ -111,6 +226,9 @@ else:
     engine = create_engine(DATABASE_URL, connect_args={
                            "check_same_thread": False})
 
+# Time every statement for the slow-query log and per-request query stats
+instrument_engine(engine)
+
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
 
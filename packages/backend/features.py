@@ -0,0 +1,220 @@
+"""
+Questionnaire answers as fixed-layout feature vectors.
+
+The active question set is compiled once per version (a hash of the question
+ids, types and options) into an Extractor. extract() turns an answers dict
+into Features with one value per question, in display order:
+
+- single_choice: index of the chosen option
+- multiple_choice: bitmap of the chosen options, so click order does not matter
+- scale: float
+- yes_no: True or False
+- text_input and other types: the text with whitespace collapsed
+
+Choices are matched to options exactly, then accent-, case- and
+punctuation-insensitively. Values that do not fit their question (an
+unknown option, a non-numeric scale) are recorded in Features.errors and kept
+as text in Features.extras with the answers to questions not in the set, so
+nothing the patient sent is lost. Missing answers are None.
+
+Features.key is a hash of the layout and values; idempotency keys and the
+prefilter's per-session cache use it, and user_answers() gives every
+matcher the same decoded answers.
+"""
+
+import hashlib
+import json
+import threading
+import unicodedata
+from collections import OrderedDict
+from typing import Any, Callable, Dict, List, NamedTuple, Optional, Tuple
+
+import vocabulary
+
+# Compiled extractors kept for question sets seen recently
+EXTRACTOR_CACHE_SIZE = 8
+
+YES = {"yes", "si", "true", "1", "verdadero"}
+NO = {"no", "false", "0", "falso"}
+
+
+class Features(NamedTuple):
+    version: str
+    values: Tuple[Any, ...]
+    # (question id, answer) of answers outside the layout, sorted by question id
+    extras: Tuple[Tuple[str, Any], ...]
+    errors: Tuple[str, ...]
+
+    @property
+    def key(self) -> str:
+        """Stable hash of the answers; equal for answers that differ only in form"""
+        canonical = vocabulary.base().canonical
+        payload = json.dumps(
+            [self.version,
+             [canonical(v) if isinstance(v, str) else v for v in self.values],
+             [[q, canonical(v) if isinstance(v, str) else v] for q, v in self.extras]],
+            ensure_ascii=False)
+        return hashlib.sha256(payload.encode()).hexdigest()
+
+
+def question_set_version(questions: List[Dict[str, Any]]) -> str:
+    payload = json.dumps(
+        [[q["id"], q["question_type"], q.get("options") or []] for q in questions],
+        ensure_ascii=False)
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+
+def _text(value: Any) -> Optional[str]:
+    if value is None:
+        return None
+    text = " ".join(unicodedata.normalize("NFC", str(value)).split())
+    return text or None
+
+
+class Extractor:
+    def __init__(self, questions: List[Dict[str, Any]]):
+        self.questions = sorted(questions, key=lambda q: q.get("display_order") or 0)
+        self.version = question_set_version(self.questions)
+        self.positions = {q["id"]: i for i, q in enumerate(self.questions)}
+        self._decoders: List[Callable[[Any, List[str], List[Any]], Any]] = [
+            self._decoder(q) for q in self.questions]
+
+    def _decoder(self, question: Dict[str, Any]) -> Callable[[Any, List[str], List[Any]], Any]:
+        """Function(answer, errors, unfit) -> value for one question, built once per version
+
+        Errors get a message and unfit the part of the answer that did not fit.
+        """
+        question_id = question["id"]
+        question_type = question["question_type"]
+        options = question.get("options") or []
+        exact = {option: i for i, option in enumerate(options)}
+        folded = {vocabulary.fold(option): i for i, option in enumerate(options)}
+
+        def option_index(choice: Any, errors: List[str], unfit: List[Any]) -> Optional[int]:
+            if isinstance(choice, str):
+                index = exact.get(choice)
+                if index is None:
+                    index = folded.get(vocabulary.fold(choice))
+                if index is not None:
+                    return index
+            errors.append(f"{question_id}: {choice!r} is not an option")
+            unfit.append(choice)
+            return None
+
+        if question_type == "single_choice" and options:
+            def decode(answer, errors, unfit):
+                if isinstance(answer, list) and len(answer) == 1:
+                    answer = answer[0]
+                return option_index(answer, errors, unfit)
+        elif question_type == "multiple_choice" and options:
+            def decode(answer, errors, unfit):
+                mask = 0
+                for choice in answer if isinstance(answer, list) else [answer]:
+                    index = option_index(choice, errors, unfit)
+                    if index is not None:
+                        mask |= 1 << index
+                return mask
+        elif question_type == "scale":
+            def decode(answer, errors, unfit):
+                try:
+                    return float(answer)
+                except (TypeError, ValueError):
+                    errors.append(f"{question_id}: {answer!r} is not a number")
+                    unfit.append(answer)
+                    return None
+        elif question_type == "yes_no":
+            def decode(answer, errors, unfit):
+                if isinstance(answer, bool):
+                    return answer
+                word = vocabulary.fold(str(answer))
+                if word in YES or word in NO:
+                    return word in YES
+                errors.append(f"{question_id}: {answer!r} is not yes or no")
+                unfit.append(answer)
+                return None
+        else:
+            def decode(answer, errors, unfit):
+                if isinstance(answer, list):
+                    return _text(", ".join(str(a) for a in answer))
+                return _text(answer)
+        return decode
+
+    def extract(self, answers: Dict[str, Any]) -> Features:
+        values: List[Any] = [None] * len(self.questions)
+        extras = {}
+        errors: List[str] = []
+        for question_id, answer in answers.items():
+            if answer in (None, "", []):
+                continue
+            position = self.positions.get(question_id)
+            if position is None:
+                extras[str(question_id)] = answer
+                continue
+            unfit: List[Any] = []
+            values[position] = self._decoders[position](answer, errors, unfit)
+            if unfit:
+                # Keep what did not fit, e.g. a free-text "other" option
+                extras[question_id] = unfit if isinstance(answer, list) else unfit[0]
+        return Features(self.version, tuple(values),
+                        tuple(sorted((q, _normalize_extra(a)) for q, a in extras.items())),
+                        tuple(errors))
+
+    def user_answers(self, features: Features) -> List[Dict[str, Any]]:
+        """Decoded answers in display order, as the matchers take them"""
+        decoded = []
+        for question, value in zip(self.questions, features.values):
+            if value is None:
+                continue
+            options = question.get("options") or []
+            question_type = question["question_type"]
+            if question_type == "single_choice" and options:
+                value = options[value]
+            elif question_type == "multiple_choice" and options:
+                value = [o for i, o in enumerate(options) if value >> i & 1]
+                if not value:
+                    continue
+            elif question_type == "yes_no":
+                value = "yes" if value else "no"
+            decoded.append({"question": question["id"], "answer": value})
+        decoded.extend({"question": q, "answer": a} for q, a in features.extras)
+        return decoded
+
+
+def _normalize_extra(answer: Any) -> Any:
+    if isinstance(answer, list):
+        return sorted((_normalize_extra(a) for a in answer), key=lambda a: json.dumps(a, ensure_ascii=False))
+    if isinstance(answer, dict):
+        return {str(k): _normalize_extra(v) for k, v in sorted(answer.items())}
+    if isinstance(answer, str):
+        return _text(answer)
+    return answer
+
+
+_lock = threading.Lock()
+_extractors: "OrderedDict[str, Extractor]" = OrderedDict()
+# The question list last compiled; catalog_cache hands out the same list until it reloads
+_last: Tuple[Optional[list], Optional[Extractor]] = (None, None)
+
+
+def extractor(questions: List[Dict[str, Any]]) -> Extractor:
+    """The compiled extractor for a question set, compiled once per version"""
+    global _last
+    last_questions, last = _last
+    if last_questions is questions:
+        return last
+    version = question_set_version(sorted(questions, key=lambda q: q.get("display_order") or 0))
+    with _lock:
+        compiled = _extractors.get(version)
+        if compiled is None:
+            compiled = _extractors[version] = Extractor(questions)
+            while len(_extractors) > EXTRACTOR_CACHE_SIZE:
+                _extractors.popitem(last=False)
+        _extractors.move_to_end(version)
+        _last = (questions, compiled)
+    return compiled
+
+
+def extract(questions: List[Dict[str, Any]], answers: Dict[str, Any]) -> Tuple[Extractor, Features]:
+    """Features of answers to the given question set, with the extractor that decodes them"""
+    compiled = extractor(questions)
+    return compiled, compiled.extract(answers)
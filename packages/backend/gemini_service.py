@@ -1,14 +1,20 @@
-import google.generativeai as genai
+import functools
 import json
 import time
 import random
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Optional, Set
 from schemas import TherapistMatch
+from metrics import model_fallbacks_total
+from prefilter import LOCAL_MODEL, rank
 import os
 from dotenv import load_dotenv
 
 load_dotenv()
 
+# Artificial delay for the stubbed Gemini models, for load tests (loadtest.py)
+GEMINI_SIMULATED_LATENCY_MS = float(
+    os.getenv("GEMINI_SIMULATED_LATENCY_MS", 0))
+
 
 class GeminiMatchingService:
     def __init__(self):
@@ -17,7 +23,8 @@ class GeminiMatchingService:
             raise ValueError(
                 "GEMINI_API_KEY not found in environment variables")
 
-        genai.configure(api_key=self.api_key)
+        # The SDK is slow to import; see the genai property
+        self._genai = None
 
         self.base_prompt = """
         Match patients with therapists based on their needs.
@@ -30,12 +37,24 @@ class GeminiMatchingService:
         IMPORTANT: Include a confidence_score (1-100) indicating how confident you are in this match.
         """
 
-    def get_matches(self, therapists: List[Dict], user_answers: List[Dict], model_name: str, limit: int = 1) -> List[TherapistMatch]:
+    @property
+    def genai(self):
+        """google.generativeai, imported and configured on first use"""
+        if self._genai is None:
+            import google.generativeai as genai
+            genai.configure(api_key=self.api_key)
+            self._genai = genai
+        return self._genai
+
+    def get_matches(self, therapists: List[Dict], user_answers: List[Dict], model_name: str, limit: int = 1,
+                    candidate_ids: Optional[Set[str]] = None) -> List[TherapistMatch]:
         start_time = time.time()
 
         if model_name == "random":
             # Random matching as control - always return only 1 therapist
             matches = self._get_random_matches(therapists, 1)
+        elif model_name == LOCAL_MODEL:
+            matches = self._get_local_matches(therapists, user_answers, 1, candidate_ids)
         else:
             # Use Gemini model - always return only 1 therapist
             matches = self._get_gemini_matches(
@@ -72,6 +91,28 @@ class GeminiMatchingService:
 
         return matches
 
+    def _get_local_matches(self, therapists: List[Dict], user_answers: List[Dict], limit: int,
+                           candidate_ids: Optional[Set[str]] = None) -> List[TherapistMatch]:
+        """Best therapists by the local score (location, topics, hours and bio text), no API call"""
+        return [
+            TherapistMatch(
+                id=str(therapist['id']),
+                name=therapist['name'],
+                specialties=therapist['specialties'],
+                therapeutic_approaches=therapist['therapeutic_approaches'],
+                session_price=therapist['session_price'],
+                country=therapist['country'],
+                city=therapist['city'],
+                remote=therapist['remote'],
+                on_site=therapist['on_site'],
+                bio=therapist['bio'],
+                match_score=round(score * 100, 1),
+                match_reason="Coincidencia en temas, modalidad, horarios y perfil con tus respuestas",
+                confidence_score=None  # The local score is not calibrated
+            )
+            for therapist, score in rank(therapists, user_answers, limit, candidate_ids=candidate_ids)
+        ] if therapists else []
+
     def _get_gemini_matches(self, therapists: List[Dict], user_answers: List[Dict], model_name: str, limit: int) -> List[TherapistMatch]:
         """Get matches using Gemini model - always returns exactly 1 therapist"""
         try:
@@ -81,6 +122,9 @@ class GeminiMatchingService:
             if not therapists:
                 return []
 
+            if GEMINI_SIMULATED_LATENCY_MS:
+                time.sleep(GEMINI_SIMULATED_LATENCY_MS / 1000)
+
             # Select exactly 1 therapist for consistency
             selected_therapists = random.sample(
                 therapists, min(1, len(therapists)))
@@ -129,6 +173,7 @@ class GeminiMatchingService:
 
         except Exception as e:
             print(f"Error with Gemini model {model_name}: {str(e)}")
+            model_fallbacks_total.inc(model=model_name)
             # Fallback to random matches if anything fails - still only 1 therapist
             return self._get_random_matches(therapists, 1)
 
@@ -139,3 +184,9 @@ class GeminiMatchingService:
             "gemini-2.5-flash",
             "random"  # Control group
         ]
+
+
+@functools.lru_cache(maxsize=1)
+def get_matching_service() -> GeminiMatchingService:
+    """Shared matching service, created on first use"""
+    return GeminiMatchingService()
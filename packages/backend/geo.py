@@ -0,0 +1,342 @@
+"""
+Offline geocoding and distance queries for location matching.
+
+Cities are resolved against gazetteer.csv, bundled with the backend, so no
+geocoding service is ever called. Names are compared accent-, case- and
+punctuation-insensitively and through aliases, so "CDMX", "Ciudad de Mexico"
+and "ciudad de méxico" resolve to the same place. When a name exists in
+several countries ("Valencia", "Córdoba") the country decides: the
+therapist's country field, "Valencia, España", or for patients a country
+named in their answers. A name that is still ambiguous resolves to nothing
+rather than to a guess, and neither does a city the given country does not
+have.
+
+SpatialIndex is a KD-tree over the 3D (ECEF) positions of the on-site and
+hybrid therapists that have coordinates. Straight-line distance in 3D grows
+monotonically with great-circle distance, so "within X km" and "nearest k"
+are answered by the tree in logarithmic time per result, without the
+distortions of latitude/longitude near the poles or the antimeridian.
+"""
+
+import csv
+import functools
+import heapq
+import logging
+import math
+import os
+import re
+import unicodedata
+from typing import Any, Dict, Iterable, List, NamedTuple, Optional, Sequence, Set, Tuple
+
+logger = logging.getLogger(__name__)
+
+GAZETTEER_PATH = os.getenv("GAZETTEER_PATH", os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), "gazetteer.csv"))
+
+EARTH_RADIUS_KM = 6371.0088
+
+# Normalized country spellings and codes mapped to the normalized gazetteer country
+COUNTRY_ALIASES = {
+    "mx": "mexico", "mex": "mexico",
+    "ec": "ecuador",
+    "co": "colombia", "col": "colombia",
+    "pe": "peru",
+    "ar": "argentina", "arg": "argentina",
+    "cl": "chile",
+    "ve": "venezuela",
+    "bo": "bolivia",
+    "uy": "uruguay",
+    "py": "paraguay",
+    "cr": "costa rica",
+    "pa": "panama",
+    "gt": "guatemala",
+    "sv": "el salvador",
+    "hn": "honduras",
+    "ni": "nicaragua",
+    "rd": "republica dominicana", "do": "republica dominicana",
+    "pr": "puerto rico",
+    "cu": "cuba",
+    "es": "espana", "spain": "espana",
+    "eeuu": "estados unidos", "ee uu": "estados unidos", "usa": "estados unidos",
+    "us": "estados unidos", "united states": "estados unidos",
+}
+
+# Longest place name, in words, looked for in free text
+_MAX_NAME_WORDS = 6
+
+
+def normalize_place(text: str) -> str:
+    """Lowercase, strip accents and punctuation, collapse whitespace"""
+    text = unicodedata.normalize("NFKD", text or "")
+    text = "".join(c for c in text if not unicodedata.combining(c))
+    text = re.sub(r"[^\w\s]", " ", text.casefold())
+    return " ".join(text.split())
+
+
+def normalize_country(country: Optional[str]) -> str:
+    key = normalize_place(country or "")
+    return COUNTRY_ALIASES.get(key, key)
+
+
+class Place(NamedTuple):
+    name: str
+    country: str
+    lat: float
+    lon: float
+
+
+def haversine_km(lat1: float, lon1: float, lat2: float, lon2: float) -> float:
+    """Great-circle distance in km"""
+    phi1, phi2 = math.radians(lat1), math.radians(lat2)
+    dphi = phi2 - phi1
+    dlambda = math.radians(lon2 - lon1)
+    a = math.sin(dphi / 2) ** 2 + math.cos(phi1) * \
+        math.cos(phi2) * math.sin(dlambda / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * math.asin(min(1.0, math.sqrt(a)))
+
+
+def to_ecef(lat: float, lon: float) -> Tuple[float, float, float]:
+    """Position on a spherical Earth in km, centered at the Earth's center"""
+    phi, lam = math.radians(lat), math.radians(lon)
+    return (EARTH_RADIUS_KM * math.cos(phi) * math.cos(lam),
+            EARTH_RADIUS_KM * math.cos(phi) * math.sin(lam),
+            EARTH_RADIUS_KM * math.sin(phi))
+
+
+def _chord_km(arc_km: float) -> float:
+    """Straight-line distance between two points arc_km apart on the surface"""
+    return 2 * EARTH_RADIUS_KM * math.sin(min(math.pi / 2, arc_km / (2 * EARTH_RADIUS_KM)))
+
+
+def _arc_km(chord_km: float) -> float:
+    return 2 * EARTH_RADIUS_KM * math.asin(min(1.0, chord_km / (2 * EARTH_RADIUS_KM)))
+
+
+class Gazetteer:
+    def __init__(self, places: Iterable[Tuple[Place, Sequence[str]]]):
+        self.places: List[Place] = []
+        self._by_name: Dict[str, List[Place]] = {}
+        # Normalized names of the countries with places
+        self.countries: Set[str] = set()
+        for place, aliases in places:
+            self.places.append(place)
+            self.countries.add(normalize_place(place.country))
+            for name in (place.name, *aliases):
+                key = normalize_place(name)
+                if key:
+                    self._by_name.setdefault(key, []).append(place)
+
+    @classmethod
+    def load(cls, path: str = GAZETTEER_PATH) -> "Gazetteer":
+        """Read name,country,lat,lon,aliases rows; aliases are separated by |"""
+        with open(path, encoding="utf-8", newline="") as f:
+            rows = list(csv.DictReader(f))
+        return cls(
+            (Place(row["name"], row["country"], float(row["lat"]), float(row["lon"])),
+             [a for a in (row.get("aliases") or "").split("|") if a])
+            for row in rows
+        )
+
+    def lookup(self, city: Optional[str], country: Optional[str] = None) -> Optional[Place]:
+        """The place a therapist's or patient's city refers to, or None"""
+        key = normalize_place(city or "")
+        if not key:
+            return None
+        candidates = self._by_name.get(key)
+        if not candidates:
+            # "Quito, Ecuador" or "Guadalajara Jalisco"
+            head = normalize_place((city or "").split(",")[0])
+            candidates = self._by_name.get(head) or self._longest_prefix(key)
+        if not candidates:
+            return None
+        # "Valencia, España" names its country
+        return self._pick(candidates, country or self.find_country(city))
+
+    def _pick(self, candidates: List[Place], country: Optional[str]) -> Optional[Place]:
+        """The candidate in country; without one, the only candidate country or None"""
+        wanted = normalize_country(country)
+        if wanted in self.countries:
+            for place in candidates:
+                if normalize_place(place.country) == wanted:
+                    return place
+            return None
+        if len({place.country for place in candidates}) > 1:
+            return None
+        return candidates[0]
+
+    def find_country(self, text: str) -> Optional[str]:
+        """Normalized name of a gazetteer country named in free text, or None"""
+        words = normalize_place(text).split()
+        for start in range(len(words)):
+            for n in range(min(_MAX_NAME_WORDS, len(words) - start), 0, -1):
+                name = " ".join(words[start:start + n])
+                # Two-letter codes like "es" or "co" are common words
+                country = COUNTRY_ALIASES.get(name) if len(name) > 2 else None
+                if (country or name) in self.countries:
+                    return country or name
+        return None
+
+    def _longest_prefix(self, key: str) -> Optional[List[Place]]:
+        words = key.split()
+        for n in range(min(len(words), _MAX_NAME_WORDS), 0, -1):
+            candidates = self._by_name.get(" ".join(words[:n]))
+            if candidates:
+                return candidates
+        return None
+
+    def find_in_text(self, text: str, country: Optional[str] = None) -> Optional[Place]:
+        """First place named in free text that is not ambiguous, preferring longer names"""
+        words = normalize_place(text).split()
+        for start in range(len(words)):
+            for n in range(min(_MAX_NAME_WORDS, len(words) - start), 0, -1):
+                candidates = self._by_name.get(" ".join(words[start:start + n]))
+                if candidates:
+                    place = self._pick(candidates, country)
+                    if place:
+                        return place
+        return None
+
+
+@functools.lru_cache(maxsize=1)
+def gazetteer() -> Gazetteer:
+    """The bundled gazetteer, loaded on first use"""
+    return Gazetteer.load()
+
+
+def coordinates(city: Optional[str], country: Optional[str]) -> Tuple[Optional[float], Optional[float]]:
+    """(latitude, longitude) of a city, or (None, None) when it is not in the gazetteer or ambiguous"""
+    place = gazetteer().lookup(city, country)
+    if place is None:
+        return None, None
+    return place.lat, place.lon
+
+
+class KDTree:
+    """Static 3-d tree over points; items are returned with their distance"""
+
+    def __init__(self, points: Sequence[Tuple[float, float, float]], items: Sequence[Any]):
+        self._points = list(points)
+        self._items = list(items)
+        # Node i splits on axis _axes[i]; the tree is stored in the permuted order
+        self._order = list(range(len(self._points)))
+        self._axes = [0] * len(self._points)
+        self._build(0, len(self._order), 0)
+
+    def __len__(self) -> int:
+        return len(self._points)
+
+    def _build(self, lo: int, hi: int, depth: int) -> None:
+        if hi - lo <= 1:
+            if hi > lo:
+                self._axes[lo] = depth % 3
+            return
+        axis = depth % 3
+        self._order[lo:hi] = sorted(
+            self._order[lo:hi], key=lambda i: self._points[i][axis])
+        mid = (lo + hi) // 2
+        self._axes[mid] = axis
+        self._build(lo, mid, depth + 1)
+        self._build(mid + 1, hi, depth + 1)
+
+    def within(self, point: Tuple[float, float, float], radius: float) -> List[Tuple[Any, float]]:
+        """Items within radius (straight-line) of point, with their distance"""
+        found = []
+        radius_sq = radius * radius
+        stack = [(0, len(self._order))]
+        while stack:
+            lo, hi = stack.pop()
+            if lo >= hi:
+                continue
+            mid = (lo + hi) // 2
+            index = self._order[mid]
+            p = self._points[index]
+            d_sq = (p[0] - point[0]) ** 2 + \
+                (p[1] - point[1]) ** 2 + (p[2] - point[2]) ** 2
+            if d_sq <= radius_sq:
+                found.append((self._items[index], math.sqrt(d_sq)))
+            diff = point[self._axes[mid]] - p[self._axes[mid]]
+            if diff <= radius:
+                stack.append((lo, mid))
+            if diff >= -radius:
+                stack.append((mid + 1, hi))
+        return found
+
+    def nearest(self, point: Tuple[float, float, float], k: int) -> List[Tuple[Any, float]]:
+        """The k items closest to point, nearest first"""
+        heap: List[Tuple[float, int]] = []  # max-heap of (-d_sq, index)
+
+        def visit(lo: int, hi: int):
+            if lo >= hi:
+                return
+            mid = (lo + hi) // 2
+            index = self._order[mid]
+            p = self._points[index]
+            d_sq = (p[0] - point[0]) ** 2 + \
+                (p[1] - point[1]) ** 2 + (p[2] - point[2]) ** 2
+            if len(heap) < k:
+                heapq.heappush(heap, (-d_sq, index))
+            elif d_sq < -heap[0][0]:
+                heapq.heapreplace(heap, (-d_sq, index))
+            diff = point[self._axes[mid]] - p[self._axes[mid]]
+            near, far = ((lo, mid), (mid + 1, hi)) if diff < 0 else (
+                (mid + 1, hi), (lo, mid))
+            visit(*near)
+            if len(heap) < k or diff * diff < -heap[0][0]:
+                visit(*far)
+
+        if k > 0:
+            visit(0, len(self._order))
+        return [(self._items[i], math.sqrt(-d)) for d, i in sorted(heap, reverse=True)]
+
+
+class SpatialIndex:
+    """Therapists who see patients in person, indexed by location"""
+
+    def __init__(self, therapists: Iterable[Dict[str, Any]]):
+        located = [t for t in therapists
+                   if (t.get("on_site") or t.get("hybrid"))
+                   and t.get("latitude") is not None and t.get("longitude") is not None]
+        self._tree = KDTree(
+            [to_ecef(t["latitude"], t["longitude"]) for t in located], located)
+
+    def __len__(self) -> int:
+        return len(self._tree)
+
+    def within_km(self, lat: float, lon: float, radius_km: float) -> List[Tuple[Dict[str, Any], float]]:
+        """Therapists within radius_km of a point, with their distance in km"""
+        return [(t, _arc_km(chord)) for t, chord in
+                self._tree.within(to_ecef(lat, lon), _chord_km(radius_km))]
+
+    def nearest(self, lat: float, lon: float, k: int) -> List[Tuple[Dict[str, Any], float]]:
+        """The k closest therapists with their distance in km, nearest first"""
+        return [(t, _arc_km(chord)) for t, chord in self._tree.nearest(to_ecef(lat, lon), k)]
+
+
+def backfill_coordinates(connection, batch_size: int = 1000) -> int:
+    """Geocode therapists whose coordinates are missing or out of date; returns rows updated.
+
+    Registered in migrate.MIGRATIONS. Also corrects coordinates resolved
+    before the country decided between places of the same name; cities not
+    in the gazetteer, or still ambiguous, are NULL.
+    """
+    from sqlalchemy import bindparam, select, update
+
+    from database import Therapist
+
+    table = Therapist.__table__
+    rows = connection.execute(
+        select(table.c.id, table.c.city, table.c.country, table.c.latitude, table.c.longitude)
+        .where(table.c.city.isnot(None))).all()
+    updates = []
+    for therapist_id, city, country, latitude, longitude in rows:
+        lat, lon = coordinates(city, country)
+        if (lat, lon) != (latitude, longitude):
+            updates.append({"therapist_id": therapist_id,
+                           "latitude": lat, "longitude": lon})
+    stmt = update(table).where(table.c.id == bindparam("therapist_id")).values(
+        latitude=bindparam("latitude"), longitude=bindparam("longitude"))
+    for start in range(0, len(updates), batch_size):
+        connection.execute(stmt, updates[start:start + batch_size])
+    if updates:
+        logger.info(f"Geocoded {len(updates)} therapists")
+    return len(updates)
@@ -0,0 +1,31 @@
+"""
+Gunicorn settings for serving the API with several worker processes.
+
+The app is imported once in the master (preload_app) and forked, so workers
+share the imported code pages. Each worker runs its own lifespan: it warms its
+caches and starts its cache-version poller after the fork (see
+cache_versions.py). Metrics, admission limits and caches are per process, so
+/metrics shows the worker that answered the scrape.
+
+Usage:
+    gunicorn -c gunicorn.conf.py main:app
+"""
+
+import multiprocessing
+import os
+
+bind = f"0.0.0.0:{os.getenv('PORT', '8000')}"
+workers = int(os.getenv("WEB_CONCURRENCY", multiprocessing.cpu_count()))
+worker_class = "uvicorn.workers.UvicornWorker"
+preload_app = True
+# Inline matching can wait on Gemini for a while
+timeout = int(os.getenv("GUNICORN_TIMEOUT", 120))
+graceful_timeout = 30
+keepalive = 5
+accesslog = "-"
+
+
+def post_fork(server, worker):
+    # Connections opened by the master must not be shared with the children
+    from database import engine
+    engine.dispose(close=False)
@@ -0,0 +1,274 @@
+"""
+Idempotent questionnaire submission.
+
+A submission is identified by its Idempotency-Key header, or, without one, by
+a hash of the email and the normalized answers; hashed keys only live for
+IDEMPOTENCY_WINDOW_SECONDS so a patient can deliberately retake the
+questionnaire later. The first request claims the key by inserting it into
+idempotency_keys and runs the models; repeats get the session it created.
+Duplicates that arrive while the first request is still running wait for it
+(on a future in the same process, by polling the row across processes)
+instead of starting their own run. A first request that fails releases the
+key. When its client disconnects, the submission still runs to the end and
+the key stays pending until it does, so a retry waits for it instead of
+running the models again. A key left pending by a crashed process can be
+taken over after IDEMPOTENCY_PENDING_TIMEOUT_SECONDS. The key's queries run
+in the default executor with sessions of their own, off the event loop.
+Expired keys are deleted in batches.
+"""
+
+import asyncio
+import contextvars
+import hashlib
+import json
+import logging
+import os
+import time
+import uuid
+from datetime import datetime, timedelta
+from typing import Any, Awaitable, Callable, Dict, Optional, Set, Tuple
+
+from sqlalchemy import and_, or_, update
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+
+import features
+import vocabulary
+from database import IdempotencyKey
+from metrics import idempotent_submissions_total
+
+logger = logging.getLogger(__name__)
+
+IDEMPOTENCY_KEY_TTL_SECONDS = int(
+    os.getenv("IDEMPOTENCY_KEY_TTL_SECONDS", 24 * 3600))
+IDEMPOTENCY_WINDOW_SECONDS = int(os.getenv("IDEMPOTENCY_WINDOW_SECONDS", 600))
+IDEMPOTENCY_PENDING_TIMEOUT_SECONDS = int(
+    os.getenv("IDEMPOTENCY_PENDING_TIMEOUT_SECONDS", 300))
+IDEMPOTENCY_WAIT_SECONDS = float(os.getenv("IDEMPOTENCY_WAIT_SECONDS", 60))
+IDEMPOTENCY_CLEANUP_BATCH_SIZE = int(
+    os.getenv("IDEMPOTENCY_CLEANUP_BATCH_SIZE", 1000))
+
+PENDING = "pending"
+DONE = "done"
+
+# Futures of submissions running in this process, by key
+_in_flight: Dict[str, asyncio.Future] = {}
+# Settling tasks outliving a cancelled run_once, kept from garbage collection
+_settling: Set[asyncio.Task] = set()
+
+
+class StillProcessing(Exception):
+    """Raised when a duplicate gave up waiting for the first request"""
+
+    def __init__(self, retry_after: int):
+        super().__init__(
+            f"Duplicate submission still processing, retry after {retry_after}s")
+        self.retry_after = retry_after
+
+
+def _normalize(value: Any) -> Any:
+    if isinstance(value, str):
+        # "CBT" and "Terapia Cognitivo-Conductual (CBT)" are the same answer
+        return vocabulary.base().canonical(value)
+    if isinstance(value, dict):
+        normalized = {str(k): _normalize(v) for k, v in value.items()}
+        return {k: v for k, v in normalized.items() if v not in (None, "", [])}
+    if isinstance(value, (list, tuple)):
+        # Multi-select answers do not depend on click order
+        return sorted((_normalize(v) for v in value), key=lambda v: json.dumps(v, sort_keys=True))
+    return value
+
+
+def normalize_answers(answers: Dict[str, Any]) -> Dict[str, Any]:
+    """Answers as vocabulary concept ids or folded text, without option order or empty answers"""
+    return _normalize(answers)
+
+
+def submission_key(header_key: Optional[str], email: str, answers: Dict[str, Any],
+                   answer_features: Optional[features.Features] = None) -> Tuple[str, int]:
+    """Key identifying a submission and how long it is kept, in seconds
+
+    With answer_features, answers are compared by their features key, the same
+    encoding the matchers use.
+    """
+    email = email.strip().casefold()
+    if header_key:
+        # Scoped by email so two clients cannot collide on a key
+        digest = hashlib.sha256(
+            f"{email}\n{header_key.strip()}".encode()).hexdigest()
+        return f"key:{digest}", IDEMPOTENCY_KEY_TTL_SECONDS
+    if answer_features is not None:
+        payload = answer_features.key
+    else:
+        payload = json.dumps(normalize_answers(answers),
+                             sort_keys=True, ensure_ascii=False)
+    digest = hashlib.sha256(f"{email}\n{payload}".encode()).hexdigest()
+    return f"answers:{digest}", IDEMPOTENCY_WINDOW_SECONDS
+
+
+def claim(db: Session, key: str, comparison_id: str, ttl_seconds: int) -> Tuple[bool, str]:
+    """Try to own the key for comparison_id.
+
+    Returns (True, comparison_id) when this request should run the submission,
+    or (False, id of the session that owns the key).
+    """
+    now = datetime.utcnow()
+    expires_at = now + timedelta(seconds=ttl_seconds)
+    try:
+        db.add(IdempotencyKey(key=key, comparison_id=comparison_id, status=PENDING,
+                              created_at=now, expires_at=expires_at))
+        db.commit()
+        return True, comparison_id
+    except IntegrityError:
+        db.rollback()
+
+    # Take over a key that expired or was abandoned by a crashed request
+    stale = now - timedelta(seconds=IDEMPOTENCY_PENDING_TIMEOUT_SECONDS)
+    taken = db.execute(
+        update(IdempotencyKey)
+        .where(IdempotencyKey.key == key,
+               or_(IdempotencyKey.expires_at <= now,
+                   and_(IdempotencyKey.status == PENDING, IdempotencyKey.created_at <= stale)))
+        .values(comparison_id=comparison_id, status=PENDING, created_at=now, expires_at=expires_at)
+    ).rowcount
+    db.commit()
+    if taken:
+        return True, comparison_id
+
+    row = db.query(IdempotencyKey.comparison_id).filter(
+        IdempotencyKey.key == key).first()
+    if row is None:
+        # Released or cleaned up in between; try again
+        return claim(db, key, comparison_id, ttl_seconds)
+    return False, row.comparison_id
+
+
+def mark_done(db: Session, key: str) -> None:
+    """Stage the key as complete; committed with the session it created"""
+    db.execute(update(IdempotencyKey).where(
+        IdempotencyKey.key == key).values(status=DONE))
+
+
+def release(db: Session, key: str, comparison_id: str) -> None:
+    """Drop a key whose first request failed so a retry can run"""
+    db.rollback()
+    db.query(IdempotencyKey).filter(
+        IdempotencyKey.key == key,
+        IdempotencyKey.comparison_id == comparison_id).delete(synchronize_session=False)
+    db.commit()
+
+
+def _owner(db: Session, key: str) -> Optional[Tuple[str, str]]:
+    """(comparison id, status) of the key, None if it is gone"""
+    row = db.query(IdempotencyKey.comparison_id, IdempotencyKey.status).filter(
+        IdempotencyKey.key == key).first()
+    return tuple(row) if row is not None else None
+
+
+def _with_session(session_factory: Callable[[], Session], fn: Callable, *args) -> Any:
+    db = session_factory()
+    try:
+        return fn(db, *args)
+    finally:
+        db.close()
+
+
+async def _in_thread(session_factory: Callable[[], Session], fn: Callable, *args) -> Any:
+    """Run fn(db, *args) in the default executor with a session of its own.
+
+    Keeps blocking queries off the event loop, and away from the session the
+    submission uses in the admission pool (sessions are not thread-safe).
+    Runs in a copy of the caller's context, so the queries count towards the
+    request's query stats.
+    """
+    ctx = contextvars.copy_context()
+    return await asyncio.get_running_loop().run_in_executor(
+        None, ctx.run, _with_session, session_factory, fn, *args)
+
+
+async def _wait(session_factory: Callable[[], Session], key: str, comparison_id: str, deadline: float) -> bool:
+    """Wait for the owner of key; False if it failed and the key is up for grabs"""
+    future = _in_flight.get(key)
+    if future is not None:
+        try:
+            result = await asyncio.wait_for(asyncio.shield(future), max(0.0, deadline - time.monotonic()))
+        except asyncio.TimeoutError:
+            raise StillProcessing(int(IDEMPOTENCY_WAIT_SECONDS))
+        return result == comparison_id
+
+    # The owner runs in another process
+    while True:
+        owner = await _in_thread(session_factory, _owner, key)
+        if owner is None or owner[0] != comparison_id:
+            return False
+        if owner[1] == DONE:
+            return True
+        if time.monotonic() >= deadline:
+            raise StillProcessing(int(IDEMPOTENCY_WAIT_SECONDS))
+        await asyncio.sleep(0.2)
+
+
+async def _settle(session_factory: Callable[[], Session], key: str, comparison_id: str,
+                  work: asyncio.Future, future: asyncio.Future) -> None:
+    """Wait for the submission to finish, then release the key if it failed and wake waiters"""
+    try:
+        await asyncio.wait([work])
+        if work.cancelled() or work.exception() is not None:
+            # Retries must not wait on a key nobody is processing
+            await _in_thread(session_factory, release, key, comparison_id)
+    finally:
+        # On failure waiters look at the key again
+        _in_flight.pop(key, None)
+        future.set_result(comparison_id if not work.cancelled()
+                          and work.exception() is None else None)
+
+
+async def run_once(session_factory: Callable[[], Session], key: str, ttl_seconds: int,
+                   submit: Callable[[str], Awaitable[Any]]) -> Tuple[str, bool]:
+    """Run submit(comparison_id) once per key.
+
+    Returns the session id and whether it came from an earlier request. The
+    key is claimed, polled and released in sessions from session_factory;
+    submit must stage mark_done(its session, key) in the transaction that
+    commits the session.
+    """
+    deadline = time.monotonic() + IDEMPOTENCY_WAIT_SECONDS
+    while True:
+        owner, comparison_id = await _in_thread(
+            session_factory, claim, key, str(uuid.uuid4()), ttl_seconds)
+        if not owner:
+            if await _wait(session_factory, key, comparison_id, deadline):
+                idempotent_submissions_total.inc(outcome="duplicate")
+                return comparison_id, True
+            continue
+
+        future = asyncio.get_running_loop().create_future()
+        _in_flight[key] = future
+        work = asyncio.ensure_future(submit(comparison_id))
+        settled = asyncio.ensure_future(
+            _settle(session_factory, key, comparison_id, work, future))
+        _settling.add(settled)
+        settled.add_done_callback(_settling.discard)
+        # A client that disconnects stops waiting, but the key is only
+        # settled once the work itself has finished
+        await asyncio.shield(settled)
+        work.result()
+        idempotent_submissions_total.inc(outcome="new")
+        return comparison_id, False
+
+
+def delete_expired(db: Session, batch_size: int = IDEMPOTENCY_CLEANUP_BATCH_SIZE) -> int:
+    """Delete expired keys in batches of batch_size; returns how many were deleted"""
+    deleted = 0
+    while True:
+        now = datetime.utcnow()
+        keys = [key for key, in db.query(IdempotencyKey.key).filter(
+            IdempotencyKey.expires_at <= now).limit(batch_size)]
+        if not keys:
+            return deleted
+        db.query(IdempotencyKey).filter(IdempotencyKey.key.in_(keys)).delete(
+            synchronize_session=False)
+        db.commit()
+        deleted += len(keys)
+        if len(keys) < batch_size:
+            return deleted
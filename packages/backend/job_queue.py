@@ -0,0 +1,197 @@
+"""
+Durable matching job queue backed by the matching_jobs table.
+
+Jobs are claimed under a lease. A worker extends its lease with heartbeats
+while it runs a model; if it dies, the lease expires and another worker
+picks the job up again, so execution is at-least-once. Results are written
+through matching.save_model_result, which is idempotent per model and
+session.
+
+On PostgreSQL jobs are claimed with SELECT ... FOR UPDATE SKIP LOCKED. SQLite
+serializes writers, so there a job is claimed with a conditional UPDATE that
+only succeeds if the job is still claimable.
+"""
+
+import logging
+import os
+from datetime import datetime, timedelta
+from typing import List, Optional
+
+from sqlalchemy import or_, and_, update
+from sqlalchemy.orm import Session
+
+from database import MatchingJob
+from matching import save_model_result
+from metrics import time_stage
+
+logger = logging.getLogger(__name__)
+
+JOB_LEASE_SECONDS = int(os.getenv("MATCHING_JOB_LEASE_SECONDS", 60))
+JOB_MAX_ATTEMPTS = int(os.getenv("MATCHING_JOB_MAX_ATTEMPTS", 3))
+JOB_RETRY_BACKOFF_SECONDS = int(
+    os.getenv("MATCHING_JOB_RETRY_BACKOFF_SECONDS", 5))
+
+PENDING = "pending"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+
+
+def enqueue_jobs(db: Session, comparison_id: str, models: List[str]) -> None:
+    """Stage one job per model for a session. The caller commits."""
+    now = datetime.utcnow()
+    for model in models:
+        db.add(MatchingJob(
+            comparison_id=comparison_id,
+            model_name=model,
+            status=PENDING,
+            run_after=now,
+            created_at=now,
+            updated_at=now
+        ))
+
+
+def _claimable(now: datetime):
+    """Pending jobs that are due, plus running jobs whose lease expired"""
+    return and_(
+        MatchingJob.attempts < JOB_MAX_ATTEMPTS,
+        or_(
+            and_(MatchingJob.status == PENDING, MatchingJob.run_after <= now),
+            and_(MatchingJob.status == RUNNING,
+                 MatchingJob.lease_expires_at < now)
+        )
+    )
+
+
+def claim_job(db: Session, worker_id: str, lease_seconds: int = JOB_LEASE_SECONDS) -> Optional[MatchingJob]:
+    """Claim the oldest claimable job for a worker, or return None"""
+    now = datetime.utcnow()
+    lease = {
+        "status": RUNNING,
+        "lease_owner": worker_id,
+        "lease_expires_at": now + timedelta(seconds=lease_seconds),
+        "heartbeat_at": now,
+        "attempts": MatchingJob.attempts + 1,
+        "updated_at": now,
+    }
+
+    try:
+        if db.bind.dialect.name == "postgresql":
+            job_id = db.query(MatchingJob.id).filter(_claimable(now)).order_by(
+                MatchingJob.created_at).limit(1).with_for_update(skip_locked=True).scalar()
+            if job_id is None:
+                db.rollback()
+                return None
+            db.execute(update(MatchingJob).where(
+                MatchingJob.id == job_id).values(**lease))
+            db.commit()
+            return db.get(MatchingJob, job_id)
+
+        # SQLite: compare-and-set on each candidate, writers are serialized
+        candidates = db.query(MatchingJob.id).filter(_claimable(now)).order_by(
+            MatchingJob.created_at).limit(5).all()
+        for (job_id,) in candidates:
+            claimed = db.execute(update(MatchingJob).where(
+                MatchingJob.id == job_id, _claimable(now)).values(**lease))
+            if claimed.rowcount == 1:
+                db.commit()
+                return db.get(MatchingJob, job_id)
+        db.rollback()
+        return None
+    except Exception:
+        db.rollback()
+        raise
+
+
+def heartbeat(db: Session, job_id: str, worker_id: str, lease_seconds: int = JOB_LEASE_SECONDS) -> bool:
+    """Extend the lease on a job. Returns False if the worker lost the lease."""
+    now = datetime.utcnow()
+    extended = db.execute(update(MatchingJob).where(
+        MatchingJob.id == job_id,
+        MatchingJob.lease_owner == worker_id,
+        MatchingJob.status == RUNNING
+    ).values(
+        lease_expires_at=now + timedelta(seconds=lease_seconds),
+        heartbeat_at=now,
+        updated_at=now
+    ))
+    db.commit()
+    return extended.rowcount == 1
+
+
+def complete_job(db: Session, job: MatchingJob, worker_id: str, matches: List, processing_time_ms: float) -> bool:
+    """Store the model result and mark the job done in one transaction.
+
+    Only the current lease holder may complete a job; a worker whose lease
+    was taken over discards its result.
+    """
+    now = datetime.utcnow()
+    finished = db.execute(update(MatchingJob).where(
+        MatchingJob.id == job.id,
+        MatchingJob.lease_owner == worker_id,
+        MatchingJob.status == RUNNING
+    ).values(status=DONE, lease_expires_at=None, updated_at=now))
+    if finished.rowcount != 1:
+        db.rollback()
+        logger.warning(
+            f"Job {job.id} lost its lease, discarding result from {worker_id}")
+        return False
+
+    with time_stage("db_write"):
+        save_model_result(db, job.comparison_id, job.model_name,
+                          matches, processing_time_ms)
+        db.commit()
+    return True
+
+
+def fail_job(db: Session, job: MatchingJob, worker_id: str, error: str) -> None:
+    """Record a failed attempt; retry later or give up after the last attempt.
+
+    A job that gives up stores an empty result, like a failed model did when
+    matching ran inline.
+    """
+    now = datetime.utcnow()
+    final = job.attempts >= JOB_MAX_ATTEMPTS
+    values = {
+        "status": FAILED if final else PENDING,
+        "last_error": error,
+        "lease_owner": None,
+        "lease_expires_at": None,
+        "run_after": now + timedelta(seconds=JOB_RETRY_BACKOFF_SECONDS * job.attempts),
+        "updated_at": now,
+    }
+    failed = db.execute(update(MatchingJob).where(
+        MatchingJob.id == job.id,
+        MatchingJob.lease_owner == worker_id,
+        MatchingJob.status == RUNNING
+    ).values(**values))
+    if failed.rowcount == 1 and final:
+        save_model_result(db, job.comparison_id, job.model_name, [], 0.0)
+    db.commit()
+
+
+def reap_exhausted_jobs(db: Session) -> int:
+    """Give up on jobs whose lease expired after their last attempt"""
+    now = datetime.utcnow()
+    exhausted = db.query(MatchingJob).filter(
+        MatchingJob.status == RUNNING,
+        MatchingJob.lease_expires_at < now,
+        MatchingJob.attempts >= JOB_MAX_ATTEMPTS
+    ).all()
+    for job in exhausted:
+        job.status = FAILED
+        job.last_error = job.last_error or "Lease expired on last attempt"
+        job.lease_owner = None
+        job.lease_expires_at = None
+        job.updated_at = now
+        save_model_result(db, job.comparison_id, job.model_name, [], 0.0)
+    db.commit()
+    return len(exhausted)
+
+
+def pending_job_count(db: Session, comparison_id: str) -> int:
+    """Number of jobs for a session that have not finished yet"""
+    return db.query(MatchingJob).filter(
+        MatchingJob.comparison_id == comparison_id,
+        MatchingJob.status.in_([PENDING, RUNNING])
+    ).count()
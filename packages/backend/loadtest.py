@@ -0,0 +1,402 @@
+#!/usr/bin/env python3
+"""
+End-to-end load test.
+
+Starts the API with uvicorn (or gunicorn with --workers) against a fresh
+database (a temporary SQLite file unless --database-url is given), loads a synthetic catalog, questionnaire and
+optionally session history (see synthetic_data.py), and runs
+open-loop traffic: arrivals follow a Poisson process at --rate per second
+whatever the response times, so a slow server builds up in-flight requests
+instead of quietly lowering the offered load. The stubbed Gemini models sleep
+for --gemini-latency-ms to stand in for the real API.
+
+Usage:
+    python loadtest.py run --therapists 500 --rate 20 --duration 60 --output reports/run.json
+    python loadtest.py compare reports/before.json reports/after.json --tolerance 0.1
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from collections import defaultdict
+from datetime import datetime
+from typing import Dict, List
+
+import httpx
+
+from synthetic_data import SyntheticData
+
+ADMIN_EMAIL = "admin@kuna.com"
+ADMIN_PASSWORD = "secret123"
+
+# Share of arrivals per flow; a patient flow is questions -> submit -> results -> selection
+TRAFFIC_MIX = {
+    "patient": 0.8,
+    "questions": 0.1,
+    "admin": 0.1,
+}
+
+
+def seed_database(database_url: str, therapists: int, history_sessions: int, seed: int, skew: float) -> None:
+    """Create the schema and load a synthetic catalog, questionnaire and history"""
+    os.environ["DATABASE_URL"] = database_url
+    from database import Base, SessionLocal, engine
+    from synthetic_data import load_catalog, load_history
+    import rollups
+
+    data = SyntheticData(seed, skew)
+    Base.metadata.create_all(bind=engine)
+    try:
+        load_catalog(engine, data, therapists, questions=True)
+        if history_sessions:
+            load_history(engine, data, history_sessions, days=90)
+            db = SessionLocal()
+            try:
+                rollups.rebuild(db)
+            finally:
+                db.close()
+    finally:
+        engine.dispose()
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def start_server(database_url: str, port: int, gemini_latency_ms: float, extra_env: Dict[str, str], log_file, workers: int = 0) -> subprocess.Popen:
+    """Single uvicorn process, or gunicorn with this many workers"""
+    env = dict(os.environ)
+    env.update({
+        "DATABASE_URL": database_url,
+        "GEMINI_API_KEY": env.get("GEMINI_API_KEY", "loadtest"),
+        "GEMINI_SIMULATED_LATENCY_MS": str(gemini_latency_ms),
+    })
+    env.update(extra_env)
+    if workers:
+        env.update({"WEB_CONCURRENCY": str(workers), "PORT": str(port)})
+        command = [sys.executable, "-m", "gunicorn",
+                   "-c", "gunicorn.conf.py", "main:app"]
+    else:
+        command = [sys.executable, "-m", "uvicorn", "main:app", "--host", "127.0.0.1",
+                   "--port", str(port), "--log-level", "warning"]
+    return subprocess.Popen(
+        command,
+        cwd=os.path.dirname(os.path.abspath(__file__)), env=env,
+        stdout=log_file, stderr=subprocess.STDOUT)
+
+
+def wait_until_healthy(base_url: str, process: subprocess.Popen, timeout: float = 60) -> None:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"Server exited with code {process.returncode}")
+        try:
+            if httpx.get(f"{base_url}/readyz", timeout=1).status_code == 200:
+                return
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.2)
+    raise RuntimeError("Server did not become healthy in time")
+
+
+class Recorder:
+    def __init__(self):
+        self.latencies: Dict[str, List[float]] = defaultdict(list)
+        self.errors: Dict[str, Dict[str, int]] = defaultdict(
+            lambda: defaultdict(int))
+
+    async def request(self, client: httpx.AsyncClient, route: str, method: str, url: str, **kwargs):
+        """Send one request and record its latency under the route template"""
+        started = time.perf_counter()
+        try:
+            response = await client.request(method, url, **kwargs)
+        except httpx.HTTPError as e:
+            self.errors[route][type(e).__name__] += 1
+            return None
+        elapsed = time.perf_counter() - started
+        if response.status_code >= 400:
+            self.errors[route][str(response.status_code)] += 1
+        else:
+            self.latencies[route].append(elapsed)
+        return response
+
+
+def percentile(sorted_values: List[float], q: float) -> float:
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, int(round(q * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+class LoadTest:
+    def __init__(self, base_url: str, args):
+        self.base_url = base_url
+        self.args = args
+        self.rng = random.Random(args.seed)
+        self.data = SyntheticData(args.seed + 1, args.skew)
+        self.recorder = Recorder()
+        self.questions = []
+        self.admin_headers = {}
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.dropped = 0
+
+    async def patient_flow(self, client: httpx.AsyncClient, n: int):
+        rec = self.recorder
+        await rec.request(client, "GET /api/questions", "GET", "/api/questions")
+        response = await rec.request(
+            client, "POST /api/submit-questionnaire", "POST", "/api/submit-questionnaire",
+            json={"email": f"paciente{n}@loadtest.kuna", "answers": self.data.answers(self.questions)})
+        if response is None or response.status_code != 200:
+            return
+        session_id = response.json()["session_id"]
+
+        results = None
+        for _ in range(self.args.poll_attempts):
+            response = await rec.request(
+                client, "GET /api/results/{session_id}", "GET", f"/api/results/{session_id}")
+            if response is not None and response.status_code == 200:
+                results = response.json()["results"]
+                break
+            await asyncio.sleep(self.args.poll_interval)
+        chosen = [r for r in results or [] if r["matches"]]
+        if not chosen:
+            return
+
+        result = self.rng.choice(chosen)
+        await rec.request(
+            client, "POST /api/select-therapist", "POST", "/api/select-therapist",
+            json={"session_id": session_id,
+                  "selected_therapist_id": result["matches"][0]["id"],
+                  "feedback": f"Seleccionado de {result['display_name']}"})
+
+    async def questions_flow(self, client: httpx.AsyncClient, n: int):
+        await self.recorder.request(client, "GET /api/questions", "GET", "/api/questions")
+
+    async def admin_flow(self, client: httpx.AsyncClient, n: int):
+        await self.recorder.request(
+            client, "GET /api/admin/therapists", "GET", "/api/admin/therapists", headers=self.admin_headers)
+        await self.recorder.request(
+            client, "GET /api/admin/sessions", "GET", "/api/admin/sessions", headers=self.admin_headers)
+
+    async def _run_flow(self, flow, client, n):
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        try:
+            await flow(client, n)
+        finally:
+            self.in_flight -= 1
+
+    async def run(self) -> float:
+        limits = httpx.Limits(max_connections=self.args.max_connections)
+        async with httpx.AsyncClient(base_url=self.base_url, timeout=self.args.timeout, limits=limits) as client:
+            self.questions = (await client.get("/api/questions")).json()
+            login = await client.post("/api/admin/login", data={"email": ADMIN_EMAIL, "password": ADMIN_PASSWORD})
+            self.admin_headers = {
+                "Authorization": f"Bearer {login.json()['access_token']}"}
+
+            flows = {"patient": self.patient_flow,
+                     "questions": self.questions_flow, "admin": self.admin_flow}
+            names = list(TRAFFIC_MIX)
+            weights = [TRAFFIC_MIX[name] for name in names]
+
+            tasks = set()
+            started = time.perf_counter()
+            next_arrival = started
+            n = 0
+            while next_arrival - started < self.args.duration:
+                delay = next_arrival - time.perf_counter()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+                if self.in_flight >= self.args.max_in_flight:
+                    # Count instead of queueing so the offered load stays open-loop
+                    self.dropped += 1
+                else:
+                    flow = flows[self.rng.choices(names, weights)[0]]
+                    task = asyncio.create_task(self._run_flow(flow, client, n))
+                    tasks.add(task)
+                    task.add_done_callback(tasks.discard)
+                n += 1
+                next_arrival += self.rng.expovariate(self.args.rate)
+            if tasks:
+                await asyncio.wait(tasks)
+            return time.perf_counter() - started
+
+    def report(self, elapsed: float) -> Dict[str, object]:
+        routes = {}
+        for route in sorted(set(self.recorder.latencies) | set(self.recorder.errors)):
+            values = sorted(self.recorder.latencies.get(route, []))
+            errors = dict(self.recorder.errors.get(route, {}))
+            routes[route] = {
+                "requests": len(values) + sum(errors.values()),
+                "errors": errors,
+                "throughput_rps": round(len(values) / elapsed, 3),
+                "p50_ms": round(percentile(values, 0.50) * 1000, 2),
+                "p95_ms": round(percentile(values, 0.95) * 1000, 2),
+                "p99_ms": round(percentile(values, 0.99) * 1000, 2),
+                "max_ms": round(values[-1] * 1000, 2) if values else 0.0,
+            }
+        return {
+            "elapsed_seconds": round(elapsed, 2),
+            "dropped_arrivals": self.dropped,
+            "max_in_flight": self.max_in_flight,
+            "routes": routes,
+        }
+
+
+def git_revision() -> Dict[str, object]:
+    def git(*args):
+        try:
+            return subprocess.run(["git", *args], capture_output=True, text=True,
+                                  cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+        except OSError:
+            return ""
+    return {"commit": git("rev-parse", "HEAD"), "dirty": bool(git("status", "--porcelain", "--untracked-files=no"))}
+
+
+def print_report(report: Dict[str, object]) -> None:
+    print(f"{'route':40} {'reqs':>7} {'err':>5} {'rps':>8} {'p50':>9} {'p95':>9} {'p99':>9}")
+    for route, r in report["routes"].items():
+        print(f"{route:40} {r['requests']:>7} {sum(r['errors'].values()):>5} {r['throughput_rps']:>8.2f} "
+              f"{r['p50_ms']:>7.1f}ms {r['p95_ms']:>7.1f}ms {r['p99_ms']:>7.1f}ms")
+    print(
+        f"dropped arrivals: {report['dropped_arrivals']}, max in flight: {report['max_in_flight']}")
+
+
+def run(args) -> int:
+    tmpdir = tempfile.mkdtemp(prefix="kuna-loadtest-")
+    database_url = args.database_url
+    if not database_url:
+        database_url = f"sqlite:///{tmpdir}/loadtest.db"
+    seed_database(database_url, args.therapists,
+                  args.history_sessions, args.seed, args.skew)
+
+    port = args.port or free_port()
+    base_url = f"http://127.0.0.1:{port}"
+    extra_env = dict(item.split("=", 1) for item in args.env)
+    log_path = os.path.join(tmpdir, "server.log")
+    log_file = open(log_path, "w")
+    server = start_server(database_url, port,
+                          args.gemini_latency_ms, extra_env, log_file, args.workers)
+    print(f"Server log: {log_path}")
+    try:
+        wait_until_healthy(base_url, server)
+        test = LoadTest(base_url, args)
+        elapsed = asyncio.run(test.run())
+        result = test.report(elapsed)
+    finally:
+        server.send_signal(signal.SIGINT)
+        try:
+            server.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            server.kill()
+        log_file.close()
+
+    report = {
+        "git": git_revision(),
+        "created_at": datetime.utcnow().isoformat(),
+        "python": platform.python_version(),
+        "config": {
+            "therapists": args.therapists, "history_sessions": args.history_sessions,
+            "rate": args.rate, "duration": args.duration,
+            "gemini_latency_ms": args.gemini_latency_ms, "seed": args.seed, "skew": args.skew,
+            "database": database_url.split(":", 1)[0], "env": extra_env,
+            "workers": args.workers,
+            "traffic_mix": TRAFFIC_MIX,
+        },
+        **result,
+    }
+    print_report(report)
+    if args.output:
+        os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"Report written to {args.output}")
+    return 0
+
+
+def compare(args) -> int:
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    with open(args.candidate) as f:
+        candidate = json.load(f)
+    if baseline["config"] != candidate["config"]:
+        print("warning: reports were produced with different configurations")
+
+    regressions = 0
+    print(f"baseline {baseline['git']['commit'][:10]} vs candidate {candidate['git']['commit'][:10]}")
+    print(f"{'route':40} {'metric':>7} {'baseline':>10} {'candidate':>10} {'change':>8}")
+    for route, before in baseline["routes"].items():
+        after = candidate["routes"].get(route)
+        if after is None:
+            print(f"{route:40} missing from candidate")
+            continue
+        for metric in ("p50_ms", "p95_ms", "p99_ms"):
+            change = (after[metric] - before[metric]) / \
+                before[metric] if before[metric] else 0.0
+            flag = ""
+            if metric == args.metric and change > args.tolerance:
+                regressions += 1
+                flag = "  REGRESSION"
+            print(f"{route:40} {metric[:3]:>7} {before[metric]:>8.1f}ms {after[metric]:>8.1f}ms {change:>+7.1%}{flag}")
+    return 1 if regressions else 0
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    p = sub.add_parser("run", help="Start the app and run the load test")
+    p.add_argument("--therapists", type=int, default=200)
+    p.add_argument("--rate", type=float, default=10,
+                   help="Flow arrivals per second")
+    p.add_argument("--duration", type=float, default=30, help="Seconds of arrivals")
+    p.add_argument("--gemini-latency-ms", type=float, default=500)
+    p.add_argument("--database-url",
+                   help="Use this (empty) database instead of a temporary SQLite file")
+    p.add_argument("--port", type=int)
+    p.add_argument("--workers", type=int, default=0,
+                   help="Serve with gunicorn and this many workers (0: one uvicorn process)")
+    p.add_argument("--history-sessions", type=int, default=0,
+                   help="Past sessions to preload, for admin listings at history scale")
+    p.add_argument("--seed", type=int, default=42)
+    p.add_argument("--skew", type=float, default=1.0,
+                   help="Zipf skew of the synthetic catalog and answers")
+    p.add_argument("--timeout", type=float, default=60)
+    p.add_argument("--max-connections", type=int, default=200)
+    p.add_argument("--max-in-flight", type=int, default=1000,
+                   help="Arrivals beyond this many in-flight flows are dropped and counted")
+    p.add_argument("--poll-attempts", type=int, default=20)
+    p.add_argument("--poll-interval", type=float, default=0.5)
+    p.add_argument("--env", action="append", default=[], metavar="KEY=VALUE",
+                   help="Extra environment for the server, e.g. --env MATCHING_MODE=queue")
+    p.add_argument("--output", help="Write the JSON report here")
+    p.set_defaults(func=run)
+
+    p = sub.add_parser("compare", help="Compare two JSON reports")
+    p.add_argument("baseline")
+    p.add_argument("candidate")
+    p.add_argument("--metric", default="p95_ms",
+                   choices=["p50_ms", "p95_ms", "p99_ms"])
+    p.add_argument("--tolerance", type=float, default=0.1,
+                   help="Allowed relative slowdown before failing")
+    p.set_defaults(func=compare)
+
+    args = parser.parse_args()
+    return args.func(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
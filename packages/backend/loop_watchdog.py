@@ -0,0 +1,147 @@
+"""
+Event-loop blocking detector.
+
+A ticker coroutine records a heartbeat every LOOP_WATCHDOG_INTERVAL_MS and
+measures how late it woke up (event-loop lag). A watchdog thread checks the
+heartbeat; when the loop has not ticked for LOOP_WATCHDOG_THRESHOLD_MS it
+captures the stack of the event-loop thread while it is still blocked, and
+attributes it to the route whose task was running. Stalls are logged and
+exported through the metrics registry.
+
+Enable with LOOP_WATCHDOG=1.
+"""
+
+import asyncio
+import logging
+import os
+import sys
+import threading
+import time
+import traceback
+from typing import Dict, Optional
+
+from metrics import REGISTRY
+
+logger = logging.getLogger(__name__)
+
+LOOP_WATCHDOG_ENABLED = os.getenv(
+    "LOOP_WATCHDOG", "").lower() in ("1", "true", "yes")
+LOOP_WATCHDOG_INTERVAL_MS = float(os.getenv("LOOP_WATCHDOG_INTERVAL_MS", 50))
+LOOP_WATCHDOG_THRESHOLD_MS = float(
+    os.getenv("LOOP_WATCHDOG_THRESHOLD_MS", 200))
+
+event_loop_lag_seconds = REGISTRY.histogram(
+    "kuna_event_loop_lag_seconds", "How late the event loop ran a scheduled tick",
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0))
+event_loop_blocked_total = REGISTRY.counter(
+    "kuna_event_loop_blocked_total", "Event-loop stalls over the threshold by route", ("route",))
+event_loop_blocked_seconds = REGISTRY.histogram(
+    "kuna_event_loop_blocked_seconds", "Duration of event-loop stalls by route", ("route",),
+    buckets=(0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0))
+
+
+class LoopWatchdog:
+    def __init__(self, interval_ms: float = LOOP_WATCHDOG_INTERVAL_MS, threshold_ms: float = LOOP_WATCHDOG_THRESHOLD_MS):
+        self.interval = interval_ms / 1000
+        self.threshold = threshold_ms / 1000
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._loop_thread_id: Optional[int] = None
+        self._last_tick = time.monotonic()
+        self._ticker: Optional[asyncio.Task] = None
+        self._thread: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+        # ASGI scope per running request task, maintained by LoopWatchdogMiddleware
+        self._task_scopes: Dict[asyncio.Task, dict] = {}
+
+    def start(self):
+        """Start the ticker on the running loop and the watchdog thread"""
+        self._loop = asyncio.get_running_loop()
+        self._loop_thread_id = threading.get_ident()
+        self._last_tick = time.monotonic()
+        self._ticker = self._loop.create_task(self._tick())
+        self._thread = threading.Thread(
+            target=self._watch, name="loop-watchdog", daemon=True)
+        self._thread.start()
+        logger.info(
+            f"Event-loop watchdog started (threshold {self.threshold * 1000:.0f}ms)")
+
+    def stop(self):
+        self._stop.set()
+        if self._ticker:
+            self._ticker.cancel()
+
+    def track(self, scope: dict):
+        """Associate the current task with a request; returns a callable that forgets it"""
+        task = asyncio.current_task()
+        if task is None:
+            return lambda: None
+        self._task_scopes[task] = scope
+        return lambda: self._task_scopes.pop(task, None)
+
+    async def _tick(self):
+        while True:
+            expected = time.monotonic() + self.interval
+            await asyncio.sleep(self.interval)
+            now = time.monotonic()
+            event_loop_lag_seconds.observe(max(0.0, now - expected))
+            self._last_tick = now
+
+    def _current_route(self) -> str:
+        """Route of the request whose task is currently running on the loop"""
+        current_tasks = getattr(asyncio.tasks, "_current_tasks", None)
+        task = current_tasks.get(self._loop) if current_tasks else None
+        scope = self._task_scopes.get(task) if task is not None else None
+        if scope is None:
+            return "unknown"
+        # The router stores the matched route in the scope
+        route = scope.get("route")
+        return route.path if route else scope.get("path", "unknown")
+
+    def _watch(self):
+        reported_tick = None
+        while not self._stop.wait(self.interval):
+            last_tick = self._last_tick
+            stalled = time.monotonic() - last_tick
+            if stalled < self.threshold or reported_tick == last_tick:
+                continue
+
+            # Capture while the loop is still blocked
+            frame = sys._current_frames().get(self._loop_thread_id)
+            stack = "".join(traceback.format_stack(
+                frame)) if frame else "<no frame>"
+            route = self._current_route()
+            reported_tick = last_tick
+
+            # Wait for the loop to recover to measure the full stall
+            while self._last_tick == last_tick and not self._stop.wait(self.interval):
+                pass
+            blocked = time.monotonic() - last_tick - self.interval
+            event_loop_blocked_total.inc(route=route)
+            event_loop_blocked_seconds.observe(blocked, route=route)
+            logger.warning(
+                f"Event loop blocked for {blocked * 1000:.0f}ms in {route}; stack at detection:\n{stack}")
+
+
+class LoopWatchdogMiddleware:
+    """ASGI middleware registering each request's task with the watchdog.
+
+    Must be a plain ASGI middleware added inside any BaseHTTPMiddleware, so
+    that it runs in the same task as the endpoint.
+    """
+
+    def __init__(self, app, watchdog: LoopWatchdog):
+        self.app = app
+        self.watchdog = watchdog
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        forget = self.watchdog.track(scope)
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            forget()
+
+
+watchdog = LoopWatchdog() if LOOP_WATCHDOG_ENABLED else None
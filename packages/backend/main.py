@@ -1,23 +1,150 @@
-from fastapi import FastAPI, HTTPException, Depends, Form, status
+import time
+
+# Startup logs include the time spent importing the app from here on
+_import_started = time.perf_counter()
+
+from fastapi import FastAPI, HTTPException, Depends, Form, Header, Query, Request, Response, status
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse, PlainTextResponse
+from sqlalchemy import func, text
 from sqlalchemy.orm import Session
 import uvicorn
-from typing import List
-import uuid
+from contextlib import asynccontextmanager
+from typing import Any, Dict, List, Optional
+import asyncio
+import contextvars
 import logging
 import os
 from datetime import timedelta
 
-from database import get_db, init_db, Question, Therapist, ModelComparison, ModelResult, UserSelection
+from database import SessionLocal, engine, get_db, Question, Therapist, ModelComparison, ModelResult, UserSelection
 from schemas import (
     QuestionResponse, ComparisonResponse, UserSelectionRequest,
     SubmitQuestionnaireRequest, SubmitQuestionnaireResponse, ModelResultResponse,
     TherapistRegistrationRequest, LoginRequest, LoginResponse, AdminUserResponse
 )
-from gemini_service import GeminiMatchingService
+from gemini_service import get_matching_service
+from matching import build_comparison_response, encode_answers, model_from_feedback, run_models_inline
+from job_queue import enqueue_jobs, pending_job_count
+from admission import AdmissionController, Overloaded
+from allocation import ModelAllocator
+import rollups
+import retention
+import metrics
+import geo
+import attributes
+import availability
+import query_stats
+from loop_watchdog import LoopWatchdogMiddleware, watchdog
+import profiler
+import memory_tracking
+import cache_versions
+import catalog_cache
+import features
+import idempotency
+import selection_buffer
+import prefilter
+import text_index
+from idempotency import StillProcessing
 from auth import authenticate_user, create_access_token, get_current_admin
 
-app = FastAPI(title="Therapist Matching API", version="1.0.0")
+# Seconds between warm-up attempts while the database is unreachable
+WARMUP_RETRY_SECONDS = float(os.getenv("WARMUP_RETRY_SECONDS", 5))
+# Seconds between sweeps of expired idempotency keys
+IDEMPOTENCY_CLEANUP_INTERVAL_SECONDS = float(
+    os.getenv("IDEMPOTENCY_CLEANUP_INTERVAL_SECONDS", 300))
+
+
+def _warm_up():
+    """Load the caches and create the matching service"""
+    # Record the current cache versions so later polls only see new writes
+    catalog_cache.poller.poll_once()
+    text_index.index.load()
+    db = SessionLocal()
+    try:
+        catalog_cache.warm(db)
+        # Builds the prefilter's indexes, re-indexing only bios changed since the last save
+        prefilter.prepare(catalog_cache.therapists.get(db))
+    finally:
+        db.close()
+    text_index.index.save()
+    get_matching_service()
+
+
+async def _warm_up_until_done():
+    started = time.perf_counter()
+    loop = asyncio.get_running_loop()
+    while True:
+        try:
+            await loop.run_in_executor(None, _warm_up)
+            catalog_cache.poller.start()
+            logger.info(
+                f"Warm-up finished in {(time.perf_counter() - started) * 1000:.0f}ms")
+            return
+        except Exception as e:
+            logger.warning(
+                f"Warm-up failed, retrying in {WARMUP_RETRY_SECONDS:.0f}s: {str(e)}")
+            await asyncio.sleep(WARMUP_RETRY_SECONDS)
+
+
+def _delete_expired_idempotency_keys():
+    db = SessionLocal()
+    try:
+        deleted = idempotency.delete_expired(db)
+        if deleted:
+            logger.info(f"Deleted {deleted} expired idempotency keys")
+    finally:
+        db.close()
+
+
+async def _clean_up_idempotency_keys():
+    loop = asyncio.get_running_loop()
+    while True:
+        await asyncio.sleep(IDEMPOTENCY_CLEANUP_INTERVAL_SECONDS)
+        try:
+            await loop.run_in_executor(None, _delete_expired_idempotency_keys)
+        except Exception as e:
+            logger.warning(f"Idempotency key cleanup failed: {str(e)}")
+
+
+def _replay_selection_journal():
+    try:
+        selection_buffer.buffer.replay_orphaned()
+    except Exception as e:
+        logger.error(f"Selection journal replay failed: {str(e)}")
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Start diagnostics and warm caches in the background; /readyz waits for them"""
+    started = time.perf_counter()
+    if watchdog:
+        watchdog.start()
+    if memory_tracking.tracker:
+        memory_tracking.tracker.start()
+    warm_up = asyncio.create_task(_warm_up_until_done())
+    cleanup = asyncio.create_task(_clean_up_idempotency_keys())
+    loop = asyncio.get_running_loop()
+    if selection_buffer.buffer:
+        # Selections journaled by a process that crashed
+        loop.run_in_executor(None, _replay_selection_journal)
+    logger.info(
+        f"Startup took {(time.perf_counter() - started) * 1000:.0f}ms after {IMPORT_MS:.0f}ms of imports")
+    yield
+    warm_up.cancel()
+    cleanup.cancel()
+    if selection_buffer.buffer:
+        await loop.run_in_executor(None, selection_buffer.buffer.stop)
+    catalog_cache.poller.stop()
+    await loop.run_in_executor(None, text_index.index.save)
+    if watchdog:
+        watchdog.stop()
+    if memory_tracking.tracker:
+        memory_tracking.tracker.stop()
+
+
+app = FastAPI(title="Therapist Matching API",
+              version="1.0.0", lifespan=lifespan)
 
 ALLOWED_ORIGINS = [
     "http://localhost:3000",
@@ -34,6 +161,9 @@ if os.getenv("FRONTEND_URL"):
 
 print(ALLOWED_ORIGINS)
 
+# Attach per-request SQL totals to responses as X-DB-* headers
+DEBUG = os.getenv("DEBUG", "").lower() in ("1", "true", "yes")
+
 # Add CORS middleware for React frontend
 app.add_middleware(
     CORSMiddleware,
@@ -43,24 +173,156 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Feeds route-mode profiling sessions started from /api/admin/profile/route
+app.add_middleware(profiler.RouteProfilerMiddleware)
+
+# Optional event-loop stall detector, see loop_watchdog.py
+if watchdog:
+    app.add_middleware(LoopWatchdogMiddleware, watchdog=watchdog)
+
+# Optional per-route peak memory accounting, see memory_tracking.py
+if memory_tracking.tracker:
+    app.add_middleware(memory_tracking.MemoryTrackingMiddleware,
+                       tracker=memory_tracking.tracker)
+
+
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-# Initialize database
-init_db()
+# Schema changes run separately with `python migrate.py`
+rollups.install(SessionLocal)
+
+# "inline" runs the models inside the request, "queue" hands them to `python -m worker`
+MATCHING_MODE = os.getenv("MATCHING_MODE", "inline")
+# How long /api/results waits for queued models to finish before answering
+RESULTS_WAIT_SECONDS = float(os.getenv("RESULTS_WAIT_SECONDS", 30))
+
+# Decides which models run for each session
+model_allocator = ModelAllocator()
+
+# Submissions run on their own bounded pool so cheap endpoints keep headroom
+submission_admission = AdmissionController(
+    "submit",
+    max_concurrency=int(os.getenv("SUBMIT_MAX_CONCURRENCY", 4)),
+    max_queue=int(os.getenv("SUBMIT_MAX_QUEUE", 16)),
+    queue_deadline_seconds=float(
+        os.getenv("SUBMIT_QUEUE_DEADLINE_SECONDS", 10))
+)
+
 
-# Initialize Gemini service
-gemini_service = GeminiMatchingService()
+metrics.REGISTRY.gauge(
+    "kuna_db_pool_connections", "Database pool connections by state", ("state",),
+    callback=lambda: {
+        ("checked_out",): engine.pool.checkedout(),
+        ("idle",): engine.pool.checkedin(),
+    } if hasattr(engine.pool, "checkedout") else {})
+metrics.REGISTRY.gauge(
+    "kuna_admission_queue", "Submission admission control state", ("state",),
+    callback=lambda: {
+        ("in_flight",): submission_admission.in_flight,
+        ("queued",): submission_admission.queued,
+    })
+
+
+@app.middleware("http")
+async def record_request_metrics(request: Request, call_next):
+    """Count requests and time them per route template and status code"""
+    metrics.http_requests_in_flight.inc()
+    start = time.perf_counter()
+    status_code = 500
+    try:
+        response = await call_next(request)
+        status_code = response.status_code
+        return response
+    finally:
+        elapsed = time.perf_counter() - start
+        metrics.http_requests_in_flight.dec()
+        route = request.scope.get("route")
+        labels = {
+            "route": route.path if route else "unmatched",
+            "method": request.method,
+            "status": str(status_code),
+        }
+        metrics.http_requests_total.inc(**labels)
+        metrics.http_request_duration_seconds.observe(elapsed, **labels)
+
+
+@app.middleware("http")
+async def record_query_stats(request: Request, call_next):
+    """Collect SQL query count and time for each request"""
+    token = query_stats.begin_request()
+    response = None
+    try:
+        response = await call_next(request)
+        return response
+    finally:
+        route = request.scope.get("route")
+        stats = query_stats.end_request(
+            token, route.path if route else request.url.path)
+        if DEBUG and response is not None:
+            response.headers["X-DB-Query-Count"] = str(stats.count)
+            response.headers["X-DB-Time-Ms"] = f"{stats.total_seconds * 1000:.2f}"
+
+
+@app.exception_handler(StillProcessing)
+async def still_processing_handler(request: Request, exc: StillProcessing):
+    """A duplicate submission timed out waiting for the original"""
+    return JSONResponse(
+        status_code=status.HTTP_409_CONFLICT,
+        content={"detail": "An identical submission is still being processed"},
+        headers={"Retry-After": str(exc.retry_after)}
+    )
+
+
+@app.exception_handler(Overloaded)
+async def overloaded_handler(request: Request, exc: Overloaded):
+    """Shed load with 503 and a Retry-After hint"""
+    logger.warning(f"Shedding {request.url.path}: {str(exc)}")
+    return JSONResponse(
+        status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+        content={"detail": "Server busy, please retry shortly"},
+        headers={"Retry-After": str(exc.retry_after)}
+    )
 
 
 # Health check endpoint
-@app.get("/health")
-async def health_check():
-    """Health check endpoint for deployment monitoring"""
+@app.get("/livez")
+async def liveness_check():
+    """Liveness probe: the process is up and serving requests"""
     return {"status": "healthy", "service": "kuna-backend", "version": "1.0.0"}
 
 
+# Kept for existing monitors; same as /livez
+app.add_api_route("/health", liveness_check, methods=["GET"])
+
+
+def _check_database() -> None:
+    db = SessionLocal()
+    try:
+        db.execute(text("SELECT 1"))
+    finally:
+        db.close()
+
+
+@app.get("/readyz")
+async def readiness_check():
+    """Readiness probe: the database answers and the caches are warm"""
+    checks = {"database": "ok", "caches": "ok"}
+    try:
+        # In the request's context, so its query is counted for the request
+        ctx = contextvars.copy_context()
+        await asyncio.get_running_loop().run_in_executor(None, ctx.run, _check_database)
+    except Exception as e:
+        checks["database"] = str(e)
+    if not catalog_cache.is_warm():
+        checks["caches"] = "warming"
+    ready = all(v == "ok" for v in checks.values())
+    return JSONResponse(
+        status_code=200 if ready else 503,
+        content={"status": "ready" if ready else "not_ready", "checks": checks})
+
+
 # Root endpoint
 @app.get("/")
 async def root():
@@ -116,129 +378,74 @@ async def get_current_user(current_admin=Depends(get_current_admin)):
 @app.get("/api/questions", response_model=List[QuestionResponse])
 async def get_questions(db: Session = Depends(get_db)):
     """Get all active questions for the questionnaire"""
-    questions = db.query(Question).filter(
-        Question.is_active == True).order_by(Question.display_order).all()
-    return [
-        QuestionResponse(
-            id=q.id,
-            question_text=q.question_text,
-            question_type=q.question_type,
-            options=q.options,
-            display_order=q.display_order,
-            is_active=q.is_active
-        ) for q in questions
-    ]
+    return [QuestionResponse(**q) for q in catalog_cache.questions.get(db)]
 
 
-@app.post("/api/submit-questionnaire", response_model=SubmitQuestionnaireResponse)
-async def submit_questionnaire(
-    request: SubmitQuestionnaireRequest,
-    db: Session = Depends(get_db)
-):
-    """Submit questionnaire and get session ID"""
+def _process_submission(request: SubmitQuestionnaireRequest, comparison_id: str, idempotency_key: str,
+                        user_answers: List[Dict[str, Any]], answer_features: features.Features) -> None:
+    """Store the questionnaire under comparison_id and run or enqueue the models
+
+    Runs on the admission pool with a session of its own: the request's
+    session is closed when the request ends, even while this still runs.
+    """
+    db = SessionLocal()
     try:
         # Create comparison record
-        comparison_id = str(uuid.uuid4())
         comparison = ModelComparison(
             id=comparison_id,
             email=request.email,
             questionnaire_answers=request.answers
         )
         db.add(comparison)
-        db.commit()
-
-        # Get all therapists from database
-        therapists = db.query(Therapist).filter(
-            Therapist.is_active == True).all()
-        therapist_dicts = [
-            {
-                "id": t.id,
-                "name": t.name,
-                "professional_titles": t.professional_titles,
-                "professional_id_number": t.professional_id_number,
-                "specialties": t.specialties,
-                "therapeutic_approaches": t.therapeutic_approaches,
-                "session_price": t.session_price,
-                "country": t.country,
-                "city": t.city,
-                "remote": t.remote,
-                "on_site": t.on_site,
-                "hybrid": getattr(t, 'hybrid', False),
-                "bio": t.bio,
-                "years_experience": t.years_experience,
-                "languages": t.languages,
-                "therapeutic_style": getattr(t, 'therapeutic_style', []),
-                "age_groups": getattr(t, 'age_groups', []),
-                "weekly_availability": getattr(t, 'weekly_availability', None),
-                "commitment_level": getattr(t, 'commitment_level', None),
-                "additional_info": getattr(t, 'additional_info', None)
-            }
-            for t in therapists
-        ]
+        models = model_allocator.allocate(db, comparison_id)
+
+        if MATCHING_MODE == "queue":
+            # Hand the models to the matching workers, committed with the session
+            enqueue_jobs(db, comparison_id, models)
+        else:
+            db.commit()
+            with metrics.time_stage("catalog_load"):
+                therapist_dicts = catalog_cache.therapists.get(db)
+            run_models_inline(db, get_matching_service(), comparison_id,
+                              therapist_dicts, user_answers, models, answer_features,
+                              attributes.candidate_ids(db, user_answers))
+
+        # Duplicates of this submission may now reuse the session
+        idempotency.mark_done(db, idempotency_key)
+        with metrics.time_stage("db_write"):
+            db.commit()
+    finally:
+        db.close()
 
-        # Convert answers to user_answers format for Gemini service
-        user_answers = [
-            {"question": k, "answer": v}
-            for k, v in request.answers.items()
-        ]
 
-        # Test with 3 models as requested
-        models = ["gemini-2.5-flash-lite", "gemini-2.5-flash", "random"]
-
-        for model in models:
-            try:
-                logger.info(f"Getting matches for model: {model}")
-                matches, processing_time = gemini_service.get_matches(
-                    therapist_dicts, user_answers, model)
-
-                # Convert matches to dict format for JSON storage
-                matches_dict = [
-                    {
-                        "id": match.id,
-                        "name": match.name,
-                        "specialties": match.specialties,
-                        "therapeutic_approaches": match.therapeutic_approaches,
-                        "session_price": match.session_price,
-                        "country": match.country,
-                        "city": match.city,
-                        "remote": match.remote,
-                        "on_site": match.on_site,
-                        "bio": match.bio,
-                        "match_score": match.match_score,
-                        "match_reason": match.match_reason,
-                        "confidence_score": match.confidence_score
-                    }
-                    for match in matches
-                ]
-
-                # Sort matches by confidence_score (highest first), then by match_score
-                matches_dict.sort(key=lambda x: (
-                    -(x.get('confidence_score') or x.get('match_score') or 0)
-                ))
-
-                # Store in database
-                result = ModelResult(
-                    comparison_id=comparison_id,
-                    model_name=model,
-                    matches=matches_dict,
-                    processing_time_ms=processing_time
-                )
-                db.add(result)
-
-            except Exception as e:
-                logger.error(f"Error with model {model}: {str(e)}")
-                # Add empty result for failed models
-                result = ModelResult(
-                    comparison_id=comparison_id,
-                    model_name=model,
-                    matches=[],
-                    processing_time_ms=0.0
-                )
-                db.add(result)
+@app.post("/api/submit-questionnaire", response_model=SubmitQuestionnaireResponse)
+async def submit_questionnaire(
+    request: SubmitQuestionnaireRequest,
+    response: Response,
+    db: Session = Depends(get_db),
+    idempotency_key: Optional[str] = Header(None)
+):
+    """Submit questionnaire and get session ID.
 
-        db.commit()
+    Retries with the same Idempotency-Key header, or the same email and
+    answers within IDEMPOTENCY_WINDOW_SECONDS, get the original session.
+    """
+    try:
+        user_answers, answer_features = encode_answers(
+            catalog_cache.questions.get(db), request.answers)
+        key, ttl_seconds = idempotency.submission_key(
+            idempotency_key, request.email, request.answers, answer_features)
+        comparison_id, replayed = await idempotency.run_once(
+            SessionLocal, key, ttl_seconds,
+            lambda comparison_id: submission_admission.run(
+                _process_submission, request, comparison_id, key, user_answers, answer_features))
+        if replayed:
+            response.headers["Idempotent-Replayed"] = "true"
+        catalog_cache.sessions.put(comparison_id, True)
         return SubmitQuestionnaireResponse(session_id=comparison_id)
 
+    except (Overloaded, StillProcessing):
+        raise
     except Exception as e:
         logger.error(f"Error submitting questionnaire: {str(e)}")
         raise HTTPException(
@@ -248,40 +455,44 @@ async def submit_questionnaire(
 @app.get("/api/results/{session_id}", response_model=ComparisonResponse)
 async def get_results(session_id: str, db: Session = Depends(get_db)):
     """Get results for a session"""
-    # Check if comparison exists
-    comparison = db.query(ModelComparison).filter(
-        ModelComparison.id == session_id).first()
-    if not comparison:
-        raise HTTPException(status_code=404, detail="Session not found")
+    cached = catalog_cache.results.get(session_id)
+    if cached is not None:
+        return cached
+
+    # Wait for queued models that are still running
+    pending = 0
+    if MATCHING_MODE == "queue":
+        deadline = time.monotonic() + RESULTS_WAIT_SECONDS
+        pending = pending_job_count(db, session_id)
+        while pending and time.monotonic() < deadline:
+            db.rollback()
+            await asyncio.sleep(0.5)
+            pending = pending_job_count(db, session_id)
 
     # Get all results for this comparison
     results = db.query(ModelResult).filter(
         ModelResult.comparison_id == session_id).all()
 
     if not results:
-        raise HTTPException(
-            status_code=404, detail="No results found for this session")
+        # Only look up the session to tell the two 404s apart
+        comparison = db.query(ModelComparison.id).filter(
+            ModelComparison.id == session_id).first()
+        if comparison:
+            raise HTTPException(
+                status_code=404, detail="No results found for this session")
+        # Sessions past retention are served from their archive file
+        archived = retention.read_archived(db, session_id)
+        if archived is None:
+            raise HTTPException(status_code=404, detail="Session not found")
+        results = retention.archived_results(archived)
 
     # Format results for frontend
-    model_results = []
-    display_names = {"gemini-2.5-flash-lite": "Model A",
-                     "gemini-2.5-flash": "Model B", "random": "Model C"}
-
-    for result in results:
-        model_results.append(
-            ModelResultResponse(
-                model_name=result.model_name,
-                display_name=display_names.get(
-                    result.model_name, result.model_name),
-                matches=result.matches,
-                processing_time_ms=result.processing_time_ms
-            )
-        )
-
-    return ComparisonResponse(
-        comparison_id=session_id,
-        results=model_results
-    )
+    with metrics.time_stage("serialize_results"):
+        response = build_comparison_response(session_id, results)
+    # Only complete results are cached; reruns bump the "results" version
+    if not pending:
+        catalog_cache.results.put(session_id, response)
+    return response
 
 
 @app.post("/api/select-therapist")
@@ -292,28 +503,32 @@ async def select_therapist(
     """Record user's therapist selection"""
     try:
         # Check if comparison exists
-        comparison = db.query(ModelComparison).filter(
-            ModelComparison.id == request.session_id).first()
-        if not comparison:
-            raise HTTPException(status_code=404, detail="Session not found")
+        if not catalog_cache.sessions.get(request.session_id):
+            comparison = db.query(ModelComparison.id).filter(
+                ModelComparison.id == request.session_id).first()
+            if not comparison:
+                raise HTTPException(
+                    status_code=404, detail="Session not found")
+            catalog_cache.sessions.put(request.session_id, True)
 
         # Extract model name from feedback or default to "unknown"
-        selected_model = "unknown"
-        if request.feedback and "Selected from" in request.feedback:
-            selected_model = request.feedback.replace("Selected from ", "")
+        selected_model = model_from_feedback(request.feedback)
 
         # Record selection
-        selection = UserSelection(
-            comparison_id=request.session_id,
-            selected_model=selected_model,
-            selected_therapist_id=request.selected_therapist_id,
-            feedback=request.feedback
-        )
-        db.add(selection)
-        db.commit()
-
-        return {"success": True, "message": "Selection recorded successfully"}
+        selection = selection_buffer.make_selection(
+            request.session_id, selected_model, request.selected_therapist_id,
+            request.feedback, request.selection_id)
+        if selection_buffer.buffer:
+            # Journaled (fsync) off the event loop, written later by the flusher
+            loop = asyncio.get_running_loop()
+            await loop.run_in_executor(None, selection_buffer.buffer.add, selection)
+        else:
+            selection_buffer.write_selections(engine, [selection])
+
+        return {"success": True, "id": selection["id"], "message": "Selection recorded successfully"}
 
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Error recording selection: {str(e)}")
         raise HTTPException(
@@ -331,6 +546,9 @@ async def register_therapist(request: TherapistRegistrationRequest, db: Session
             raise HTTPException(
                 status_code=400, detail="Email already registered")
 
+        # Resolve the city offline for distance-aware matching
+        latitude, longitude = geo.coordinates(request.city, request.country)
+
         # Create new therapist
         new_therapist = Therapist(
             name=request.name,
@@ -343,6 +561,8 @@ async def register_therapist(request: TherapistRegistrationRequest, db: Session
             price_negotiable=request.price_negotiable,
             country=request.country,
             city=request.city,
+            latitude=latitude,
+            longitude=longitude,
             remote=request.remote,
             on_site=request.on_site,
             hybrid=request.hybrid,
@@ -352,14 +572,23 @@ async def register_therapist(request: TherapistRegistrationRequest, db: Session
             therapeutic_style=request.therapeutic_style,
             age_groups=request.age_groups,
             weekly_availability=request.weekly_availability,
+            availability_mask=availability.encode_schedule(
+                request.weekly_availability),
             commitment_level=request.commitment_level,
             additional_info=request.additional_info,
             is_active=True  # New therapists are active by default
         )
 
         db.add(new_therapist)
+        db.flush()
+        attributes.write(db, [{"id": new_therapist.id, **{
+            field: getattr(request, field) for field in attributes.ATTRIBUTE_FIELDS}}])
+        cache_versions.bump(db, "therapists")
         db.commit()
         db.refresh(new_therapist)
+        catalog_cache.therapists.invalidate()
+        text_index.index.add(new_therapist.id, text_index.therapist_text(
+            {"bio": new_therapist.bio, "additional_info": new_therapist.additional_info}))
 
         logger.info(
             f"New therapist registered: {new_therapist.name} ({new_therapist.email})")
@@ -378,11 +607,27 @@ async def register_therapist(request: TherapistRegistrationRequest, db: Session
 @app.get("/api/admin/therapists")
 async def get_all_therapists_admin(
     current_admin=Depends(get_current_admin),
-    db: Session = Depends(get_db)
+    db: Session = Depends(get_db),
+    specialty: Optional[List[str]] = Query(None),
+    approach: Optional[List[str]] = Query(None),
+    style: Optional[List[str]] = Query(None),
+    age_group: Optional[List[str]] = Query(None),
+    language: Optional[List[str]] = Query(None)
 ):
-    """Get all therapists (admin only)"""
+    """Get all therapists (admin only).
+
+    Repeating a filter matches any of its values; different filters must all
+    match, e.g. ?language=english&specialty=ansiedad.
+    """
     try:
-        therapists = db.query(Therapist).all()
+        query = db.query(Therapist)
+        required = {field: attributes.label_filter(field, labels) for field, labels in (
+            ("specialties", specialty), ("therapeutic_approaches", approach),
+            ("therapeutic_style", style), ("age_groups", age_group), ("languages", language))
+            if labels}
+        if required:
+            query = query.filter(Therapist.id.in_(attributes.filter_query(required)))
+        therapists = query.all()
         return [
             {
                 "id": t.id,
@@ -423,8 +668,12 @@ async def delete_therapist_admin(
         if not therapist:
             raise HTTPException(status_code=404, detail="Therapist not found")
 
+        attributes.remove(db, [therapist_id])
         db.delete(therapist)
+        cache_versions.bump(db, "therapists")
         db.commit()
+        catalog_cache.therapists.invalidate()
+        text_index.index.remove(therapist_id)
 
         logger.info(
             f"Therapist deleted by admin: {therapist.name} ({therapist.email})")
@@ -444,29 +693,147 @@ async def get_all_sessions_admin(
 ):
     """Get all user sessions (admin only)"""
     try:
-        sessions = db.query(ModelComparison).all()
+        # Count children with grouped subqueries instead of loading the
+        # relationships of every session (one query per session)
+        results_count = db.query(
+            ModelResult.comparison_id, func.count(ModelResult.id).label("count")
+        ).group_by(ModelResult.comparison_id).subquery()
+        selections_count = db.query(
+            UserSelection.comparison_id, func.count(UserSelection.id).label("count")
+        ).group_by(UserSelection.comparison_id).subquery()
+
+        sessions = db.query(
+            ModelComparison,
+            func.coalesce(results_count.c.count, 0),
+            func.coalesce(selections_count.c.count, 0)
+        ).outerjoin(
+            results_count, results_count.c.comparison_id == ModelComparison.id
+        ).outerjoin(
+            selections_count, selections_count.c.comparison_id == ModelComparison.id
+        ).all()
         return [
             {
                 "id": s.id,
                 "email": s.email,
                 "created_at": s.created_at,
                 "questionnaire_answers": s.questionnaire_answers,
-                "model_results_count": len(s.model_results),
-                "user_selections_count": len(s.user_selections)
+                "model_results_count": n_results,
+                "user_selections_count": n_selections
             }
-            for s in sessions
+            for s, n_results, n_selections in sessions
         ]
     except Exception as e:
         logger.error(f"Error fetching sessions: {str(e)}")
         raise HTTPException(status_code=500, detail="Failed to fetch sessions")
 
 
-@app.get("/health")
-async def health_check():
-    """Health check endpoint"""
-    return {"status": "healthy"}
+@app.get("/api/admin/model-stats")
+async def get_model_stats_admin(
+    days: int = 30,
+    current_admin=Depends(get_current_admin),
+    db: Session = Depends(get_db)
+):
+    """Per-model win rates and latency percentiles from the rollups (admin only)"""
+    if days < 1 or days > 366:
+        raise HTTPException(
+            status_code=400, detail="days must be between 1 and 366")
+    try:
+        return rollups.model_stats(db, days)
+    except Exception as e:
+        logger.error(f"Error fetching model stats: {str(e)}")
+        raise HTTPException(
+            status_code=500, detail="Failed to fetch model stats")
+
+
+@app.get("/api/admin/admission")
+async def get_admission_stats(current_admin=Depends(get_current_admin)):
+    """Admission control queue depth, wait times and shed count (admin only)"""
+    return submission_admission.stats()
+
+
+@app.post("/api/admin/profile", response_class=PlainTextResponse)
+async def profile_process_admin(
+    seconds: float = 10,
+    interval_ms: float = 10,
+    include_idle: bool = False,
+    current_admin=Depends(get_current_admin)
+):
+    """Sample all threads for N seconds and return collapsed stacks (admin only)"""
+    if seconds <= 0 or seconds > profiler.MAX_PROFILE_SECONDS:
+        raise HTTPException(
+            status_code=400, detail=f"seconds must be between 0 and {profiler.MAX_PROFILE_SECONDS}")
+    session = profiler.ProfileSession(interval_ms, include_idle)
+    try:
+        await profiler.run_in_slot(session.run_for, seconds)
+    except profiler.ProfilerBusy as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    logger.info(
+        f"Profile by {current_admin['email']}: {session.samples} samples in {session.duration:.1f}s")
+    return PlainTextResponse(session.collapsed())
+
+
+@app.post("/api/admin/profile/route", response_class=PlainTextResponse)
+async def profile_route_admin(
+    route: str,
+    requests: int = 10,
+    timeout_seconds: float = 60,
+    interval_ms: float = 5,
+    include_idle: bool = False,
+    current_admin=Depends(get_current_admin)
+):
+    """Profile the next N requests to a route template and return collapsed stacks (admin only)"""
+    if requests < 1 or timeout_seconds <= 0 or timeout_seconds > profiler.MAX_PROFILE_SECONDS:
+        raise HTTPException(
+            status_code=400, detail="Invalid requests or timeout_seconds")
+    if not any(getattr(r, "path", None) == route for r in app.routes):
+        raise HTTPException(status_code=404, detail="Route not found")
+    session = profiler.ProfileSession(interval_ms, include_idle)
+    try:
+        await profiler.run_in_slot(session.run_for_route, route, requests, timeout_seconds)
+    except profiler.ProfilerBusy as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    logger.info(
+        f"Route profile of {route} by {current_admin['email']}: {session.requests_done} requests, {session.samples} samples")
+    return PlainTextResponse(session.collapsed())
+
+
+@app.get("/api/admin/memory")
+async def get_memory_stats_admin(
+    limit: int = 20,
+    reset_baseline: bool = False,
+    current_admin=Depends(get_current_admin)
+):
+    """Peak memory per route and top allocation sites since the baseline (admin only)"""
+    tracker = memory_tracking.tracker
+    if tracker is None:
+        return {"enabled": False}
+    try:
+        # Snapshots walk every traced block; keep them off the event loop
+        loop = asyncio.get_running_loop()
+        summary = await loop.run_in_executor(None, tracker.summary, limit)
+        if reset_baseline:
+            await loop.run_in_executor(None, tracker.reset_baseline)
+            logger.info(
+                f"Memory baseline reset by {current_admin['email']}")
+        return summary
+    except Exception as e:
+        logger.error(f"Error collecting memory stats: {str(e)}")
+        raise HTTPException(
+            status_code=500, detail="Failed to collect memory stats")
+
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def get_metrics():
+    """Prometheus metrics for this process"""
+    return PlainTextResponse(metrics.REGISTRY.render(), media_type="text/plain; version=0.0.4")
+
+
+IMPORT_MS = (time.perf_counter() - _import_started) * 1000
+logger.info(f"App imported in {IMPORT_MS:.0f}ms")
 
 
 if __name__ == "__main__":
+    from migrate import migrate
+    migrate()
     port = int(os.getenv("PORT", 8000))
     uvicorn.run(app, host="0.0.0.0", port=port)
@@ -0,0 +1,237 @@
+"""
+Matching pipeline shared by the web tier and the matching worker.
+"""
+
+import logging
+import os
+import uuid
+from datetime import datetime
+from typing import List, Dict, Any, Optional, Set, Tuple
+
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.orm import Session
+
+import availability
+import cache_versions
+import features
+import rollups
+from database import Therapist, ModelResult
+from schemas import TherapistMatch, ModelResultResponse, ComparisonResponse
+from metrics import answer_errors_total, model_match_seconds, model_failures_total, time_stage
+from prefilter import LOCAL_MODEL, select_candidates
+
+logger = logging.getLogger(__name__)
+
+# Models registered for comparison; the allocator picks a subset per session
+MATCHING_MODELS = ["gemini-2.5-flash-lite", "gemini-2.5-flash", "random"]
+# "1" also compares the local TF-IDF ranking (prefilter.py) as a model
+if os.getenv("LOCAL_TFIDF_MODEL", "0") == "1":
+    MATCHING_MODELS.append(LOCAL_MODEL)
+
+# Anonymized names shown to users
+MODEL_DISPLAY_NAMES = {"gemini-2.5-flash-lite": "Model A",
+                       "gemini-2.5-flash": "Model B", "random": "Model C",
+                       LOCAL_MODEL: "Model D"}
+
+
+def model_from_feedback(feedback: str) -> str:
+    """Recover the selected model from the selection feedback text.
+
+    The frontend sends "Seleccionado de <display name>"; older clients sent
+    "Selected from <model or display name>".
+    """
+    if not feedback:
+        return "unknown"
+    for prefix in ("Seleccionado de ", "Selected from "):
+        if feedback.startswith(prefix):
+            name = feedback[len(prefix):].strip()
+            for model, display_name in MODEL_DISPLAY_NAMES.items():
+                if name in (model, display_name):
+                    return model
+            return name
+    return "unknown"
+
+
+def therapist_to_dict(t: Therapist) -> Dict[str, Any]:
+    """Convert a Therapist row into the dict format used by the matching service"""
+    return {
+        "id": t.id,
+        "name": t.name,
+        "professional_titles": t.professional_titles,
+        "professional_id_number": t.professional_id_number,
+        "specialties": t.specialties,
+        "therapeutic_approaches": t.therapeutic_approaches,
+        "session_price": t.session_price,
+        "country": t.country,
+        "city": t.city,
+        "latitude": getattr(t, 'latitude', None),
+        "longitude": getattr(t, 'longitude', None),
+        "remote": t.remote,
+        "on_site": t.on_site,
+        "hybrid": getattr(t, 'hybrid', False),
+        "bio": t.bio,
+        "years_experience": t.years_experience,
+        "languages": t.languages,
+        "therapeutic_style": getattr(t, 'therapeutic_style', []),
+        "age_groups": getattr(t, 'age_groups', []),
+        "weekly_availability": getattr(t, 'weekly_availability', None),
+        "availability_mask": availability.decode(getattr(t, 'availability_mask', None)),
+        "commitment_level": getattr(t, 'commitment_level', None),
+        "additional_info": getattr(t, 'additional_info', None)
+    }
+
+
+def load_therapist_dicts(db: Session) -> List[Dict[str, Any]]:
+    """Load all active therapists as matching dicts"""
+    therapists = db.query(Therapist).filter(
+        Therapist.is_active == True).all()
+    return [therapist_to_dict(t) for t in therapists]
+
+
+def encode_answers(questions: List[Dict[str, Any]], answers: Dict[str, Any]) -> Tuple[List[Dict[str, Any]], features.Features]:
+    """Features of the answers under the question set and the decoded answers every model gets"""
+    extractor, answer_features = features.extract(questions, answers)
+    if answer_features.errors:
+        answer_errors_total.inc(len(answer_features.errors))
+        logger.warning(f"Answers that do not fit their question: {'; '.join(answer_features.errors)}")
+    return extractor.user_answers(answer_features), answer_features
+
+
+def matches_to_dicts(matches: List[TherapistMatch]) -> List[Dict[str, Any]]:
+    """Convert matches to dicts for JSON storage, best first"""
+    matches_dict = [
+        {
+            "id": match.id,
+            "name": match.name,
+            "specialties": match.specialties,
+            "therapeutic_approaches": match.therapeutic_approaches,
+            "session_price": match.session_price,
+            "country": match.country,
+            "city": match.city,
+            "remote": match.remote,
+            "on_site": match.on_site,
+            "bio": match.bio,
+            "match_score": match.match_score,
+            "match_reason": match.match_reason,
+            "confidence_score": match.confidence_score
+        }
+        for match in matches
+    ]
+
+    # Sort matches by confidence_score (highest first), then by match_score
+    matches_dict.sort(key=lambda x: (
+        -(x.get('confidence_score') or x.get('match_score') or 0)
+    ))
+
+    return matches_dict
+
+
+def run_model(matching_service, therapist_dicts: List[Dict], user_answers: List[Dict], model: str,
+              answer_features: Optional[features.Features] = None,
+              candidate_ids: Optional[Set[str]] = None) -> Tuple[List[Dict[str, Any]], float]:
+    """Run one model and return its matches as sorted dicts plus the processing time.
+
+    candidate_ids (attributes.candidate_ids) restricts every model but the
+    random control group to the therapists meeting the patient's requirements.
+    """
+    if model not in ("random", LOCAL_MODEL):
+        # The random control group keeps drawing from the whole catalog, and
+        # the local model is the prefilter's own ranking of it
+        with time_stage("prefilter"):
+            therapist_dicts = select_candidates(
+                therapist_dicts, user_answers,
+                profile_key=answer_features.key if answer_features else None,
+                candidate_ids=candidate_ids)
+    with model_match_seconds.time(model=model):
+        matches, processing_time = matching_service.get_matches(
+            therapist_dicts, user_answers, model,
+            candidate_ids=candidate_ids)
+
+    return matches_to_dicts(matches), processing_time
+
+
+def build_comparison_response(comparison_id: str, results: List[ModelResult]) -> ComparisonResponse:
+    """Format stored model results for the frontend"""
+    model_results = []
+
+    for result in results:
+        model_results.append(
+            ModelResultResponse(
+                model_name=result.model_name,
+                display_name=MODEL_DISPLAY_NAMES.get(
+                    result.model_name, result.model_name),
+                matches=result.matches,
+                processing_time_ms=result.processing_time_ms
+            )
+        )
+
+    return ComparisonResponse(
+        comparison_id=comparison_id,
+        results=model_results
+    )
+
+
+def save_model_result(db: Session, comparison_id: str, model_name: str, matches: List[Dict], processing_time_ms: float) -> str:
+    """Insert or overwrite the result of a model for a session; returns the result id.
+
+    A single INSERT ... ON CONFLICT (comparison_id, model_name) DO UPDATE, so
+    two leases racing on the same job leave one result behind. The caller
+    commits.
+    """
+    table = ModelResult.__table__
+    insert = postgresql.insert if db.bind.dialect.name == "postgresql" else sqlite.insert
+    now = datetime.utcnow()
+    new_id = str(uuid.uuid4())
+    stmt = insert(table).values(
+        id=new_id,
+        comparison_id=comparison_id,
+        model_name=model_name,
+        matches=matches,
+        processing_time_ms=processing_time_ms,
+        created_at=now
+    )
+    stmt = stmt.on_conflict_do_update(
+        index_elements=["comparison_id", "model_name"],
+        set_={"matches": stmt.excluded.matches,
+              "processing_time_ms": stmt.excluded.processing_time_ms,
+              "created_at": stmt.excluded.created_at}
+    ).returning(table.c.id)
+    result_id = db.execute(stmt).scalar()
+    if result_id == new_id:
+        # Core inserts bypass the session's after_flush rollup hook
+        rollups.record_result(db.connection(), model_name, now.date(),
+                              processing_time_ms, not matches)
+    else:
+        # Overwrote an earlier result, which another process may have cached
+        cache_versions.bump(db, "results")
+    return result_id
+
+
+def run_models_inline(db: Session, matching_service, comparison_id: str, therapist_dicts: List[Dict],
+                      user_answers: List[Dict], models: List[str],
+                      answer_features: Optional[features.Features] = None,
+                      candidate_ids: Optional[Set[str]] = None) -> None:
+    """Run every model in-process for a new session and stage the results on the session"""
+
+    for model in models:
+        try:
+            logger.info(f"Getting matches for model: {model}")
+            matches_dict, processing_time = run_model(
+                matching_service, therapist_dicts, user_answers, model, answer_features, candidate_ids)
+            result = ModelResult(
+                comparison_id=comparison_id,
+                model_name=model,
+                matches=matches_dict,
+                processing_time_ms=processing_time
+            )
+        except Exception as e:
+            logger.error(f"Error with model {model}: {str(e)}")
+            model_failures_total.inc(model=model)
+            # Add empty result for failed models
+            result = ModelResult(
+                comparison_id=comparison_id,
+                model_name=model,
+                matches=[],
+                processing_time_ms=0.0
+            )
+        db.add(result)
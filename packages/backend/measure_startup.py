@@ -0,0 +1,132 @@
+#!/usr/bin/env python3
+"""
+Measure how long the app takes to import and to become live and ready.
+
+Import time is measured in fresh interpreters with `python -X importtime`,
+which also gives the slowest modules. Time to /livez and /readyz is measured
+by starting uvicorn against a migrated temporary SQLite database and polling
+both probes.
+
+Usage:
+    python measure_startup.py --runs 5
+"""
+
+import argparse
+import os
+import re
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.request
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+
+def _env(database_url: str):
+    env = dict(os.environ)
+    env["DATABASE_URL"] = database_url
+    env.setdefault("GEMINI_API_KEY", "startup")
+    return env
+
+
+def measure_import(env, runs: int, top: int):
+    """Wall time of `import main` per run and the slowest modules of the last run"""
+    times = []
+    for _ in range(runs):
+        started = time.perf_counter()
+        result = subprocess.run([sys.executable, "-X", "importtime", "-c", "import main"],
+                                cwd=HERE, env=env, capture_output=True, text=True)
+        times.append(time.perf_counter() - started)
+        if result.returncode:
+            raise RuntimeError(result.stderr[-2000:])
+
+    # "import time: self [us] | cumulative | imported package"
+    modules = []
+    for line in result.stderr.splitlines():
+        match = re.match(r"import time:\s+(\d+) \|\s+(\d+) \|(\s*)(\S+)", line)
+        if match:
+            modules.append((int(match.group(2)), len(
+                match.group(3)) // 2, match.group(4)))
+    # Modules imported directly by main.py
+    direct = sorted((m for m in modules if m[1] == 1), reverse=True)[:top]
+    return times, direct
+
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def _ok(url: str) -> bool:
+    try:
+        with urllib.request.urlopen(url, timeout=1) as response:
+            return response.status == 200
+    except OSError:
+        return False
+
+
+def measure_probes(env, timeout: float = 60):
+    """Seconds from process start until /livez and /readyz return 200"""
+    port = _free_port()
+    base = f"http://127.0.0.1:{port}"
+    started = time.perf_counter()
+    server = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--host", "127.0.0.1",
+         "--port", str(port), "--log-level", "warning"],
+        cwd=HERE, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    live = ready = None
+    try:
+        while time.perf_counter() - started < timeout and ready is None:
+            if server.poll() is not None:
+                raise RuntimeError(
+                    f"Server exited with code {server.returncode}")
+            if live is None and _ok(f"{base}/livez"):
+                live = time.perf_counter() - started
+            if live is not None and _ok(f"{base}/readyz"):
+                ready = time.perf_counter() - started
+            time.sleep(0.01)
+    finally:
+        server.terminate()
+        server.wait(timeout=10)
+    return live, ready
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--top", type=int, default=15,
+                        help="Slowest direct imports of main.py to list")
+    parser.add_argument("--database-url",
+                        help="Use this migrated database instead of a temporary SQLite file")
+    args = parser.parse_args()
+
+    database_url = args.database_url or f"sqlite:///{tempfile.mkdtemp(prefix='kuna-startup-')}/startup.db"
+    env = _env(database_url)
+    if not args.database_url:
+        subprocess.run([sys.executable, "migrate.py"], cwd=HERE, env=env,
+                       check=True, capture_output=True)
+
+    times, modules = measure_import(env, args.runs, args.top)
+    print(f"import main: median {statistics.median(times) * 1000:.0f}ms, "
+          f"min {min(times) * 1000:.0f}ms over {len(times)} runs (includes interpreter start)")
+    print("\nSlowest imports made by main.py (cumulative):")
+    for cumulative_us, _, name in modules:
+        print(f"  {cumulative_us / 1000:>8.1f}ms  {name}")
+
+    live_times, ready_times = [], []
+    for _ in range(args.runs):
+        live, ready = measure_probes(env)
+        live_times.append(live)
+        ready_times.append(ready)
+    print(f"\n/livez after  median {statistics.median(live_times) * 1000:.0f}ms")
+    print(f"/readyz after median {statistics.median(ready_times) * 1000:.0f}ms")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,150 @@
+"""
+Opt-in memory instrumentation with tracemalloc.
+
+With MEMORY_TRACKING=1 every request records the peak traced allocation
+above what was allocated when it started, per route. tracemalloc keeps a
+single process-wide peak, which is only reset when a request starts with no
+other request in flight. A request that ran alone gets its exact peak; one
+that overlapped others gets the peak of the whole overlapping stretch, an
+upper bound, and is counted in overlapped_requests. Top allocation sites are
+reported as the difference between the current snapshot and a baseline
+snapshot, which can be reset to look at a specific window.
+
+tracemalloc slows allocation-heavy code noticeably; keep it off in normal
+operation.
+"""
+
+import os
+import threading
+import tracemalloc
+from typing import Any, Dict, List, Optional, Tuple
+
+from metrics import REGISTRY
+
+MEMORY_TRACKING_ENABLED = os.getenv(
+    "MEMORY_TRACKING", "").lower() in ("1", "true", "yes")
+MEMORY_TRACKING_FRAMES = int(os.getenv("MEMORY_TRACKING_FRAMES", 10))
+
+request_peak_memory_bytes = REGISTRY.histogram(
+    "kuna_request_peak_memory_bytes", "Peak traced allocation during a request by route", ("route",),
+    buckets=(64e3, 256e3, 1e6, 4e6, 16e6, 64e6, 256e6, 1e9))
+
+_SNAPSHOT_FILTERS = [
+    tracemalloc.Filter(False, tracemalloc.__file__),
+    tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+    tracemalloc.Filter(False, "<frozen importlib._bootstrap_external>"),
+    tracemalloc.Filter(False, "<unknown>"),
+]
+
+
+class MemoryTracker:
+    def __init__(self, frames: int = MEMORY_TRACKING_FRAMES):
+        self.frames = frames
+        self._baseline: Optional[tracemalloc.Snapshot] = None
+        self._routes: Dict[str, Dict[str, float]] = {}
+        self._lock = threading.Lock()
+        self._in_flight = 0
+        self._started_total = 0
+
+    def start(self):
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(self.frames)
+        self.reset_baseline()
+
+    def stop(self):
+        tracemalloc.stop()
+
+    def reset_baseline(self):
+        self._baseline = tracemalloc.take_snapshot().filter_traces(_SNAPSHOT_FILTERS)
+
+    def begin_request(self) -> Tuple[int, Optional[int]]:
+        """Start measuring a request; pass the result to end_request"""
+        with self._lock:
+            # Resetting while others run would wipe the peaks they reached
+            alone = self._in_flight == 0
+            if alone:
+                tracemalloc.reset_peak()
+            current, _ = tracemalloc.get_traced_memory()
+            self._in_flight += 1
+            self._started_total += 1
+            return current, self._started_total if alone else None
+
+    def end_request(self, route: str, started: Tuple[int, Optional[int]]):
+        started_with, started_as = started
+        _, peak = tracemalloc.get_traced_memory()
+        peak_delta = max(0, peak - started_with)
+        request_peak_memory_bytes.observe(peak_delta, route=route)
+        with self._lock:
+            self._in_flight -= 1
+            # Alone throughout: nothing was in flight at the start or started since
+            overlapped = started_as is None or started_as != self._started_total
+            stats = self._routes.setdefault(
+                route, {"requests": 0, "overlapped_requests": 0, "max_peak_bytes": 0,
+                        "total_peak_bytes": 0, "last_peak_bytes": 0})
+            stats["requests"] += 1
+            stats["overlapped_requests"] += 1 if overlapped else 0
+            stats["max_peak_bytes"] = max(stats["max_peak_bytes"], peak_delta)
+            stats["total_peak_bytes"] += peak_delta
+            stats["last_peak_bytes"] = peak_delta
+
+    def route_stats(self) -> Dict[str, Dict[str, Any]]:
+        with self._lock:
+            return {
+                route: {
+                    "requests": s["requests"],
+                    "overlapped_requests": s["overlapped_requests"],
+                    "max_peak_bytes": s["max_peak_bytes"],
+                    "avg_peak_bytes": round(s["total_peak_bytes"] / s["requests"]),
+                    "last_peak_bytes": s["last_peak_bytes"],
+                }
+                for route, s in self._routes.items()
+            }
+
+    def top_allocations(self, limit: int = 20, key_type: str = "lineno") -> List[Dict[str, Any]]:
+        """Allocation sites that grew the most since the baseline snapshot"""
+        snapshot = tracemalloc.take_snapshot().filter_traces(_SNAPSHOT_FILTERS)
+        stats = snapshot.compare_to(self._baseline, key_type)
+        return [
+            {
+                "site": str(stat.traceback[0]) if stat.traceback else "<unknown>",
+                "traceback": [str(frame) for frame in stat.traceback][-5:],
+                "size_diff_bytes": stat.size_diff,
+                "size_bytes": stat.size,
+                "count_diff": stat.count_diff,
+                "count": stat.count,
+            }
+            for stat in stats[:limit]
+        ]
+
+    def summary(self, limit: int = 20) -> Dict[str, Any]:
+        current, peak = tracemalloc.get_traced_memory()
+        return {
+            "enabled": True,
+            "traced_current_bytes": current,
+            "traced_peak_bytes": peak,
+            "routes": self.route_stats(),
+            "top_allocations": self.top_allocations(limit),
+        }
+
+
+class MemoryTrackingMiddleware:
+    """ASGI middleware recording the peak allocation of each request"""
+
+    def __init__(self, app, tracker: MemoryTracker):
+        self.app = app
+        self.tracker = tracker
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not tracemalloc.is_tracing():
+            await self.app(scope, receive, send)
+            return
+        started = self.tracker.begin_request()
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            route = scope.get("route")
+            self.tracker.end_request(
+                route.path if route else "unmatched", started)
+
+
+tracker = MemoryTracker() if MEMORY_TRACKING_ENABLED else None
@@ -0,0 +1,233 @@
+"""
+Minimal Prometheus-style metrics registry.
+
+Counters, gauges and histograms with labels, rendered in the Prometheus text
+exposition format by /metrics. Values are kept per process.
+"""
+
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+# Default latency buckets in seconds
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25,
+                   0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    pairs = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+
+    def _key(self, labels: Dict[str, str]) -> Tuple[str, ...]:
+        return tuple(str(labels.get(n, "")) for n in self.labelnames)
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}",
+                 f"# TYPE {self.name} {self.kind}"]
+        lines.extend(self._samples())
+        return lines
+
+    def _samples(self) -> List[str]:
+        raise NotImplementedError
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, amount: float = 1.0, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def _samples(self):
+        with self._lock:
+            items = list(self._values.items())
+        return [f"{self.name}{_format_labels(self.labelnames, k)} {_format_value(v)}" for k, v in items]
+
+
+class Gauge(_Metric):
+    kind = "gauge"
+
+    def __init__(self, *args, callback: Optional[Callable[[], Dict[Tuple[str, ...], float]]] = None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._values: Dict[Tuple[str, ...], float] = {}
+        # Called at render time, returns {label values: value}
+        self._callback = callback
+
+    def set(self, value: float, **labels):
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+    def inc(self, amount: float = 1.0, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def dec(self, amount: float = 1.0, **labels):
+        self.inc(-amount, **labels)
+
+    def _samples(self):
+        with self._lock:
+            values = dict(self._values)
+        if self._callback:
+            try:
+                values.update(self._callback())
+            except Exception:
+                pass
+        return [f"{self.name}{_format_labels(self.labelnames, k)} {_format_value(v)}" for k, v in values.items()]
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, *args, buckets: Sequence[float] = DEFAULT_BUCKETS, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.buckets = tuple(sorted(buckets))
+        # label values -> [bucket counts..., +Inf count], sum
+        self._values: Dict[Tuple[str, ...], Tuple[List[int], List[float]]] = {}
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            if key not in self._values:
+                self._values[key] = ([0] * (len(self.buckets) + 1), [0.0])
+            counts, total = self._values[key]
+            counts[index] += 1
+            total[0] += value
+
+    @contextmanager
+    def time(self, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def _samples(self):
+        with self._lock:
+            items = [(k, list(c), s[0]) for k, (c, s) in self._values.items()]
+        lines = []
+        for key, counts, total in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                le = f'le="{_format_value(bound)}"'
+                lines.append(
+                    f"{self.name}_bucket{_format_labels(self.labelnames, key, le)} {cumulative}")
+            lines.append(
+                f"{self.name}_sum{_format_labels(self.labelnames, key)} {_format_value(total)}")
+            lines.append(
+                f"{self.name}_count{_format_labels(self.labelnames, key)} {cumulative}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self._metrics: Dict[str, _Metric] = {}
+        self._lock = threading.Lock()
+
+    def register(self, metric: _Metric) -> _Metric:
+        with self._lock:
+            return self._metrics.setdefault(metric.name, metric)
+
+    def counter(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> Counter:
+        return self.register(Counter(name, documentation, labelnames))
+
+    def gauge(self, name: str, documentation: str, labelnames: Sequence[str] = (), callback=None) -> Gauge:
+        return self.register(Gauge(name, documentation, labelnames, callback=callback))
+
+    def histogram(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                  buckets: Sequence[float] = DEFAULT_BUCKETS) -> Histogram:
+        return self.register(Histogram(name, documentation, labelnames, buckets=buckets))
+
+    def render(self) -> str:
+        with self._lock:
+            metrics = list(self._metrics.values())
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+# HTTP
+http_requests_total = REGISTRY.counter(
+    "kuna_http_requests_total", "HTTP requests by route, method and status code",
+    ("route", "method", "status"))
+http_request_duration_seconds = REGISTRY.histogram(
+    "kuna_http_request_duration_seconds", "HTTP request latency by route, method and status code",
+    ("route", "method", "status"))
+http_requests_in_flight = REGISTRY.gauge(
+    "kuna_http_requests_in_flight", "HTTP requests currently being served")
+
+# Matching pipeline
+pipeline_stage_seconds = REGISTRY.histogram(
+    "kuna_pipeline_stage_seconds", "Time spent in each stage of the matching pipeline",
+    ("stage",))
+model_match_seconds = REGISTRY.histogram(
+    "kuna_model_match_seconds", "Time spent matching per model", ("model",))
+model_fallbacks_total = REGISTRY.counter(
+    "kuna_model_fallbacks_total", "Model calls that fell back to random matches", ("model",))
+model_failures_total = REGISTRY.counter(
+    "kuna_model_failures_total", "Model calls that failed and stored an empty result", ("model",))
+answer_errors_total = REGISTRY.counter(
+    "kuna_answer_errors_total", "Submitted answers that did not fit their question")
+
+# Admission control
+admission_wait_seconds = REGISTRY.histogram(
+    "kuna_admission_wait_seconds", "Time requests spent queued before admission", ("controller",))
+admission_requests_total = REGISTRY.counter(
+    "kuna_admission_requests_total", "Requests admitted or shed by admission control",
+    ("controller", "outcome"))
+
+# Idempotent submissions
+idempotent_submissions_total = REGISTRY.counter(
+    "kuna_idempotent_submissions_total",
+    "Questionnaire submissions by outcome (new or duplicate)", ("outcome",))
+
+# Write-behind selections
+selections_flushed_total = REGISTRY.counter(
+    "kuna_selections_flushed_total", "Buffered selections written, by outcome", ("outcome",))
+selection_flush_seconds = REGISTRY.histogram(
+    "kuna_selection_flush_seconds", "Time to write one batch of buffered selections")
+
+# Local text index
+text_index_search_seconds = REGISTRY.histogram(
+    "kuna_text_index_search_seconds", "Time to answer one text index query")
+text_index_documents = REGISTRY.gauge(
+    "kuna_text_index_documents", "Therapists in this process's text index")
+
+
+def time_stage(stage: str):
+    """Context manager timing one matching pipeline stage"""
+    return pipeline_stage_seconds.time(stage=stage)
@@ -0,0 +1,140 @@
+#!/usr/bin/env python3
+"""
+Schema migrations, run once per deploy before the app starts.
+
+Creates missing tables, then adds columns that exist on the models but not in
+the database (SQLite and PostgreSQL both support ADD COLUMN), then creates the
+unique index on model_results that create_all only adds to new tables, drops
+indexes earlier deploys created and nothing uses any more, then runs the
+dialect-specific steps in MIGRATIONS. Every step is idempotent, so running it
+again is a no-op. The app itself never changes the schema.
+
+Usage:
+    python migrate.py
+"""
+
+import logging
+import sys
+import time
+from typing import Callable, List
+
+from sqlalchemy import inspect, text
+from sqlalchemy.schema import CreateColumn
+
+import cache_versions
+from database import Base, engine, init_db
+from attributes import ATTRIBUTE_FIELDS, backfill_attributes
+from availability import backfill_masks
+from geo import backfill_coordinates
+
+logger = logging.getLogger(__name__)
+
+# Extra idempotent steps, each called with an open connection in a transaction
+# and returning the number of therapist rows it changed
+MIGRATIONS: List[Callable] = [
+    backfill_coordinates,
+    backfill_masks,
+    backfill_attributes,
+]
+
+
+def add_missing_columns(connection) -> List[str]:
+    """ALTER TABLE ... ADD COLUMN for model columns missing from the database"""
+    inspector = inspect(connection)
+    added = []
+    for table in Base.metadata.sorted_tables:
+        existing = {c["name"] for c in inspector.get_columns(table.name)}
+        for column in table.columns:
+            if column.name in existing:
+                continue
+            ddl = CreateColumn(column).compile(dialect=connection.dialect)
+            connection.exec_driver_sql(
+                f"ALTER TABLE {table.name} ADD COLUMN {ddl}")
+            added.append(f"{table.name}.{column.name}")
+    return added
+
+
+def add_model_results_unique_index(connection) -> int:
+    """Deduplicate model_results and make (comparison_id, model_name) unique.
+
+    Tables created before the constraint existed may hold several results per
+    model and session; the latest one is kept. Returns the rows deleted, or
+    -1 if the index already existed.
+    """
+    inspector = inspect(connection)
+    columns = ["comparison_id", "model_name"]
+    unique = [c["column_names"] for c in inspector.get_unique_constraints("model_results")]
+    unique += [i["column_names"] for i in inspector.get_indexes("model_results") if i["unique"]]
+    if columns in unique:
+        return -1
+    deleted = connection.execute(text(
+        "DELETE FROM model_results WHERE id IN ("
+        " SELECT id FROM ("
+        "  SELECT id, ROW_NUMBER() OVER ("
+        "   PARTITION BY comparison_id, model_name ORDER BY created_at DESC, id DESC) AS position"
+        "  FROM model_results) ranked"
+        " WHERE position > 1)")).rowcount
+    if deleted:
+        # Cached responses may show a result that was dropped
+        cache_versions.bump(connection, "results")
+    connection.execute(text(
+        "CREATE UNIQUE INDEX uq_model_results_comparison_model "
+        "ON model_results (comparison_id, model_name)"))
+    return deleted
+
+
+def drop_attribute_gin_indexes(connection) -> List[str]:
+    """Drop the GIN indexes over the therapists' list columns (PostgreSQL only).
+
+    Earlier deploys created ix_therapists_<field>_gin for jsonb containment
+    queries; attribute filters read therapist_attributes instead, so the
+    indexes only slowed down writes. Returns the indexes dropped.
+    """
+    if connection.dialect.name != "postgresql":
+        return []
+    # pg_indexes also lists expression indexes
+    existing = set(connection.execute(text(
+        "SELECT indexname FROM pg_indexes WHERE tablename = 'therapists'")).scalars())
+    dropped = []
+    for field in ATTRIBUTE_FIELDS:
+        name = f"ix_therapists_{field}_gin"
+        if name in existing:
+            connection.execute(text(f"DROP INDEX IF EXISTS {name}"))
+            dropped.append(name)
+    return dropped
+
+
+def migrate() -> None:
+    started = time.perf_counter()
+    init_db()
+    with engine.begin() as connection:
+        for column in add_missing_columns(connection):
+            print(f"✓ Added column: {column}")
+        deduplicated = add_model_results_unique_index(connection)
+        if deduplicated >= 0:
+            print(f"✓ Added unique index on model_results ({deduplicated} duplicates removed)")
+        for index in drop_attribute_gin_indexes(connection):
+            print(f"✓ Dropped unused index: {index}")
+        changed = 0
+        for step in MIGRATIONS:
+            changed += step(connection) or 0
+        if changed:
+            # Backfilled rows: running servers and catalog snapshots are stale
+            cache_versions.bump(connection, "therapists")
+    print(
+        f"✓ Schema up to date ({(time.perf_counter() - started) * 1000:.0f}ms)")
+
+
+def main():
+    """Main function"""
+    logging.basicConfig(level=logging.INFO)
+    try:
+        migrate()
+    except Exception as e:
+        print(f"✗ Migration failed: {e}")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
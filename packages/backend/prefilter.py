@@ -0,0 +1,283 @@
+"""
+Candidate pre-filter and local scorer for the matching models.
+
+Before a model sees the catalog, every active therapist gets a cheap local
+score against the patient's answers and only the best
+PREFILTER_MAX_CANDIDATES are passed on, so prompts stay small however large
+the catalog grows. The random control group always sees the full catalog.
+
+The score combines location, topical overlap, shared hours and bio text:
+
+- Location: the patient's city is resolved offline from their answers
+  (geo.py), using a country they name to tell apart cities that exist in
+  several countries. Patients who want in-person sessions are matched to on-site and
+  hybrid therapists through the spatial index, scoring higher the closer they
+  are within PREFILTER_RADIUS_KM; remote therapists score for patients who
+  accept online sessions.
+- Topics: how many of the concepts of the therapist's specialties,
+  approaches, styles, age groups and languages (vocabulary.py) the patient
+  picked or mentioned, as a popcount over per-catalog concept bitmaps.
+- Hours: how many hours of the week the therapist's parsed schedule shares
+  with the patient's availability answers (availability.py), counted for the
+  whole catalog in one AND-and-popcount pass.
+- Text: cosine similarity of the therapist's bio to everything the patient
+  wrote, from the TF-IDF index (text_index.py), relative to the best match.
+
+The patient's profile is cached by the key of their answer features
+(features.py), so the models of one session build it once.
+
+With LOCAL_TFIDF_MODEL=1 the same ranking also competes as a model of its
+own, LOCAL_MODEL, whose match is simply the best-scored therapist.
+"""
+
+import heapq
+import os
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, Iterable, List, Optional, Set, Tuple
+
+import availability
+import geo
+import text_index
+import vocabulary
+from geo import SpatialIndex, normalize_place
+from vocabulary import Vocabulary
+
+PREFILTER_MAX_CANDIDATES = int(os.getenv("PREFILTER_MAX_CANDIDATES", 50))
+PREFILTER_RADIUS_KM = float(os.getenv("PREFILTER_RADIUS_KM", 50))
+# Bios most similar to the patient's answers that get a text score
+PREFILTER_TEXT_CANDIDATES = int(os.getenv("PREFILTER_TEXT_CANDIDATES", 500))
+
+# The local ranking served as a matching model
+LOCAL_MODEL = "local-tfidf"
+
+LOCATION_WEIGHT = 0.25
+TOPIC_WEIGHT = 0.4
+AVAILABILITY_WEIGHT = 0.15
+TEXT_WEIGHT = 0.2
+# Overlapping answers at which the topic score saturates
+TOPIC_SATURATION = 3
+# Shared weekly hours at which the availability score saturates
+AVAILABILITY_SATURATION_HOURS = 4
+# Patient profiles kept by answer features key, so the models of a session share one
+PROFILE_CACHE_SIZE = 256
+
+# Therapist fields compared with the patient's chosen options
+TOPIC_FIELDS = ("specialties", "therapeutic_approaches",
+                "therapeutic_style", "age_groups", "languages")
+
+# Normalized words in the modality answer
+IN_PERSON_WORDS = ("presencial", "hibrida", "hibrido", "en persona")
+REMOTE_WORDS = ("en linea", "online", "virtual", "remota", "remoto", "hibrida", "hibrido")
+ANY_MODALITY_WORDS = ("me da igual", "cualquiera", "indiferente")
+
+
+class PreparedCatalog:
+    """Per-catalog data the scorer reuses across requests"""
+
+    def __init__(self, therapists: List[Dict[str, Any]]):
+        self.index = SpatialIndex(therapists)
+        # Re-indexes only bios that changed since the index was last synced or loaded
+        text_index.index.sync(therapists)
+        # Rebuilt only when the catalog's labels change
+        self.vocabulary = vocabulary.compiled(vocabulary.catalog_labels(therapists))
+        # Bit of each concept, and each therapist's concepts as a bitmap
+        self.concept_bits: Dict[str, int] = {}
+        self.topics = [self._topic_mask(t) for t in therapists]
+        # Weekly hour bitmaps, 0 where the schedule is unknown
+        self.availability = [t.get("availability_mask") or 0 for t in therapists]
+
+    def _topic_mask(self, therapist: Dict[str, Any]) -> int:
+        mask = 0
+        for field in TOPIC_FIELDS:
+            for value in therapist.get(field) or ():
+                if isinstance(value, str):
+                    for concept in self.vocabulary.label_concepts(field, value):
+                        bit = self.concept_bits.setdefault(concept, len(self.concept_bits))
+                        mask |= 1 << bit
+        return mask
+
+    def concepts_mask(self, concepts: Set[str]) -> int:
+        """Bitmap of the patient's concepts that some therapist in this catalog has"""
+        mask = 0
+        for concept in concepts:
+            bit = self.concept_bits.get(concept)
+            if bit is not None:
+                mask |= 1 << bit
+        return mask
+
+
+# The prepared form of the last catalog list seen; catalog_cache hands out
+# the same list object until it reloads
+_prepared: Tuple[Optional[list], Optional[PreparedCatalog]] = (None, None)
+
+
+def prepare(therapists: List[Dict[str, Any]]) -> PreparedCatalog:
+    global _prepared
+    catalog, prepared = _prepared
+    if catalog is not therapists:
+        prepared = PreparedCatalog(therapists)
+        _prepared = (therapists, prepared)
+    return prepared
+
+
+def _answer_texts(user_answers: Iterable[Dict[str, Any]]) -> List[str]:
+    texts = []
+    for item in user_answers:
+        answer = item.get("answer")
+        values = answer if isinstance(answer, list) else [answer]
+        texts.extend(v for v in values if isinstance(v, str) and v.strip())
+    return texts
+
+
+def patient_profile(user_answers: List[Dict[str, Any]],
+                    vocab: Optional[Vocabulary] = None) -> Dict[str, Any]:
+    """What the pre-filter needs from the answers: place, modality, concepts and hours"""
+    vocab = vocab or vocabulary.base()
+    texts = _answer_texts(user_answers)
+    normalized = [normalize_place(t) for t in texts]
+
+    place = None
+    gazetteer = geo.gazetteer()
+    # Tells "Valencia" in Spain from the one in Venezuela; ambiguous places stay unknown
+    country = next((c for c in map(gazetteer.find_country, texts) if c), None)
+    # A short answer that is just a city beats a city mentioned in passing
+    for text, norm in zip(texts, normalized):
+        if len(norm.split()) <= 4:
+            place = gazetteer.lookup(text, country)
+            if place:
+                break
+    if place is None:
+        for text in texts:
+            place = gazetteer.find_in_text(text, country)
+            if place:
+                break
+
+    in_person = any(w in n for n in normalized for w in IN_PERSON_WORDS)
+    remote = any(w in n for n in normalized for w in REMOTE_WORDS)
+    if any(w in n for n in normalized for w in ANY_MODALITY_WORDS) or not (in_person or remote):
+        in_person = remote = True
+
+    return {
+        "place": place,
+        "in_person": in_person,
+        "remote": remote,
+        "concepts": {c for text in texts for c in vocab.concepts(text)},
+        "availability": availability.patient_mask(user_answers),
+        "text": "\n".join(texts),
+    }
+
+
+_profiles_lock = threading.Lock()
+_profiles: "OrderedDict[Tuple[str, str], Dict[str, Any]]" = OrderedDict()
+
+
+def cached_profile(user_answers: List[Dict[str, Any]], vocab: Vocabulary,
+                   profile_key: Optional[str] = None) -> Dict[str, Any]:
+    """patient_profile, computed once per answers and vocabulary when profile_key is given"""
+    if profile_key is None:
+        return patient_profile(user_answers, vocab)
+    key = (profile_key, vocab.version)
+    with _profiles_lock:
+        profile = _profiles.get(key)
+        if profile is not None:
+            _profiles.move_to_end(key)
+            return profile
+    profile = patient_profile(user_answers, vocab)
+    with _profiles_lock:
+        _profiles[key] = profile
+        while len(_profiles) > PROFILE_CACHE_SIZE:
+            _profiles.popitem(last=False)
+    return profile
+
+
+def location_score(therapist: Dict[str, Any], profile: Dict[str, Any],
+                   distance_km: Optional[float]) -> float:
+    """1 for a nearby in-person therapist, down to 0 for one the patient cannot see"""
+    score = 0.0
+    if profile["in_person"] and distance_km is not None:
+        score = 1.0 - 0.5 * min(1.0, distance_km / PREFILTER_RADIUS_KM)
+    if profile["remote"] and therapist.get("remote"):
+        # Remote sessions work from anywhere; in-person nearby is still preferred
+        score = max(score, 0.5 if profile["in_person"] else 1.0)
+    if profile["place"] is None and profile["in_person"] and not profile["remote"]:
+        # Location unknown: only modality can be judged
+        score = max(score, 0.5 if therapist.get("on_site") or therapist.get("hybrid") else 0.0)
+    return score
+
+
+def topic_score(hits: int) -> float:
+    """Share of the saturation count of therapist topic values the patient picked"""
+    return min(1.0, hits / TOPIC_SATURATION)
+
+
+def availability_score(mask: int, shared_hours: int, profile: Dict[str, Any]) -> float:
+    """Share of the saturation count of hours both have free; 0.5 if the therapist's are unknown"""
+    if not profile["availability"]:
+        return 0.0
+    if not mask:
+        return 0.5
+    return min(1.0, shared_hours / AVAILABILITY_SATURATION_HOURS)
+
+
+def score(therapist: Dict[str, Any], profile: Dict[str, Any], distance_km: Optional[float] = None,
+          topic_hits: int = 0, mask: int = 0, shared_hours: int = 0, text_score: float = 0.0) -> float:
+    """Local match score in [0, 1]"""
+    return (LOCATION_WEIGHT * location_score(therapist, profile, distance_km)
+            + TOPIC_WEIGHT * topic_score(topic_hits)
+            + AVAILABILITY_WEIGHT * availability_score(mask, shared_hours, profile)
+            + TEXT_WEIGHT * text_score)
+
+
+def similar_bios(profile: Dict[str, Any]) -> Dict[str, float]:
+    """Text score of the bios closest to the patient's answers, 1 for the closest, by therapist id"""
+    found = text_index.index.search(profile["text"], PREFILTER_TEXT_CANDIDATES)
+    if not found or found[0][1] <= 0:
+        return {}
+    best = found[0][1]
+    return {therapist_id: similarity / best for therapist_id, similarity in found}
+
+
+def nearby(prepared: PreparedCatalog, profile: Dict[str, Any]) -> Dict[str, float]:
+    """Distance in km of in-person therapists within the radius, by therapist id"""
+    place = profile["place"]
+    if place is None or not profile["in_person"]:
+        return {}
+    return {t["id"]: distance for t, distance in
+            prepared.index.within_km(place.lat, place.lon, PREFILTER_RADIUS_KM)}
+
+
+def rank(therapists: List[Dict[str, Any]], user_answers: List[Dict[str, Any]],
+         limit: int, profile_key: Optional[str] = None,
+         candidate_ids: Optional[Set[str]] = None) -> List[Tuple[Dict[str, Any], float]]:
+    """The limit best therapists with their local score, best first; only candidate_ids if given"""
+    prepared = prepare(therapists)
+    profile = cached_profile(user_answers, prepared.vocabulary, profile_key)
+    distances = nearby(prepared, profile)
+    texts = similar_bios(profile)
+    # Topic and hour overlaps are popcounts over the whole catalog
+    concepts = prepared.concepts_mask(profile["concepts"])
+    hits = [(topics & concepts).bit_count() for topics in prepared.topics]
+    shared = availability.overlap_hours(prepared.availability, profile["availability"])
+    scores = [score(t, profile, distances.get(t["id"]), topic_hits, mask, hours, texts.get(t["id"], 0.0))
+              for t, topic_hits, mask, hours in zip(therapists, hits, prepared.availability, shared)]
+    indexes = range(len(therapists))
+    if candidate_ids is not None:
+        indexes = [i for i, t in enumerate(therapists) if t["id"] in candidate_ids]
+    best = heapq.nlargest(limit, indexes, key=scores.__getitem__)
+    return [(therapists[i], scores[i]) for i in best]
+
+
+def select_candidates(therapists: List[Dict[str, Any]], user_answers: List[Dict[str, Any]],
+                      limit: int = PREFILTER_MAX_CANDIDATES,
+                      profile_key: Optional[str] = None,
+                      candidate_ids: Optional[Set[str]] = None) -> List[Dict[str, Any]]:
+    """The limit best therapists by local score, best first; all of them if limit is 0.
+
+    With candidate_ids (attributes.candidate_ids), only those therapists.
+    """
+    if limit <= 0 or len(therapists) <= limit:
+        if candidate_ids is not None:
+            return [t for t in therapists if t["id"] in candidate_ids]
+        return therapists
+    return [t for t, _ in rank(therapists, user_answers, limit, profile_key, candidate_ids)]
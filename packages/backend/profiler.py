@@ -0,0 +1,184 @@
+"""
+On-demand statistical sampling profiler.
+
+A sampling thread reads every thread's current Python stack with
+sys._current_frames() at a fixed interval and counts identical stacks. The
+output is in collapsed-stack format ("frame;frame;frame count" per line),
+which flamegraph.pl, speedscope or inferno turn into a flame graph.
+
+Nothing runs while no session is active. Sessions either sample for a fixed
+number of seconds, or sample only while requests to one route are in flight
+until N of them have finished. At most PROFILER_MAX_SESSIONS sessions run at
+once.
+"""
+
+import asyncio
+import os
+import sys
+import threading
+import time
+from collections import Counter
+from typing import Dict, Optional
+
+from starlette.routing import Match
+
+PROFILER_MAX_SESSIONS = int(os.getenv("PROFILER_MAX_SESSIONS", 1))
+MAX_PROFILE_SECONDS = 120
+MIN_INTERVAL_MS = 1.0
+
+# Leaf frames of threads that are waiting rather than working
+IDLE_LEAVES = {
+    "Condition.wait", "Event.wait", "Thread._wait_for_tstate_lock", "Thread.join",
+    "EpollSelector.select", "KqueueSelector.select", "PollSelector.select",
+    "SelectSelector.select", "BaseSelector.select", "Queue.get", "_worker",
+    "socket.accept", "BaseServer.serve_forever", "sleep", "LoopWatchdog._watch",
+}
+
+_slots = threading.BoundedSemaphore(PROFILER_MAX_SESSIONS)
+_route_sessions: Dict[str, "ProfileSession"] = {}
+_route_lock = threading.Lock()
+
+
+class ProfilerBusy(Exception):
+    """Raised when the maximum number of profiling sessions is already running"""
+
+
+def _frame_label(frame) -> str:
+    code = frame.f_code
+    name = getattr(code, "co_qualname", code.co_name)
+    return f"{name} ({os.path.basename(code.co_filename)})".replace(";", ":")
+
+
+class ProfileSession:
+    def __init__(self, interval_ms: float, include_idle: bool = False):
+        self.interval = max(interval_ms, MIN_INTERVAL_MS) / 1000
+        self.include_idle = include_idle
+        self.stacks = Counter()
+        self.samples = 0
+        self.started_at = None
+        self.duration = 0.0
+
+        # Route mode
+        self.route: Optional[str] = None
+        self.requests_wanted = 0
+        self.requests_done = 0
+        self.in_flight = 0
+        self._done = threading.Event()
+        self._lock = threading.Lock()
+
+    def _sample(self, own_thread: int):
+        names = {t.ident: t.name for t in threading.enumerate()}
+        for thread_id, frame in sys._current_frames().items():
+            if thread_id == own_thread:
+                continue
+            labels = []
+            leaf = getattr(frame.f_code, "co_qualname", frame.f_code.co_name)
+            if not self.include_idle and leaf in IDLE_LEAVES:
+                continue
+            while frame is not None:
+                labels.append(_frame_label(frame))
+                frame = frame.f_back
+            labels.append(names.get(thread_id, str(thread_id)))
+            self.stacks[";".join(reversed(labels))] += 1
+        self.samples += 1
+
+    def run_for(self, seconds: float) -> None:
+        """Sample every thread for a fixed time"""
+        own_thread = threading.get_ident()
+        self.started_at = time.monotonic()
+        deadline = self.started_at + min(seconds, MAX_PROFILE_SECONDS)
+        while time.monotonic() < deadline:
+            self._sample(own_thread)
+            time.sleep(self.interval)
+        self.duration = time.monotonic() - self.started_at
+
+    def run_for_route(self, route: str, requests: int, timeout: float) -> None:
+        """Sample while requests to a route are in flight until enough have finished"""
+        self.route = route
+        self.requests_wanted = requests
+        with _route_lock:
+            if route in _route_sessions:
+                raise ProfilerBusy(f"Route {route} is already being profiled")
+            _route_sessions[route] = self
+        own_thread = threading.get_ident()
+        self.started_at = time.monotonic()
+        deadline = self.started_at + min(timeout, MAX_PROFILE_SECONDS)
+        try:
+            while not self._done.is_set() and time.monotonic() < deadline:
+                if self.in_flight:
+                    self._sample(own_thread)
+                time.sleep(self.interval)
+        finally:
+            with _route_lock:
+                _route_sessions.pop(route, None)
+            self.duration = time.monotonic() - self.started_at
+
+    def request_started(self):
+        with self._lock:
+            self.in_flight += 1
+
+    def request_finished(self):
+        with self._lock:
+            self.in_flight -= 1
+            self.requests_done += 1
+            if self.requests_done >= self.requests_wanted:
+                self._done.set()
+
+    def collapsed(self) -> str:
+        """Collapsed stacks, one "frames count" line per distinct stack"""
+        return "".join(f"{stack} {count}\n" for stack, count in self.stacks.most_common())
+
+
+class RouteProfilerMiddleware:
+    """ASGI middleware feeding route-mode sessions; a dict check when idle"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if not _route_sessions or scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        session = None
+        for route in scope["app"].routes:
+            match, _ = route.matches(scope)
+            if match == Match.FULL:
+                session = _route_sessions.get(getattr(route, "path", None))
+                break
+        if session is None:
+            await self.app(scope, receive, send)
+            return
+
+        session.request_started()
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            session.request_finished()
+
+
+def acquire_slot() -> None:
+    if not _slots.acquire(blocking=False):
+        raise ProfilerBusy(
+            f"At most {PROFILER_MAX_SESSIONS} profiling session(s) may run at once")
+
+
+def release_slot() -> None:
+    _slots.release()
+
+
+async def run_in_slot(fn, *args):
+    """Run fn(*args) in the default executor while holding a profiling slot
+
+    The slot is released when fn returns rather than when the caller stops
+    waiting, so clients that disconnect cannot start more than
+    PROFILER_MAX_SESSIONS samplers.
+    """
+    acquire_slot()
+    try:
+        future = asyncio.get_running_loop().run_in_executor(None, fn, *args)
+    except BaseException:
+        release_slot()
+        raise
+    future.add_done_callback(lambda _: release_slot())
+    return await asyncio.shield(future)
@@ -0,0 +1,126 @@
+"""
+SQL query instrumentation.
+
+Cursor execution hooks on the engine time every statement. Within a request
+(see begin_request/end_request) they also keep the query count, total DB
+time and how often each statement template ran. Statements slower than
+SLOW_QUERY_MS are logged with the shape of their parameters (types only,
+never values). A template that repeats N_PLUS_ONE_THRESHOLD times or more in
+one request is reported as a likely N+1.
+"""
+
+import contextvars
+import logging
+import os
+import time
+from collections import Counter
+from typing import Any, List, Optional, Tuple
+
+from sqlalchemy import event
+
+from metrics import REGISTRY
+
+logger = logging.getLogger(__name__)
+
+SLOW_QUERY_MS = float(os.getenv("SLOW_QUERY_MS", 200))
+N_PLUS_ONE_THRESHOLD = int(os.getenv("N_PLUS_ONE_THRESHOLD", 5))
+
+db_query_seconds = REGISTRY.histogram(
+    "kuna_db_query_seconds", "SQL statement execution time", ("operation",))
+db_slow_queries_total = REGISTRY.counter(
+    "kuna_db_slow_queries_total", "SQL statements slower than SLOW_QUERY_MS", ("operation",))
+db_n_plus_one_total = REGISTRY.counter(
+    "kuna_db_n_plus_one_total", "Requests that repeated a statement template", ("route",))
+
+
+class RequestQueryStats:
+    def __init__(self):
+        self.count = 0
+        self.total_seconds = 0.0
+        self.templates = Counter()
+
+    def repeated_templates(self, threshold: int = N_PLUS_ONE_THRESHOLD) -> List[Tuple[str, int]]:
+        return [(t, n) for t, n in self.templates.most_common() if n >= threshold]
+
+
+_current: contextvars.ContextVar[Optional[RequestQueryStats]] = contextvars.ContextVar(
+    "request_query_stats", default=None)
+
+
+def begin_request() -> contextvars.Token:
+    """Start collecting query stats for the current request"""
+    return _current.set(RequestQueryStats())
+
+
+def current() -> Optional[RequestQueryStats]:
+    return _current.get()
+
+
+def end_request(token: contextvars.Token, route: str) -> RequestQueryStats:
+    """Stop collecting, report likely N+1 patterns and return the stats"""
+    stats = _current.get()
+    _current.reset(token)
+    repeated = stats.repeated_templates()
+    if repeated:
+        db_n_plus_one_total.inc(route=route)
+        for template, count in repeated:
+            logger.warning(
+                f"Likely N+1 in {route}: statement ran {count} times: {_shorten(template)}")
+    return stats
+
+
+def _shorten(statement: str, limit: int = 300) -> str:
+    statement = " ".join(statement.split())
+    return statement if len(statement) <= limit else statement[:limit] + "..."
+
+
+def _operation(statement: str) -> str:
+    return statement.lstrip().split(" ", 1)[0].upper() or "OTHER"
+
+
+def parameters_shape(parameters: Any, executemany: bool = False) -> Any:
+    """Describe parameters by type so slow-query logs never contain values"""
+    if executemany and isinstance(parameters, (list, tuple)):
+        first = parameters[0] if parameters else None
+        return {"rows": len(parameters), "row": parameters_shape(first)}
+    if isinstance(parameters, dict):
+        return {k: type(v).__name__ for k, v in parameters.items()}
+    if isinstance(parameters, (list, tuple)):
+        return [type(v).__name__ for v in parameters]
+    return type(parameters).__name__
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault("query_start", []).append(time.perf_counter())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    elapsed = time.perf_counter() - conn.info["query_start"].pop()
+    operation = _operation(statement)
+    db_query_seconds.observe(elapsed, operation=operation)
+
+    stats = _current.get()
+    if stats is not None:
+        stats.count += 1
+        stats.total_seconds += elapsed
+        stats.templates[statement] += 1
+
+    if elapsed * 1000 >= SLOW_QUERY_MS:
+        db_slow_queries_total.inc(operation=operation)
+        logger.warning(
+            f"Slow query ({elapsed * 1000:.1f}ms) params={parameters_shape(parameters, executemany)}: {_shorten(statement)}")
+
+
+def _handle_error(exception_context):
+    # Failed statements never reach after_cursor_execute
+    conn = exception_context.connection
+    if conn is not None and conn.info.get("query_start"):
+        conn.info["query_start"].pop()
+
+
+def instrument_engine(engine) -> None:
+    """Attach the timing hooks to an engine"""
+    if not event.contains(engine, "before_cursor_execute", _before_cursor_execute):
+        event.listen(engine, "before_cursor_execute", _before_cursor_execute)
+        event.listen(engine, "after_cursor_execute", _after_cursor_execute)
+        event.listen(engine, "handle_error", _handle_error)
@@ -0,0 +1,205 @@
+#!/usr/bin/env python3
+"""
+Retention of questionnaire sessions.
+
+Sessions older than RETENTION_DAYS are moved out of model_comparisons,
+model_results, user_selections, model_allocations and matching_jobs into
+compressed archive files, RETENTION_BATCH_SIZE sessions at a time. Each batch
+is written as gzip NDJSON, one file per day the sessions were created, under
+ARCHIVE_DIR/sessions/date=YYYY-MM-DD/, one line per session with its answers,
+results, selections and allocations. Once the files are on disk, the batch is
+deleted from the live tables and each session recorded in archived_sessions
+with its file, in one transaction; a crash in between leaves an unreferenced
+file and the sessions are archived again on the next run. Sessions with jobs
+still pending or running are skipped.
+
+Archived sessions stay readable: get_results loads one from its file on
+demand, and rollup rebuilds count the archive too. Cached results stay valid
+(an archived session's results do not change); the known-sessions cache is
+invalidated, since the sessions no longer take selections.
+
+Usage:
+    python retention.py                     # archive sessions older than RETENTION_DAYS
+    python retention.py --days 90 --vacuum  # then give the space back (SQLite)
+"""
+
+import argparse
+import gzip
+import json
+import logging
+import os
+import sys
+import time
+import uuid
+from collections import defaultdict
+from datetime import datetime, timedelta
+from typing import Any, Dict, Iterator, List, Optional
+
+from sqlalchemy import delete, exists, insert, select, text
+from sqlalchemy.orm import Session
+
+import cache_versions
+from database import (ArchivedSession, MatchingJob, ModelAllocation, ModelComparison,
+                      ModelResult, UserSelection)
+
+logger = logging.getLogger(__name__)
+
+RETENTION_DAYS = int(os.getenv("RETENTION_DAYS", 365))
+RETENTION_BATCH_SIZE = int(os.getenv("RETENTION_BATCH_SIZE", 500))
+ARCHIVE_DIR = os.getenv("ARCHIVE_DIR", "./data/archive")
+
+
+def _time(value: Optional[datetime]) -> Optional[str]:
+    return value.isoformat() if value else None
+
+
+def parse_time(value: Optional[str]) -> Optional[datetime]:
+    return datetime.fromisoformat(value) if value else None
+
+
+def _write_partition(relative_path: str, records: List[Dict[str, Any]]) -> None:
+    path = os.path.join(ARCHIVE_DIR, relative_path)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    temporary = f"{path}.tmp"
+    with open(temporary, "wb") as raw:
+        with gzip.GzipFile(fileobj=raw, mode="wb") as f:
+            for record in records:
+                f.write(json.dumps(record, ensure_ascii=False).encode("utf-8") + b"\n")
+        raw.flush()
+        os.fsync(raw.fileno())
+    os.replace(temporary, path)
+
+
+def archive_batch(connection, cutoff: datetime, batch_size: int = RETENTION_BATCH_SIZE) -> int:
+    """Archive the oldest batch of sessions created before cutoff; returns how many"""
+    comparisons = ModelComparison.__table__
+    results = ModelResult.__table__
+    selections = UserSelection.__table__
+    allocations = ModelAllocation.__table__
+    jobs = MatchingJob.__table__
+
+    unfinished = exists().where(jobs.c.comparison_id == comparisons.c.id,
+                                jobs.c.status.in_(("pending", "running")))
+    sessions = connection.execute(
+        select(comparisons.c.id, comparisons.c.email,
+               comparisons.c.questionnaire_answers, comparisons.c.created_at)
+        .where(comparisons.c.created_at < cutoff, ~unfinished)
+        .order_by(comparisons.c.created_at, comparisons.c.id)
+        .limit(batch_size)).all()
+    if not sessions:
+        return 0
+    ids = [s.id for s in sessions]
+
+    children = defaultdict(lambda: {"results": [], "selections": [], "allocations": []})
+    for r in connection.execute(select(results).where(results.c.comparison_id.in_(ids))):
+        children[r.comparison_id]["results"].append({
+            "model_name": r.model_name, "matches": r.matches,
+            "processing_time_ms": r.processing_time_ms, "created_at": _time(r.created_at)})
+    for s in connection.execute(select(selections).where(selections.c.comparison_id.in_(ids))):
+        children[s.comparison_id]["selections"].append({
+            "selected_model": s.selected_model, "selected_therapist_id": s.selected_therapist_id,
+            "feedback": s.feedback, "created_at": _time(s.created_at)})
+    for a in connection.execute(select(allocations).where(allocations.c.comparison_id.in_(ids))):
+        children[a.comparison_id]["allocations"].append({
+            "model_name": a.model_name, "inclusion_probability": a.inclusion_probability,
+            "allocated": a.allocated, "created_at": _time(a.created_at)})
+
+    # One file per creation day; the id comes first so lookups can skip other lines
+    partitions: Dict[str, List[Dict[str, Any]]] = defaultdict(list)
+    paths = {}
+    batch = uuid.uuid4().hex
+    for session in sessions:
+        day = (session.created_at or datetime.utcnow()).date()
+        relative_path = os.path.join("sessions", f"date={day.isoformat()}", f"{batch}.ndjson.gz")
+        partitions[relative_path].append({
+            "id": session.id, "email": session.email,
+            "questionnaire_answers": session.questionnaire_answers,
+            "created_at": _time(session.created_at), **children[session.id]})
+        paths[session.id] = relative_path
+    for relative_path, records in partitions.items():
+        _write_partition(relative_path, records)
+
+    archived_at = datetime.utcnow()
+    connection.execute(insert(ArchivedSession.__table__), [
+        {"id": s.id, "path": paths[s.id], "created_at": s.created_at, "archived_at": archived_at}
+        for s in sessions])
+    for table in (results, selections, allocations, jobs):
+        connection.execute(delete(table).where(table.c.comparison_id.in_(ids)))
+    connection.execute(delete(comparisons).where(comparisons.c.id.in_(ids)))
+    cache_versions.bump(connection, "sessions")
+    return len(sessions)
+
+
+def archive(engine, cutoff: datetime, batch_size: int = RETENTION_BATCH_SIZE) -> int:
+    """Archive every session created before cutoff, one transaction per batch"""
+    total = 0
+    while True:
+        started = time.perf_counter()
+        with engine.begin() as connection:
+            archived = archive_batch(connection, cutoff, batch_size)
+        if not archived:
+            return total
+        total += archived
+        logger.info(
+            f"Archived {archived} sessions in {(time.perf_counter() - started) * 1000:.0f}ms ({total} so far)")
+
+
+def read_archived(db: Session, session_id: str) -> Optional[Dict[str, Any]]:
+    """The archived record of a session, None if it was never archived"""
+    relative_path = db.query(ArchivedSession.path).filter(
+        ArchivedSession.id == session_id).scalar()
+    if relative_path is None:
+        return None
+    prefix = json.dumps({"id": session_id})[:-1].encode("utf-8")
+    with gzip.open(os.path.join(ARCHIVE_DIR, relative_path), "rb") as f:
+        for line in f:
+            if line.startswith(prefix):
+                return json.loads(line)
+    logger.warning(f"Archived session {session_id} not found in {relative_path}")
+    return None
+
+
+def archived_results(record: Dict[str, Any]) -> List[ModelResult]:
+    """The results of an archived session as (unsaved) ModelResult rows"""
+    return [
+        ModelResult(comparison_id=record["id"], model_name=r["model_name"], matches=r["matches"],
+                    processing_time_ms=r["processing_time_ms"], created_at=parse_time(r["created_at"]))
+        for r in record["results"]
+    ]
+
+
+def iter_archive(db: Session) -> Iterator[Dict[str, Any]]:
+    """Every archived session record"""
+    paths = [p for (p,) in db.query(ArchivedSession.path).distinct().order_by(ArchivedSession.path)]
+    for relative_path in paths:
+        with gzip.open(os.path.join(ARCHIVE_DIR, relative_path), "rb") as f:
+            for line in f:
+                yield json.loads(line)
+
+
+def main(argv=None):
+    """Main function"""
+    from database import engine, init_db
+
+    parser = argparse.ArgumentParser(description="Archive old questionnaire sessions")
+    parser.add_argument("--days", type=int, default=RETENTION_DAYS,
+                        help="Archive sessions created more than this many days ago")
+    parser.add_argument("--batch-size", type=int, default=RETENTION_BATCH_SIZE)
+    parser.add_argument("--vacuum", action="store_true",
+                        help="VACUUM the database afterwards so the file shrinks (SQLite)")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO)
+    init_db()
+    cutoff = datetime.utcnow() - timedelta(days=args.days)
+    archived = archive(engine, cutoff, args.batch_size)
+    print(f"✓ Archived {archived} sessions created before {cutoff:%Y-%m-%d %H:%M} to {ARCHIVE_DIR}")
+    if args.vacuum and archived and engine.dialect.name == "sqlite":
+        with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as connection:
+            connection.execute(text("VACUUM"))
+        print("✓ Database vacuumed")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
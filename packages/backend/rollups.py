@@ -0,0 +1,254 @@
+#!/usr/bin/env python3
+"""
+Incremental per-model, per-day rollups of results, selections and latency.
+
+Every ModelResult and UserSelection written through a session adds to
+model_daily_rollups and model_latency_buckets in the same transaction, using
+atomic upserts so concurrent writers never lose counts. Latency is kept as
+counts over fixed, log-spaced buckets, which can be merged across days to
+answer p50/p95/p99. Dashboard queries read only these tables, so they cost
+the same no matter how much history is kept.
+
+To rebuild the rollups from existing history:
+
+    python rollups.py --rebuild
+"""
+
+import argparse
+import sys
+from bisect import bisect_right
+from collections import defaultdict
+from datetime import date, datetime, timedelta
+from itertools import chain
+from typing import Any, Dict, Iterable, List, Optional
+
+from sqlalchemy import event, func
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.orm import Session
+
+from database import ModelDailyRollup, ModelLatencyBucket, ModelResult, UserSelection
+
+# Upper bounds of the latency buckets in ms, growing by 1.5x from 1ms to ~10min
+LATENCY_BUCKET_BOUNDS_MS = [round(1.5 ** i, 3) for i in range(34)]
+
+
+def latency_bucket(processing_time_ms: float) -> int:
+    """Index of the bucket a latency falls into; the last bucket is open-ended"""
+    return bisect_right(LATENCY_BUCKET_BOUNDS_MS, processing_time_ms or 0.0)
+
+
+def _insert(connection):
+    if connection.dialect.name == "postgresql":
+        return postgresql.insert
+    return sqlite.insert
+
+
+def _increment(connection, model, keys: Dict[str, Any], increments: Dict[str, Any]):
+    """INSERT ... ON CONFLICT DO UPDATE SET col = col + excluded.col"""
+    table = model.__table__
+    stmt = _insert(connection)(table).values(**keys, **increments)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=list(keys),
+        set_={col: table.c[col] + stmt.excluded[col] for col in increments}
+    )
+    connection.execute(stmt)
+
+
+def record_result(connection, model_name: str, day: date, processing_time_ms: float, empty: bool):
+    """Add one model result to the rollups"""
+    _increment(connection, ModelDailyRollup,
+               {"day": day, "model_name": model_name},
+               {"results_count": 1, "empty_results_count": 1 if empty else 0,
+                "selections_count": 0, "latency_sum_ms": processing_time_ms or 0.0})
+    _increment(connection, ModelLatencyBucket,
+               {"day": day, "model_name": model_name,
+                "bucket": latency_bucket(processing_time_ms)},
+               {"count": 1})
+
+
+def record_selections(connection, selections: Iterable[Dict[str, Any]]):
+    """Add user selections (dicts with selected_model and created_at) to the rollups"""
+    counts = defaultdict(int)
+    for selection in selections:
+        created_at = selection.get("created_at") or datetime.utcnow()
+        counts[(created_at.date(), selection.get(
+            "selected_model") or "unknown")] += 1
+    for (day, model_name), count in counts.items():
+        _increment(connection, ModelDailyRollup,
+                   {"day": day, "model_name": model_name},
+                   {"results_count": 0, "empty_results_count": 0,
+                    "selections_count": count, "latency_sum_ms": 0.0})
+
+
+def _after_flush(session: Session, flush_context):
+    """Roll up results and selections inserted by this flush"""
+    new_results = [o for o in session.new if isinstance(o, ModelResult)]
+    new_selections = [o for o in session.new if isinstance(o, UserSelection)]
+    if not new_results and not new_selections:
+        return
+
+    connection = session.connection()
+    for result in new_results:
+        day = (result.created_at or datetime.utcnow()).date()
+        record_result(connection, result.model_name, day,
+                      result.processing_time_ms, not result.matches)
+    if new_selections:
+        record_selections(connection, [
+            {"selected_model": s.selected_model, "created_at": s.created_at}
+            for s in new_selections
+        ])
+
+
+def install(session_factory):
+    """Keep the rollups updated for every session created by session_factory"""
+    if not event.contains(session_factory, "after_flush", _after_flush):
+        event.listen(session_factory, "after_flush", _after_flush)
+
+
+def percentile(buckets: List[int], q: float) -> Optional[float]:
+    """Approximate percentile (0-1) from merged bucket counts, as a bucket upper bound"""
+    total = sum(buckets)
+    if not total:
+        return None
+    rank = q * total
+    seen = 0
+    for index, count in enumerate(buckets):
+        seen += count
+        if seen >= rank and count:
+            if index < len(LATENCY_BUCKET_BOUNDS_MS):
+                return LATENCY_BUCKET_BOUNDS_MS[index]
+            return LATENCY_BUCKET_BOUNDS_MS[-1]
+    return LATENCY_BUCKET_BOUNDS_MS[-1]
+
+
+def model_totals(db: Session) -> Dict[str, Dict[str, int]]:
+    """All-time shown and selected counts per model"""
+    rows = db.query(
+        ModelDailyRollup.model_name,
+        func.sum(ModelDailyRollup.results_count -
+                 ModelDailyRollup.empty_results_count),
+        func.sum(ModelDailyRollup.selections_count)
+    ).group_by(ModelDailyRollup.model_name).all()
+    return {
+        model_name: {"shown": int(shown or 0), "selected": int(selected or 0)}
+        for model_name, shown, selected in rows
+    }
+
+
+def model_stats(db: Session, days: int) -> Dict[str, Any]:
+    """Per-model win rates and latency percentiles over the last `days` days"""
+    since = datetime.utcnow().date() - timedelta(days=days - 1)
+    rollups = db.query(ModelDailyRollup).filter(
+        ModelDailyRollup.day >= since).all()
+    buckets = db.query(ModelLatencyBucket).filter(
+        ModelLatencyBucket.day >= since).all()
+
+    size = len(LATENCY_BUCKET_BOUNDS_MS) + 1
+    merged = defaultdict(lambda: [0] * size)
+    for b in buckets:
+        merged[b.model_name][b.bucket] += b.count
+
+    models = defaultdict(lambda: {"results": 0, "empty_results": 0,
+                                  "selections": 0, "latency_sum_ms": 0.0, "daily": []})
+    for r in sorted(rollups, key=lambda r: r.day):
+        m = models[r.model_name]
+        m["results"] += r.results_count
+        m["empty_results"] += r.empty_results_count
+        m["selections"] += r.selections_count
+        m["latency_sum_ms"] += r.latency_sum_ms
+        shown = r.results_count - r.empty_results_count
+        m["daily"].append({
+            "day": r.day.isoformat(),
+            "results": r.results_count,
+            "selections": r.selections_count,
+            "win_rate": r.selections_count / shown if shown else None,
+        })
+
+    response = {}
+    for model_name, m in models.items():
+        shown = m["results"] - m["empty_results"]
+        latency = merged.get(model_name, [0] * size)
+        response[model_name] = {
+            "results": m["results"],
+            "empty_results": m["empty_results"],
+            "selections": m["selections"],
+            "win_rate": m["selections"] / shown if shown else None,
+            "avg_processing_time_ms": m["latency_sum_ms"] / m["results"] if m["results"] else None,
+            "p50_processing_time_ms": percentile(latency, 0.50),
+            "p95_processing_time_ms": percentile(latency, 0.95),
+            "p99_processing_time_ms": percentile(latency, 0.99),
+            "daily": m["daily"],
+        }
+    return {"since": since.isoformat(), "days": days, "models": response}
+
+
+def rebuild(db: Session, batch_size: int = 1000) -> None:
+    """Recompute every rollup from model_results, user_selections and archived sessions"""
+    import retention
+
+    daily = defaultdict(lambda: {"results_count": 0, "empty_results_count": 0,
+                                 "selections_count": 0, "latency_sum_ms": 0.0})
+    latency = defaultdict(int)
+
+    results = db.query(ModelResult.model_name, ModelResult.created_at,
+                       ModelResult.processing_time_ms, ModelResult.matches).yield_per(batch_size)
+    selections = db.query(UserSelection.selected_model,
+                          UserSelection.created_at).yield_per(batch_size)
+    # Streamed, once for results and once for selections
+    archived_results = (
+        (r["model_name"], retention.parse_time(r["created_at"]), r["processing_time_ms"], r["matches"])
+        for record in retention.iter_archive(db) for r in record["results"])
+    archived_selections = (
+        (s["selected_model"], retention.parse_time(s["created_at"]))
+        for record in retention.iter_archive(db) for s in record["selections"])
+
+    for model_name, created_at, processing_time_ms, matches in chain(results, archived_results):
+        key = ((created_at or datetime.utcnow()).date(), model_name)
+        daily[key]["results_count"] += 1
+        daily[key]["empty_results_count"] += 0 if matches else 1
+        daily[key]["latency_sum_ms"] += processing_time_ms or 0.0
+        latency[key + (latency_bucket(processing_time_ms),)] += 1
+
+    for selected_model, created_at in chain(selections, archived_selections):
+        key = ((created_at or datetime.utcnow()).date(),
+               selected_model or "unknown")
+        daily[key]["selections_count"] += 1
+
+    db.query(ModelLatencyBucket).delete()
+    db.query(ModelDailyRollup).delete()
+    db.bulk_insert_mappings(ModelDailyRollup, [
+        {"day": day, "model_name": model_name, **counts}
+        for (day, model_name), counts in daily.items()
+    ])
+    db.bulk_insert_mappings(ModelLatencyBucket, [
+        {"day": day, "model_name": model_name, "bucket": bucket, "count": count}
+        for (day, model_name, bucket), count in latency.items()
+    ])
+    db.commit()
+
+
+def main(argv=None):
+    """Main function"""
+    from database import SessionLocal, init_db
+
+    parser = argparse.ArgumentParser(description="Model rollup maintenance")
+    parser.add_argument("--rebuild", action="store_true",
+                        help="Recompute the rollups from the full history")
+    args = parser.parse_args(argv)
+
+    if not args.rebuild:
+        parser.print_help()
+        return 1
+
+    init_db()
+    db = SessionLocal()
+    try:
+        rebuild(db)
+        print("✓ Rollups rebuilt")
+    finally:
+        db.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -47,6 +47,8 @@ class UserSelectionRequest(BaseModel):
     session_id: str  # Changed from comparison_id
     selected_therapist_id: str
     feedback: Optional[str] = None
+    # Client-generated id; a retry with the same id is stored once
+    selection_id: Optional[str] = None
 
 
 class SubmitQuestionnaireRequest(BaseModel):
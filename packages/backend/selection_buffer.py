@@ -0,0 +1,302 @@
+"""
+Write-behind buffer for user selections.
+
+/api/select-therapist validates the session against the known-sessions cache
+and hands the selection to this buffer instead of inserting it inside the
+request. A background thread flushes buffered selections in one transaction
+per batch, when SELECTION_FLUSH_BATCH_SIZE are waiting or every
+SELECTION_FLUSH_INTERVAL_SECONDS, so selections take one write lock per
+batch instead of one per click.
+
+Selections carry their id from the start (client-generated or assigned on
+arrival) and are inserted with ON CONFLICT DO NOTHING ... RETURNING, so a row
+written twice, by a client retry or a journal replay, is stored and rolled up
+once.
+
+With SELECTION_JOURNAL_DIR set, each selection is appended to an fsync'd
+journal segment before the request returns. A segment is deleted once its
+batch is committed. Every process holds an flock on the segments it writes;
+at startup a process replays and removes the segments nobody holds, which
+are the ones a crashed process left behind.
+
+A batch the database rejects is retried one selection at a time, so a single
+bad row (an unknown session, an oversized value) cannot hold back the rest.
+Rows that still fail are dead-lettered: logged, counted in
+kuna_selections_flushed_total{outcome="dead_letter"}, appended to
+dead-letter.ndjson in the journal directory, and dropped from the buffer.
+Errors that mean the database is unavailable keep the batch buffered instead.
+"""
+
+import fcntl
+import glob
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Tuple
+
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.exc import InterfaceError, OperationalError
+
+import rollups
+from database import UserSelection, engine as default_engine
+from metrics import selections_flushed_total, selection_flush_seconds
+
+logger = logging.getLogger(__name__)
+
+# "0" writes each selection inside its request
+SELECTION_WRITE_BEHIND = os.getenv("SELECTION_WRITE_BEHIND", "1") == "1"
+SELECTION_FLUSH_BATCH_SIZE = int(os.getenv("SELECTION_FLUSH_BATCH_SIZE", 200))
+SELECTION_FLUSH_INTERVAL_SECONDS = float(
+    os.getenv("SELECTION_FLUSH_INTERVAL_SECONDS", 1.0))
+# Empty disables the journal; buffered selections are then lost on a crash
+SELECTION_JOURNAL_DIR = os.getenv("SELECTION_JOURNAL_DIR", "")
+DEAD_LETTER_FILE = "dead-letter.ndjson"
+
+
+def _encode(selection: Dict[str, Any]) -> str:
+    return json.dumps({**selection, "created_at": selection["created_at"].isoformat()})
+
+
+def _decode(line: str) -> Dict[str, Any]:
+    selection = json.loads(line)
+    selection["created_at"] = datetime.fromisoformat(selection["created_at"])
+    return selection
+
+
+class _Segment:
+    """An append-only journal file, flock'd by the process writing it"""
+
+    def __init__(self, path: str):
+        self.path = path
+        # Locked under a temporary name so replay never sees it unlocked
+        self.file = open(f"{path}.new", "x", encoding="utf-8")
+        fcntl.flock(self.file.fileno(), fcntl.LOCK_EX)
+        os.rename(f"{path}.new", path)
+
+    def append(self, selection: Dict[str, Any]) -> None:
+        self.file.write(_encode(selection) + "\n")
+        self.file.flush()
+        os.fsync(self.file.fileno())
+
+    def remove(self) -> None:
+        os.unlink(self.path)
+        self.file.close()
+
+
+def write_selections(engine, selections: List[Dict[str, Any]]) -> int:
+    """Insert selections and roll up the ones not stored before; returns how many were new"""
+    if not selections:
+        return 0
+    with engine.begin() as connection:
+        insert = postgresql.insert if connection.dialect.name == "postgresql" else sqlite.insert
+        table = UserSelection.__table__
+        stmt = insert(table).on_conflict_do_nothing(
+            index_elements=["id"]).returning(table.c.id)
+        inserted = {row.id for row in connection.execute(stmt, selections)}
+        rollups.record_selections(
+            connection, [s for s in selections if s["id"] in inserted])
+    return len(inserted)
+
+
+def write_each(engine, selections: List[Dict[str, Any]]) -> List[Tuple[Dict[str, Any], Exception]]:
+    """Insert selections one transaction each; returns the rejected ones with their errors
+
+    Errors that mean the database is unavailable, not that a row is bad, are raised.
+    """
+    rejected = []
+    for selection in selections:
+        try:
+            write_selections(engine, [selection])
+        except (OperationalError, InterfaceError):
+            raise
+        except Exception as e:
+            rejected.append((selection, e))
+    return rejected
+
+
+def make_selection(comparison_id: str, selected_model: str, selected_therapist_id: str,
+                   feedback: Optional[str], selection_id: Optional[str] = None) -> Dict[str, Any]:
+    """A user_selections row as a dict"""
+    return {
+        "id": selection_id or str(uuid.uuid4()),
+        "comparison_id": comparison_id,
+        "selected_model": selected_model,
+        "selected_therapist_id": selected_therapist_id,
+        "feedback": feedback,
+        "created_at": datetime.utcnow(),
+    }
+
+
+class SelectionBuffer:
+    def __init__(self, engine, batch_size: int = SELECTION_FLUSH_BATCH_SIZE,
+                 interval_seconds: float = SELECTION_FLUSH_INTERVAL_SECONDS,
+                 journal_dir: str = SELECTION_JOURNAL_DIR):
+        self.engine = engine
+        self.batch_size = batch_size
+        self.interval_seconds = interval_seconds
+        self.journal_dir = journal_dir
+        self._pending: Dict[str, Dict[str, Any]] = {}
+        self._segment: Optional[_Segment] = None
+        # Rotated segments whose selections are not committed yet
+        self._unflushed_segments: List[_Segment] = []
+        self._segment_number = 0
+        self._lock = threading.Lock()
+        # Serializes flushes between the flusher thread and stop()
+        self._flush_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stopping = threading.Event()
+        self._thread = None
+
+    @property
+    def pending(self) -> int:
+        return len(self._pending)
+
+    def _open_segment(self) -> _Segment:
+        self._segment_number += 1
+        os.makedirs(self.journal_dir, exist_ok=True)
+        return _Segment(os.path.join(
+            self.journal_dir,
+            f"selections-{os.getpid()}-{uuid.uuid4().hex[:8]}-{self._segment_number}.ndjson"))
+
+    def add(self, selection: Dict[str, Any]) -> str:
+        """Buffer a selection from make_selection, journaled first when enabled; returns its id"""
+        with self._lock:
+            if selection["id"] in self._pending:
+                return selection["id"]
+            if self.journal_dir:
+                if self._segment is None:
+                    self._segment = self._open_segment()
+                self._segment.append(selection)
+            self._pending[selection["id"]] = selection
+            full = len(self._pending) >= self.batch_size
+        self._start()
+        if full:
+            self._wake.set()
+        return selection["id"]
+
+    def flush(self) -> int:
+        """Write everything buffered so far; returns the number of selections written"""
+        with self._flush_lock:
+            with self._lock:
+                batch = list(self._pending.values())
+                # New selections go to a new segment; the rotated ones hold only this batch
+                if self._segment is not None:
+                    self._unflushed_segments.append(self._segment)
+                    self._segment = None
+            if not batch:
+                return 0
+            started = time.perf_counter()
+            try:
+                rejected = self._write(batch)
+            except Exception:
+                # The batch stays buffered and journaled; the next flush retries it
+                selections_flushed_total.inc(len(batch), outcome="error")
+                raise
+            with self._lock:
+                for selection in batch:
+                    self._pending.pop(selection["id"], None)
+            for segment in self._unflushed_segments:
+                segment.remove()
+            self._unflushed_segments = []
+            selection_flush_seconds.observe(time.perf_counter() - started)
+            selections_flushed_total.inc(len(batch) - rejected, outcome="ok")
+            return len(batch) - rejected
+
+    def _write(self, selections: List[Dict[str, Any]]) -> int:
+        """Write selections, dead-lettering rows the database rejects; returns how many were rejected"""
+        try:
+            write_selections(self.engine, selections)
+            return 0
+        except (OperationalError, InterfaceError):
+            raise
+        except Exception as e:
+            logger.warning(
+                f"Writing {len(selections)} selections failed, retrying one by one: {str(e)}")
+        rejected = write_each(self.engine, selections)
+        if rejected:
+            self._dead_letter(rejected)
+        return len(rejected)
+
+    def _dead_letter(self, rejected: List[Tuple[Dict[str, Any], Exception]]) -> None:
+        for selection, error in rejected:
+            logger.error(f"Dead-lettering selection {_encode(selection)}: {str(error)}")
+        selections_flushed_total.inc(len(rejected), outcome="dead_letter")
+        if not self.journal_dir:
+            return
+        os.makedirs(self.journal_dir, exist_ok=True)
+        with open(os.path.join(self.journal_dir, DEAD_LETTER_FILE), "a", encoding="utf-8") as f:
+            for selection, error in rejected:
+                f.write(json.dumps({"selection": json.loads(_encode(selection)), "error": str(error)}) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+
+    def replay_orphaned(self) -> int:
+        """Write and remove journal segments left by processes that died; returns selections replayed"""
+        if not self.journal_dir:
+            return 0
+        replayed = 0
+        for path in sorted(glob.glob(os.path.join(self.journal_dir, "selections-*.ndjson"))):
+            try:
+                f = open(path, "r", encoding="utf-8")
+            except FileNotFoundError:
+                continue
+            with f:
+                try:
+                    fcntl.flock(f.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except BlockingIOError:
+                    continue  # A live process owns it
+                if not os.path.exists(path):
+                    continue  # Flushed and removed by its owner after we opened it
+                # A torn last line from a crash mid-write is skipped
+                selections = []
+                for line in f:
+                    try:
+                        selections.append(_decode(line))
+                    except ValueError:
+                        logger.warning(f"Skipping unreadable journal line in {path}")
+                rejected = self._write(selections)
+                os.unlink(path)
+            logger.info(
+                f"Replayed {len(selections)} journaled selections from {os.path.basename(path)} ({rejected} rejected)")
+            replayed += len(selections)
+        return replayed
+
+    def _start(self) -> None:
+        # Started on first use, so it runs in the process that buffers (after any fork)
+        if self._thread is None:
+            with self._lock:
+                if self._thread is None:
+                    self._stopping.clear()
+                    self._thread = threading.Thread(
+                        target=self._run, name="selection-flusher", daemon=True)
+                    self._thread.start()
+
+    def stop(self) -> None:
+        """Stop the flusher and write what is left"""
+        self._stopping.set()
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join(timeout=10)
+            self._thread = None
+        try:
+            self.flush()
+        except Exception as e:
+            where = "kept in the journal" if self.journal_dir else "lost"
+            logger.error(
+                f"Final selection flush failed, {self.pending} selections {where}: {str(e)}")
+
+    def _run(self):
+        while not self._stopping.is_set():
+            self._wake.wait(self.interval_seconds)
+            self._wake.clear()
+            try:
+                self.flush()
+            except Exception as e:
+                logger.error(f"Selection flush failed, will retry: {str(e)}")
+
+
+buffer = SelectionBuffer(default_engine) if SELECTION_WRITE_BEHIND else None
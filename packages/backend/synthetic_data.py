@@ -0,0 +1,421 @@
+#!/usr/bin/env python3
+"""
+Synthetic therapist catalogs, questionnaires and session history.
+
+Everything is drawn from a seeded random.Random, so the same seed and sizes
+always produce the same rows. Values come from the vocabularies the frontend
+offers (specialties, approaches, styles, age groups, languages, commitment
+levels, weekly schedule format). Popularity follows a Zipf distribution over
+each vocabulary and over therapists: skew 0 is uniform, 1 is a classic Zipf
+and larger values concentrate demand on fewer values.
+
+Usage:
+    python synthetic_data.py --therapists 10000 --questions
+    python synthetic_data.py --sessions 2000000 --days 365 --seed 7 --skew 1.2
+"""
+
+import argparse
+import itertools
+import math
+import random
+import sys
+import time
+import uuid
+from bisect import bisect_right
+from datetime import datetime, timedelta
+from typing import Any, Dict, Iterator, List, Optional, Sequence, Tuple
+
+import availability
+import geo
+
+# Vocabularies as offered by the registration form, most common first
+SPECIALTIES = ["Ansiedad y estrés", "Depresión", "Relaciones / vínculos", "Autoestima",
+               "Duelo y pérdidas", "Trauma / TEPT", "Adolescencia", "Sexualidad",
+               "Trastornos alimenticios"]
+APPROACHES = ["Terapia Cognitivo-Conductual (CBT)", "Humanista / centrada en la persona",
+              "Psicoanálisis / psicodinámica", "Mindfulness / aceptación", "Sistémica", "EMDR",
+              "Espiritual / transpersonal"]
+LANGUAGES = ["Español", "Inglés"]
+THERAPEUTIC_STYLES = ["Contenedor y empático 🫂", "Práctico y orientado a soluciones 🛠️",
+                      "Flexible y adaptativo 🌀", "Analítico y reflexivo 🧠",
+                      "Directo y confrontativo ⚡", "Espiritual y profundo 🌱"]
+AGE_GROUPS = ["Adultos (26–50)", "Jóvenes (18–25)", "Todos los anteriores",
+              "Adolescentes (13–17)", "Adultos mayores (50+)"]
+COMMITMENT_LEVELS = ["Sesiones constantes (2–5 pacientes fijos)",
+                     "Sesiones ocasionales / baja disponibilidad",
+                     "Alta disponibilidad / puedo recibir varios pacientes nuevos por semana"]
+DAYS_OF_WEEK = ["Lunes", "Martes", "Miércoles",
+                "Jueves", "Viernes", "Sábado", "Domingo"]
+TIME_SLOTS = ["08:00", "09:00", "10:00", "11:00", "12:00", "13:00", "14:00",
+              "15:00", "16:00", "17:00", "18:00", "19:00", "20:00", "21:00"]
+CITIES = [("México", "Ciudad de México"), ("México", "Guadalajara"), ("México", "Monterrey"),
+          ("Ecuador", "Quito"), ("Colombia", "Bogotá"), ("Ecuador", "Guayaquil"),
+          ("México", "Puebla"), ("Colombia", "Medellín"), ("Perú", "Lima"),
+          ("México", "Querétaro"), ("Ecuador", "Cuenca"), ("México", "Mérida")]
+MODALITIES = ["En línea", "Presencial", "Híbrida", "Me da igual"]
+SESSION_TIMES = ["Tardes entre semana (12:00–18:00)", "Noches entre semana (18:00–21:00)",
+                 "Mañanas entre semana (8:00–12:00)", "Fines de semana"]
+BUDGETS = ["Menos de $30", "$30–$60", "$60–$100", "Más de $100"]
+
+FIRST_NAMES = ["María", "José", "Ana", "Luis", "Carmen", "Juan", "Lucía", "Carlos", "Sofía",
+               "Diego", "Valentina", "Andrés", "Gabriela", "Fernando", "Isabel", "Daniela"]
+LAST_NAMES = ["González", "Rodríguez", "Hernández", "López", "Martínez", "Pérez", "Sánchez",
+              "Ramírez", "Torres", "Flores", "Rivera", "Gómez", "Díaz", "Vargas", "Castro"]
+
+CONCERN_SENTENCES = {
+    "Ansiedad y estrés": "Últimamente siento mucha ansiedad y estrés por el trabajo",
+    "Depresión": "Me siento triste y sin energía desde hace meses",
+    "Relaciones / vínculos": "Tengo conflictos constantes con mi pareja y mi familia",
+    "Autoestima": "Me cuesta valorarme y me comparo todo el tiempo con los demás",
+    "Duelo y pérdidas": "Perdí a un ser querido y no logro superarlo",
+    "Trauma / TEPT": "Viví una experiencia traumática que todavía me afecta",
+    "Adolescencia": "Mi hijo adolescente está pasando por un momento difícil",
+    "Sexualidad": "Quiero hablar de temas de sexualidad en un espacio seguro",
+    "Trastornos alimenticios": "Tengo una relación complicada con la comida",
+}
+
+# Questionnaire: (key, text, type, options)
+QUESTIONS = [
+    ("concerns", "¿Qué te trae a terapia?", "multiple_choice", SPECIALTIES),
+    ("approach", "¿Qué enfoque terapéutico prefieres?",
+     "single_choice", APPROACHES),
+    ("style", "¿Qué estilo de terapeuta buscas?",
+     "single_choice", THERAPEUTIC_STYLES),
+    ("modality", "¿Prefieres sesiones en línea o presenciales?",
+     "single_choice", MODALITIES),
+    ("age_group", "¿Cuál es tu rango de edad?",
+     "single_choice", AGE_GROUPS[:2] + AGE_GROUPS[3:]),
+    ("language", "¿En qué idioma prefieres tus sesiones?",
+     "single_choice", LANGUAGES),
+    ("budget", "¿Cuál es tu presupuesto por sesión?", "single_choice", BUDGETS),
+    ("session_times", "¿En qué horarios podrías tener tus sesiones?",
+     "multiple_choice", SESSION_TIMES),
+    ("intensity", "¿Qué tan intenso es tu malestar?", "scale", None),
+    ("city", "¿En qué ciudad vives?", "text_input", None),
+    ("story", "Cuéntanos brevemente qué te gustaría trabajar en terapia",
+     "text_input", None),
+    ("previous_therapy", "¿Has ido a terapia antes?", "yes_no", None),
+]
+
+MODEL_DISPLAY_NAMES = {"gemini-2.5-flash-lite": "Model A",
+                       "gemini-2.5-flash": "Model B", "random": "Model C"}
+# Median processing time per model in ms; actual times are log-normal around it
+MODEL_LATENCY_MS = {"gemini-2.5-flash-lite": 900.0,
+                    "gemini-2.5-flash": 1600.0, "random": 0.05}
+# Relative chance that a shown model's match is the one selected
+MODEL_APPEAL = {"gemini-2.5-flash-lite": 1.0,
+                "gemini-2.5-flash": 1.3, "random": 0.6}
+
+
+class ZipfChoice:
+    """Weighted choice over a ranked population with weights 1 / rank**skew"""
+
+    def __init__(self, population: Sequence[Any], skew: float):
+        self.population = list(population)
+        weights = [1 / (rank ** skew)
+                   for rank in range(1, len(self.population) + 1)]
+        self.cum_weights = list(itertools.accumulate(weights))
+        self.total = self.cum_weights[-1]
+
+    def one(self, rng: random.Random) -> Any:
+        index = bisect_right(self.cum_weights, rng.random() * self.total)
+        return self.population[min(index, len(self.population) - 1)]
+
+    def distinct(self, rng: random.Random, k: int) -> List[Any]:
+        """k distinct values, popular ones more likely"""
+        k = min(k, len(self.population))
+        chosen = []
+        while len(chosen) < k:
+            value = self.one(rng)
+            if value not in chosen:
+                chosen.append(value)
+        return chosen
+
+
+class SyntheticData:
+    def __init__(self, seed: int = 42, skew: float = 1.0):
+        self.seed = seed
+        self.skew = skew
+        self.rng = random.Random(seed)
+        self.specialties = ZipfChoice(SPECIALTIES, skew)
+        self.approaches = ZipfChoice(APPROACHES, skew)
+        self.styles = ZipfChoice(THERAPEUTIC_STYLES, skew)
+        self.age_groups = ZipfChoice(AGE_GROUPS, skew)
+        self.commitment = ZipfChoice(COMMITMENT_LEVELS, skew)
+        self.cities = ZipfChoice(CITIES, skew)
+
+    def uuid(self) -> str:
+        return str(uuid.UUID(int=self.rng.getrandbits(128), version=4))
+
+    def weekly_availability(self) -> str:
+        """Schedule in the format the registration form sends"""
+        rng = self.rng
+        weekdays = [d for d in DAYS_OF_WEEK[:5] if rng.random() < 0.75]
+        weekend = [d for d in DAYS_OF_WEEK[5:] if rng.random() < 0.2]
+        parts = []
+        for day in weekdays + weekend or [DAYS_OF_WEEK[0]]:
+            start = rng.randrange(0, len(TIME_SLOTS) - 3)
+            end = rng.randrange(start + 2, len(TIME_SLOTS))
+            if rng.random() < 0.3 and end - start >= 5:
+                # Split shift with a lunch break
+                pause = start + (end - start) // 2
+                slots = f"{TIME_SLOTS[start]}-{TIME_SLOTS[pause - 1]}, {TIME_SLOTS[pause]}-{TIME_SLOTS[end]}"
+            else:
+                slots = f"{TIME_SLOTS[start]}-{TIME_SLOTS[end]}"
+            parts.append(f"{day}: {slots}")
+        return "; ".join(parts)
+
+    def therapist(self, index: int) -> Dict[str, Any]:
+        """One therapist as a row mapping for the therapists table"""
+        rng = self.rng
+        country, city = self.cities.one(rng)
+        first, last = rng.choice(FIRST_NAMES), rng.choice(LAST_NAMES)
+        specialties = self.specialties.distinct(rng, rng.randint(1, 4))
+        remote = rng.random() < 0.75
+        on_site = rng.random() < 0.45 or not remote
+        price = rng.lognormvariate(math.log(50), 0.4)
+        latitude, longitude = geo.coordinates(city, country)
+        row = {
+            "id": self.uuid(),
+            "name": f"Dr. {first} {last} {index}",
+            "professional_titles": rng.choice(["Licenciada en Psicología", "Máster en Psicología Clínica",
+                                               "Doctora en Psicología Clínica"]),
+            "professional_id_number": f"PSI-{index:07d}",
+            "email": f"{first}.{last}.{index}@synthetic.kuna".lower(),
+            "specialties": specialties,
+            "therapeutic_approaches": self.approaches.distinct(rng, rng.randint(1, 3)),
+            "session_price": float(min(200, max(15, 5 * round(price / 5)))),
+            "price_negotiable": rng.random() < 0.3,
+            "country": country,
+            "city": city,
+            "latitude": latitude,
+            "longitude": longitude,
+            "remote": remote,
+            "on_site": on_site,
+            "hybrid": remote and on_site and rng.random() < 0.5,
+            "bio": f"Psicoterapeuta con experiencia en {', '.join(s.lower() for s in specialties)}.",
+            "years_experience": min(40, int(rng.expovariate(1 / 8)) + 1),
+            "languages": ["Español", "Inglés"] if rng.random() < 0.25 else ["Español"],
+            "therapeutic_style": self.styles.distinct(rng, rng.randint(1, 2)),
+            "age_groups": self.age_groups.distinct(rng, rng.randint(1, 3)),
+            "weekly_availability": self.weekly_availability(),
+            "commitment_level": self.commitment.one(rng),
+            "additional_info": None,
+            "is_active": rng.random() < 0.97,
+            "created_at": datetime(2025, 1, 1) + timedelta(minutes=index),
+        }
+        row["availability_mask"] = availability.encode_schedule(
+            row["weekly_availability"])
+        return row
+
+    def therapists(self, count: int) -> List[Dict[str, Any]]:
+        return [self.therapist(i) for i in range(count)]
+
+    def questions(self) -> List[Dict[str, Any]]:
+        """The questionnaire as row mappings for the questions table"""
+        return [
+            {"id": self.uuid(), "question_text": text, "question_type": question_type,
+             "options": options, "is_active": True, "display_order": order}
+            for order, (_, text, question_type, options) in enumerate(QUESTIONS)
+        ]
+
+    def answers(self, questions: List[Dict[str, Any]]) -> Dict[str, Any]:
+        """Questionnaire answers keyed by question id, as the frontend submits them"""
+        rng = self.rng
+        by_text = {text: key for key, text, _, _ in QUESTIONS}
+        answers = {}
+        concerns = self.specialties.distinct(rng, rng.randint(1, 3))
+        for q in questions:
+            key = by_text.get(q["question_text"])
+            question_type = q["question_type"]
+            if key == "concerns":
+                answers[q["id"]] = concerns
+            elif key == "approach":
+                answers[q["id"]] = self.approaches.one(rng)
+            elif key == "style":
+                answers[q["id"]] = self.styles.one(rng)
+            elif key == "city":
+                answers[q["id"]] = self.cities.one(rng)[1]
+            elif key == "story":
+                answers[q["id"]] = ". ".join(
+                    CONCERN_SENTENCES[c] for c in concerns) + "."
+            elif question_type in ("single_choice", "multiple_choice") and q.get("options"):
+                choice = ZipfChoice(q["options"], self.skew).one(rng)
+                answers[q["id"]] = [
+                    choice] if question_type == "multiple_choice" else choice
+            elif question_type == "scale":
+                answers[q["id"]] = min(10, max(1, round(rng.gauss(6, 2))))
+            elif question_type == "yes_no":
+                answers[q["id"]] = "yes" if rng.random() < 0.4 else "no"
+            else:
+                answers[q["id"]] = rng.choice(list(CONCERN_SENTENCES.values()))
+        return answers
+
+    def match(self, therapist: Dict[str, Any], model: str) -> Dict[str, Any]:
+        """A stored match dict, as matching.matches_to_dicts produces"""
+        rng = self.rng
+        ai = model != "random"
+        return {
+            "id": therapist["id"],
+            "name": therapist["name"],
+            "specialties": therapist["specialties"],
+            "therapeutic_approaches": therapist["therapeutic_approaches"],
+            "session_price": therapist["session_price"],
+            "country": therapist["country"],
+            "city": therapist["city"],
+            "remote": therapist["remote"],
+            "on_site": therapist["on_site"],
+            "bio": therapist["bio"],
+            "match_score": rng.randint(80, 95) if ai else rng.randint(1, 100),
+            "match_reason": "Especialidades y enfoque coinciden con tus respuestas" if ai
+            else "Randomly selected as control group",
+            "confidence_score": rng.randint(75, 95) if ai else None,
+        }
+
+    def sessions(self, count: int, therapists: List[Dict[str, Any]], questions: List[Dict[str, Any]],
+                 days: int = 90, models: Sequence[str] = tuple(MODEL_DISPLAY_NAMES),
+                 selection_rate: float = 0.6, empty_rate: float = 0.01,
+                 end: Optional[datetime] = None) -> Iterator[Tuple[Dict, List[Dict], Optional[Dict]]]:
+        """Yield (comparison, results, selection or None) row mappings per session"""
+        rng = self.rng
+        end = end or datetime.utcnow()
+        span = days * 86400
+        popular = ZipfChoice(therapists, self.skew)
+        for n in range(count):
+            created_at = end - timedelta(seconds=rng.random() * span)
+            comparison = {
+                "id": self.uuid(),
+                "email": f"paciente{n}@synthetic.kuna",
+                "questionnaire_answers": self.answers(questions),
+                "created_at": created_at,
+            }
+            shown = [m for m in models if m == "random" or rng.random() < 0.9] or [models[0]]
+            results = []
+            for model in shown:
+                empty = rng.random() < empty_rate
+                latency = rng.lognormvariate(
+                    math.log(MODEL_LATENCY_MS.get(model, 1000.0)), 0.5)
+                results.append({
+                    "id": self.uuid(),
+                    "comparison_id": comparison["id"],
+                    "model_name": model,
+                    "matches": [] if empty else [self.match(popular.one(rng), model)],
+                    "processing_time_ms": 0.0 if empty else latency,
+                    "created_at": created_at + timedelta(milliseconds=latency),
+                })
+
+            selection = None
+            candidates = [r for r in results if r["matches"]]
+            if candidates and rng.random() < selection_rate:
+                chosen = rng.choices(
+                    candidates, [MODEL_APPEAL.get(r["model_name"], 1.0) for r in candidates])[0]
+                selection = {
+                    "id": self.uuid(),
+                    "comparison_id": comparison["id"],
+                    "selected_model": chosen["model_name"],
+                    "selected_therapist_id": chosen["matches"][0]["id"],
+                    "feedback": f"Seleccionado de {MODEL_DISPLAY_NAMES.get(chosen['model_name'], chosen['model_name'])}",
+                    "created_at": created_at + timedelta(seconds=rng.uniform(20, 600)),
+                }
+            yield comparison, results, selection
+
+
+def _batches(iterable, size: int):
+    iterator = iter(iterable)
+    while True:
+        batch = list(itertools.islice(iterator, size))
+        if not batch:
+            return
+        yield batch
+
+
+def load_catalog(engine, data: SyntheticData, therapists: int, questions: bool, batch_size: int = 5000) -> None:
+    """Insert generated therapists (and the questionnaire) in batches"""
+    import attributes
+    import cache_versions
+    from database import Question, Therapist
+
+    with engine.begin() as connection:
+        if questions:
+            connection.execute(Question.__table__.insert(), data.questions())
+        for batch in _batches((data.therapist(i) for i in range(therapists)), batch_size):
+            connection.execute(Therapist.__table__.insert(), batch)
+            attributes.write(connection, batch)
+        # Running servers drop their cached catalog
+        cache_versions.bump(connection, "therapists", "questions")
+
+
+def load_history(engine, data: SyntheticData, sessions: int, days: int, batch_size: int = 5000) -> None:
+    """Insert generated sessions, results and selections, one transaction per batch"""
+    from database import ModelComparison, ModelResult, Question, Therapist, UserSelection
+
+    with engine.connect() as connection:
+        therapist_rows = [dict(row._mapping) for row in connection.execute(
+            Therapist.__table__.select().where(Therapist.is_active == True))]
+        question_rows = [dict(row._mapping) for row in connection.execute(
+            Question.__table__.select().where(Question.is_active == True))]
+    if not therapist_rows:
+        raise SystemExit("No active therapists; load a catalog first")
+
+    started = time.monotonic()
+    loaded = 0
+    for batch in _batches(data.sessions(sessions, therapist_rows, question_rows, days), batch_size):
+        comparisons = [comparison for comparison, _, _ in batch]
+        results = [r for _, session_results, _ in batch for r in session_results]
+        selections = [s for _, _, s in batch if s]
+        with engine.begin() as connection:
+            connection.execute(ModelComparison.__table__.insert(), comparisons)
+            connection.execute(ModelResult.__table__.insert(), results)
+            if selections:
+                connection.execute(UserSelection.__table__.insert(), selections)
+        loaded += len(batch)
+        rate = loaded / (time.monotonic() - started)
+        print(f"  {loaded}/{sessions} sessions ({rate:.0f}/s)", flush=True)
+
+
+def main(argv=None):
+    """Main function"""
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--therapists", type=int, default=0,
+                        help="Therapists to generate")
+    parser.add_argument("--questions", action="store_true",
+                        help="Also insert the synthetic questionnaire")
+    parser.add_argument("--sessions", type=int, default=0,
+                        help="Sessions (with results and selections) to generate")
+    parser.add_argument("--days", type=int, default=90,
+                        help="Spread sessions over this many past days")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--skew", type=float, default=1.0,
+                        help="Zipf exponent for popularity; 0 is uniform")
+    parser.add_argument("--batch-size", type=int, default=5000)
+    parser.add_argument("--skip-rollups", action="store_true",
+                        help="Do not rebuild the model rollups after loading history")
+    args = parser.parse_args(argv)
+
+    from database import SessionLocal, engine, init_db
+    import rollups
+
+    init_db()
+    data = SyntheticData(args.seed, args.skew)
+    if args.therapists or args.questions:
+        print(f"Loading {args.therapists} therapists...")
+        load_catalog(engine, data, args.therapists,
+                     args.questions, args.batch_size)
+    if args.sessions:
+        print(f"Loading {args.sessions} sessions...")
+        load_history(engine, data, args.sessions, args.days, args.batch_size)
+        if not args.skip_rollups:
+            # Core inserts bypass the session hooks that maintain the rollups
+            print("Rebuilding rollups...")
+            db = SessionLocal()
+            try:
+                rollups.rebuild(db)
+            finally:
+                db.close()
+    print("✓ Done")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,86 @@
+#!/usr/bin/env python3
+"""
+Tests for admission control (admission.py): the concurrency bound, shedding,
+and slots held by work whose caller was cancelled.
+
+Usage:
+    python -m pytest test_admission.py
+"""
+
+import asyncio
+import sys
+import threading
+
+import pytest
+
+from admission import AdmissionController, Overloaded
+
+
+def blocker():
+    """A function for the pool that runs until the returned event is set"""
+    started, release = threading.Event(), threading.Event()
+
+    def fn():
+        started.set()
+        release.wait(5)
+        return "done"
+    return fn, started, release
+
+
+async def wait_for_event(event: threading.Event):
+    loop = asyncio.get_running_loop()
+    assert await loop.run_in_executor(None, event.wait, 5)
+
+
+def test_runs_in_pool():
+    controller = AdmissionController("test", 2, 4, 5.0)
+    assert asyncio.run(controller.run(lambda a, b: a + b, 1, 2)) == 3
+    assert controller.stats()["in_flight"] == 0
+    assert controller.admitted_total == 1
+
+
+def test_cancelled_caller_keeps_slot_until_thread_finishes():
+    async def scenario():
+        controller = AdmissionController("test", 1, 4, 5.0)
+        fn, started, release = blocker()
+        first = asyncio.ensure_future(controller.run(fn))
+        await wait_for_event(started)
+
+        first.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await first
+        # The thread still runs, so a second request must not be admitted yet
+        assert controller.in_flight == 1
+        second = asyncio.ensure_future(controller.run(lambda: "second"))
+        await asyncio.sleep(0.05)
+        assert not second.done()
+        assert controller.queued == 1
+
+        release.set()
+        assert await second == "second"
+        assert controller.in_flight == 0
+    asyncio.run(scenario())
+
+
+def test_sheds_when_queue_is_full():
+    async def scenario():
+        controller = AdmissionController("test", 1, 1, 5.0)
+        fn, started, release = blocker()
+        running = asyncio.ensure_future(controller.run(fn))
+        await wait_for_event(started)
+        waiting = asyncio.ensure_future(controller.run(lambda: "queued"))
+        await asyncio.sleep(0)
+
+        with pytest.raises(Overloaded) as shed:
+            await controller.run(lambda: "shed")
+        assert shed.value.retry_after >= 1
+        assert controller.shed_total == 1
+
+        release.set()
+        assert await running == "done"
+        assert await waiting == "queued"
+    asyncio.run(scenario())
+
+
+if __name__ == "__main__":
+    sys.exit(pytest.main([__file__, "-q"]))
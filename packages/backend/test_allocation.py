@@ -0,0 +1,82 @@
+#!/usr/bin/env python3
+"""
+Tests for per-session model allocation (allocation.py): Thompson sampling
+converges on the model users pick, the control runs at its fixed rate, and
+every session records inclusion probabilities.
+
+Usage:
+    python -m pytest test_allocation.py
+"""
+
+import random
+import sys
+from datetime import date
+
+import pytest
+
+import rollups
+from allocation import ModelAllocator
+from database import ModelAllocation
+
+COSTS = {"good": 1.0, "poor": 1.0, "random": 0.0}
+
+
+def _allocator():
+    # Only one paid model fits in the budget, so the bandit has to choose
+    return ModelAllocator(models=["good", "poor", "random"], costs=COSTS,
+                          budget=1.0, control_rate=1.0, exploration_rate=0.0)
+
+
+def _record(db, model_name: str, shown: int, selected: int):
+    connection = db.connection()
+    for _ in range(shown):
+        rollups.record_result(connection, model_name, date.today(), 100.0, False)
+    rollups.record_selections(connection, [{"selected_model": model_name}] * selected)
+
+
+def test_converges_to_better_model(db):
+    allocator = _allocator()
+    true_rates = {"good": 0.6, "poor": 0.1}
+    outcomes = random.Random(7)
+    chosen = []
+    for session in range(300):
+        # Always read fresh stats instead of waiting out the cache TTL
+        allocator._stats_loaded_at = None
+        models = allocator.allocate(db, f"session-{session}")
+        paid = [m for m in models if m != "random"]
+        assert len(paid) == 1
+        chosen.append(paid[0])
+        _record(db, paid[0], 1, int(outcomes.random() < true_rates[paid[0]]))
+    db.commit()
+
+    late = chosen[-100:]
+    assert late.count("good") >= 90
+
+
+def test_exploits_recorded_stats(db):
+    _record(db, "good", 100, 50)
+    _record(db, "poor", 100, 5)
+    db.commit()
+
+    allocator = _allocator()
+    models = allocator.allocate(db, "session-1")
+    assert models == ["good", "random"]
+    db.flush()
+
+    rows = {r.model_name: r for r in db.query(ModelAllocation).filter_by(comparison_id="session-1")}
+    assert set(rows) == {"good", "poor", "random"}
+    assert rows["good"].allocated and not rows["poor"].allocated
+    assert rows["good"].inclusion_probability > 0.95
+    assert rows["poor"].inclusion_probability < 0.05
+    assert rows["random"].inclusion_probability == 1.0
+
+
+def test_budget_keeps_cheapest_model(db):
+    allocator = ModelAllocator(models=["good", "poor", "random"], costs=COSTS,
+                               budget=0.5, control_rate=0.0, exploration_rate=0.0)
+    models = allocator.allocate(db, "session-1")
+    assert len(models) == 1 and models[0] in ("good", "poor")
+
+
+if __name__ == "__main__":
+    sys.exit(pytest.main([__file__, "-q"]))
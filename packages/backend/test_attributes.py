@@ -0,0 +1,110 @@
+#!/usr/bin/env python3
+"""
+Tests for indexed therapist attributes (attributes.py): the rows written per
+therapist, patient requirements, and the candidate filter with its fallback.
+
+Usage:
+    python -m pytest test_attributes.py
+"""
+
+import sys
+
+import pytest
+
+import attributes
+from database import Therapist, TherapistAttribute
+
+THERAPISTS = [
+    {"id": "ana", "languages": ["Español", "Inglés"], "specialties": ["Ansiedad y estrés"], "is_active": True},
+    {"id": "bea", "languages": ["Español"], "specialties": ["Depresión"], "is_active": True},
+    {"id": "carla", "languages": ["English", "Francés"], "specialties": ["Duelo y pérdidas"], "is_active": True},
+    # Only inactive therapists speak Portuguese
+    {"id": "dora", "languages": ["Portugués", "Inglés"], "specialties": ["Ansiedad y estrés"], "is_active": False},
+]
+
+
+@pytest.fixture
+def catalog(db):
+    for t in THERAPISTS:
+        db.add(Therapist(id=t["id"], name=t["id"].title(), email=f"{t['id']}@x.com",
+                         languages=t["languages"], specialties=t["specialties"], is_active=t["is_active"]))
+    db.flush()
+    attributes.write(db, THERAPISTS)
+    db.commit()
+    return db
+
+
+@pytest.fixture
+def hard_filter(monkeypatch):
+    monkeypatch.setattr(attributes, "LANGUAGE_HARD_FILTER", True)
+
+
+def answers(*values):
+    return [{"question": f"q{i}", "answer": v} for i, v in enumerate(values)]
+
+
+def test_attribute_rows():
+    rows = attributes.attribute_rows({"id": "x", "languages": ["Inglés", "english", "Klingon"],
+                                      "specialties": ["Ansiedad social"], "age_groups": None})
+    # Labels outside the vocabulary are also values of their own
+    assert sorted((r["attribute"], r["value"]) for r in rows) == [
+        ("languages", "language:english"), ("languages", "language:ingles"), ("languages", "language:klingon"),
+        ("specialties", "specialty:ansiedad-social"), ("specialties", "specialty:ansiedad-y-estres")]
+
+
+@pytest.mark.parametrize("values, expected", [
+    (("Inglés",), {"languages": {"language:ingles"}}),
+    ((["Español", "english"], "Ansiedad y estrés"), {"languages": {"language:espanol", "language:ingles"}}),
+    # Only languages are requirements
+    (("Depresión", "Terapia Cognitivo-Conductual (CBT)"), {}),
+    # Prose mentioning a language is not a choice of language
+    (("Vi una película en inglés que me hizo pensar mucho",), {}),
+    ((3, None, True), {}),
+])
+def test_required(values, expected):
+    assert attributes.required(answers(*values)) == expected
+
+
+def test_candidate_ids(catalog, hard_filter):
+    assert attributes.candidate_ids(catalog, answers("Inglés")) == {"ana", "carla"}
+    assert attributes.candidate_ids(catalog, answers(["Inglés", "Francés"])) == {"ana", "carla"}
+    assert attributes.candidate_ids(catalog, answers("Español", "Ansiedad y estrés")) == {"ana", "bea"}
+
+
+def test_candidate_ids_off_by_default(catalog):
+    assert not attributes.LANGUAGE_HARD_FILTER
+    assert attributes.candidate_ids(catalog, answers("Inglés")) is None
+
+
+def test_candidate_ids_without_requirements(catalog, hard_filter):
+    assert attributes.candidate_ids(catalog, answers("Depresión", "Me siento triste")) is None
+
+
+def test_candidate_ids_fall_back_when_no_active_therapist_qualifies(catalog, hard_filter):
+    # Dora speaks Portuguese but is inactive: no restriction rather than no candidates
+    assert attributes.candidate_ids(catalog, answers("Portugués")) is None
+    assert attributes.candidate_ids(catalog, answers("Alemán")) is None
+
+
+def test_filter_query_keeps_inactive_for_admin_listing(catalog):
+    required = {"languages": attributes.label_filter("languages", ["english"]),
+                "specialties": attributes.label_filter("specialties", ["ansiedad"])}
+    assert {i for (i,) in catalog.execute(attributes.filter_query(required))} == {"ana", "dora"}
+    assert {i for (i,) in catalog.execute(attributes.candidates_query(required))} == {"ana"}
+
+
+def test_remove_and_backfill(catalog, engine, hard_filter):
+    attributes.remove(catalog, ["ana", "bea"])
+    catalog.commit()
+    assert attributes.candidate_ids(catalog, answers("Español")) is None
+
+    with engine.begin() as connection:
+        assert attributes.backfill_attributes(connection, batch_size=1) == 2
+        assert attributes.backfill_attributes(connection) == 0
+    assert attributes.candidate_ids(catalog, answers("Español")) == {"ana", "bea"}
+    assert catalog.query(TherapistAttribute).filter(
+        TherapistAttribute.therapist_id == "ana").count() == 3
+
+
+if __name__ == "__main__":
+    sys.exit(pytest.main([__file__, "-q"]))
@@ -0,0 +1,85 @@
+#!/usr/bin/env python3
+"""
+Tests for the weekly availability parser (availability.py): the hours each
+schedule text sets in the 168-bit mask.
+
+Usage:
+    python -m pytest test_availability.py
+"""
+
+import sys
+
+import pytest
+
+import availability
+from availability import ALL_DAYS, WEEKDAYS, parse_schedule, slot_mask
+
+MON, TUE, WED, THU, FRI, SAT, SUN = range(7)
+
+
+def hours(mask, day):
+    """Hours of one day set in a mask"""
+    return [h for h in range(24) if mask >> (day * 24 + h) & 1]
+
+
+@pytest.mark.parametrize("text, expected", [
+    ("Lunes a viernes de 9:00 AM a 6:00 PM", slot_mask(WEEKDAYS, 9, 18)),
+    ("Lunes: 09:00-13:00, 15:00-19:00; Sábado: 10:00-14:00",
+     slot_mask({MON}, 9, 13) | slot_mask({MON}, 15, 19) | slot_mask({SAT}, 10, 14)),
+    ("Martes y jueves por la tarde", slot_mask({TUE, THU}, 12, 18)),
+    ("Todos los días excepto miércoles", slot_mask(ALL_DAYS - {WED}, 8, 22)),
+    ("Fines de semana de 10 a 14 hrs", slot_mask({SAT, SUN}, 10, 14)),
+    ("Mañanas entre semana", slot_mask(WEEKDAYS, 8, 12)),
+    ("de 2 a 7", slot_mask(ALL_DAYS, 14, 19)),
+    # "9 a 6" without am/pm means until the evening
+    ("Lunes a viernes de 9 a 6", slot_mask(WEEKDAYS, 9, 18)),
+    ("Miércoles 10 a 8", slot_mask({WED}, 10, 20)),
+    # "hasta las 00:00" is the end of the day
+    ("Sábado de 18:00 hasta las 00:00", slot_mask({SAT}, 18, 24)),
+    ("Jueves 8:30 a 12:15", slot_mask({THU}, 8, 13)),
+    # Plain numbers alone are not hours
+    ("Adolescentes (13–17)", 0),
+    ("Disponible", 0),
+])
+def test_parse_schedule(text, expected):
+    assert parse_schedule(text) == expected
+
+
+def test_overnight_range_continues_next_day():
+    mask = parse_schedule("Viernes de 8 pm a 2 am")
+    assert hours(mask, FRI) == [20, 21, 22, 23]
+    assert hours(mask, SAT) == [0, 1]
+    assert mask.bit_count() == 6
+
+    assert parse_schedule("Martes 22:00 a 02:00") == parse_schedule("martes de 10 pm a 2 am")
+    assert parse_schedule("de 22 a 6") == slot_mask(ALL_DAYS, 22, 30)
+    assert hours(parse_schedule("de 22 a 6"), MON) == [0, 1, 2, 3, 4, 5, 22, 23]
+
+
+def test_overnight_sunday_wraps_to_monday():
+    mask = parse_schedule("Domingo 23:00 a 01:00")
+    assert hours(mask, SUN) == [23]
+    assert hours(mask, MON) == [0]
+    assert mask < 1 << availability.HOURS_PER_WEEK
+
+
+def test_patient_mask_and_overlap():
+    answers = [{"question": "session_times", "answer": ["Tardes entre semana", "Fines de semana"]},
+               {"question": "story", "answer": "Quiero trabajar la ansiedad que siento desde 2019 "
+                                               "cuando empecé un trabajo nuevo y me mudé de ciudad"}]
+    wanted = availability.patient_mask(answers)
+    assert wanted == slot_mask(WEEKDAYS, 12, 18) | slot_mask({SAT, SUN}, 8, 22)
+
+    masks = [parse_schedule("Lunes a viernes de 9 a 6"), parse_schedule("Sábado de 10 a 14 hrs"), 0]
+    assert availability.overlap_hours(masks, wanted) == [5 * 6, 4, 0]
+
+
+def test_encode_round_trip():
+    mask = parse_schedule("Domingo 23:00 a 01:00")
+    assert availability.decode(availability.encode(mask)) == mask
+    assert availability.encode_schedule(None) is None
+    assert availability.decode(None) == 0
+
+
+if __name__ == "__main__":
+    sys.exit(pytest.main([__file__, "-q"]))
@@ -0,0 +1,93 @@
+#!/usr/bin/env python3
+"""
+Tests for the process-local caches (catalog_cache.py) and their
+cross-process invalidation through cache versions (cache_versions.py).
+
+Usage:
+    python -m pytest test_catalog_cache.py
+"""
+
+import sys
+
+import pytest
+from sqlalchemy.orm import sessionmaker
+
+import cache_versions
+import catalog_cache
+from catalog_cache import CachedQuery, LRUCache
+from database import Question
+
+
+@pytest.fixture
+def sessions(engine):
+    return sessionmaker(autocommit=False, autoflush=False, bind=engine)
+
+
+@pytest.fixture
+def questions():
+    catalog_cache.questions.invalidate()
+    yield catalog_cache.questions
+    catalog_cache.questions.invalidate()
+
+
+def _add_question(db, text, order):
+    db.add(Question(question_text=text, question_type="text_input", display_order=order))
+
+
+def test_version_bump_invalidates_cache(sessions, questions):
+    db = sessions()
+    _add_question(db, "Primera", 1)
+    db.commit()
+    poller = cache_versions.VersionPoller(sessions)
+    assert poller.poll_once() == []
+    assert [q["question_text"] for q in questions.get(db)] == ["Primera"]
+
+    # Another process adds a question and bumps the version in the same transaction
+    writer = sessions()
+    _add_question(writer, "Segunda", 2)
+    cache_versions.bump(writer, "questions")
+    writer.commit()
+    writer.close()
+    assert [q["question_text"] for q in questions.get(db)] == ["Primera"]
+
+    assert poller.poll_once() == ["questions"]
+    assert [q["question_text"] for q in questions.get(db)] == ["Primera", "Segunda"]
+    assert cache_versions.current(db, "questions") == 1
+    assert poller.poll_once() == []
+    db.close()
+
+
+def test_first_poll_invalidates_nothing(sessions):
+    db = sessions()
+    cache_versions.bump(db, "results")
+    db.commit()
+    db.close()
+    catalog_cache.results.put("session-1", {"id": "session-1"})
+
+    assert cache_versions.VersionPoller(sessions).poll_once() == []
+    assert catalog_cache.results.get("session-1") == {"id": "session-1"}
+    catalog_cache.results.invalidate()
+
+
+def test_cached_query_reloads_after_ttl(db):
+    loads = []
+    cache = CachedQuery("test", lambda db: loads.append(1) or len(loads), ttl_seconds=60)
+    assert (cache.get(db), cache.get(db)) == (1, 1)
+
+    cache.invalidate()
+    assert cache.get(db) == 2 and cache.loaded
+    cache.ttl_seconds = 0
+    assert cache.get(db) == 3
+
+
+def test_lru_evicts_least_recently_used():
+    cache = LRUCache("test", 2)
+    cache.put("a", 1)
+    cache.put("b", 2)
+    assert cache.get("a") == 1
+    cache.put("c", 3)
+    assert (cache.get("a"), cache.get("b"), cache.get("c")) == (1, None, 3)
+
+
+if __name__ == "__main__":
+    sys.exit(pytest.main([__file__, "-q"]))
@@ -0,0 +1,132 @@
+#!/usr/bin/env python3
+"""
+Tests for the columnar catalog snapshot (columnar_catalog.py): rows that
+round-trip every column kind including NULLs, and snapshots that are
+rewritten when their version, format or age no longer fits.
+
+Usage:
+    python -m pytest test_columnar_catalog.py
+"""
+
+import json
+import os
+import struct
+import sys
+import time
+
+import pytest
+
+import cache_versions
+import columnar_catalog
+from columnar_catalog import Catalog
+from database import Therapist
+from matching import load_therapist_dicts
+
+THERAPISTS = [
+    {"id": "ana", "name": "Ana Núñez", "professional_titles": "Psicóloga", "professional_id_number": "123",
+     "specialties": ["Ansiedad", "Duelo"], "therapeutic_approaches": ["TCC"], "session_price": 650.5,
+     "country": "México", "city": "CDMX", "latitude": 19.43, "longitude": -99.13,
+     "remote": True, "on_site": False, "hybrid": True, "bio": "Acompaño procesos de duelo 🌱",
+     "years_experience": 12, "languages": ["Español", "Inglés"], "therapeutic_style": ["Directivo"],
+     "age_groups": ["Adultos"], "weekly_availability": "Lunes 9-13", "availability_mask": 2 ** 150 + 5,
+     "commitment_level": "alto", "additional_info": ""},
+    {"id": "beto", "name": "Beto", "professional_titles": None, "professional_id_number": None,
+     "specialties": ["Duelo"], "therapeutic_approaches": None, "session_price": None,
+     "country": None, "city": None, "latitude": None, "longitude": None,
+     "remote": False, "on_site": True, "hybrid": False, "bio": None,
+     "years_experience": None, "languages": [], "therapeutic_style": None,
+     "age_groups": ["Adultos", "Adolescentes"], "weekly_availability": None, "availability_mask": None,
+     "commitment_level": None, "additional_info": None},
+]
+
+
+@pytest.fixture
+def path(tmp_path, monkeypatch):
+    # Each test maps its own snapshot
+    monkeypatch.setattr(columnar_catalog, "_current", None)
+    return str(tmp_path / "catalog.bin")
+
+
+@pytest.fixture
+def catalog_db(db):
+    for t in THERAPISTS:
+        db.add(Therapist(id=t["id"], name=t["name"], email=f"{t['id']}@x.com",
+                         specialties=t["specialties"], languages=t["languages"],
+                         session_price=t["session_price"], is_active=True))
+    db.commit()
+    return db
+
+
+def test_rows_round_trip(path):
+    columnar_catalog.write(path, THERAPISTS, version=3)
+    catalog = Catalog(path)
+
+    assert (catalog.version, len(catalog)) == (3, 2)
+    assert [dict(row) for row in catalog] == THERAPISTS
+    assert catalog[-1]["availability_mask"] is None
+    assert catalog[0]["availability_mask"] == 2 ** 150 + 5
+
+
+def test_list_fields_come_back_in_dictionary_order(path):
+    columnar_catalog.write(path, [{"id": "a", "specialties": ["Duelo", "Ansiedad"]},
+                                  {"id": "b", "specialties": ["Ansiedad", "Duelo", "Duelo"]}], version=0)
+    assert Catalog(path)[1]["specialties"] == ["Duelo", "Ansiedad"]
+
+
+def test_rows_match_table(catalog_db, path):
+    catalog = columnar_catalog.load(catalog_db, path)
+    assert isinstance(catalog, Catalog)
+    assert [dict(row) for row in catalog] == load_therapist_dicts(catalog_db)
+
+
+def test_current_snapshot_is_reused(catalog_db, path):
+    first = columnar_catalog.load(catalog_db, path)
+    written_at = os.stat(path).st_mtime_ns
+    assert columnar_catalog.load(catalog_db, path) is first
+    assert os.stat(path).st_mtime_ns == written_at
+
+
+def test_version_bump_rewrites_snapshot(catalog_db, path):
+    assert columnar_catalog.load(catalog_db, path).version == 0
+
+    catalog_db.query(Therapist).filter(Therapist.id == "beto").update({"is_active": False})
+    cache_versions.bump(catalog_db, "therapists")
+    catalog_db.commit()
+
+    catalog = columnar_catalog.load(catalog_db, path)
+    assert catalog.version == 1
+    assert [row["id"] for row in catalog] == ["ana"]
+    assert Catalog(path).version == 1
+
+
+def test_format_mismatch_is_rewritten(catalog_db, path):
+    columnar_catalog.write(path, THERAPISTS[:1], version=0)
+    with open(path, "rb") as f:
+        data = f.read()
+    (length,) = struct.unpack_from("<I", data, len(columnar_catalog.MAGIC))
+    start = len(columnar_catalog.MAGIC) + 4
+    header = json.loads(data[start:start + length])
+    header["format"] = columnar_catalog.FORMAT_VERSION + 1
+    # Same length, so the column offsets still line up
+    patched = json.dumps(header, ensure_ascii=False).encode("utf-8").ljust(length)
+    with open(path, "wb") as f:
+        f.write(data[:start] + patched + data[start + length:])
+
+    with pytest.raises(ValueError):
+        Catalog(path)
+    catalog = columnar_catalog.load(catalog_db, path)
+    assert [row["id"] for row in catalog] == ["ana", "beto"]
+
+
+def test_stale_snapshot_is_rewritten(catalog_db, path, monkeypatch):
+    # Written at the current version, but by a write that skipped the bump
+    columnar_catalog.write(path, THERAPISTS[:1], version=0)
+    assert len(columnar_catalog.load(catalog_db, path)) == 1
+
+    monkeypatch.setattr(columnar_catalog, "CATALOG_SNAPSHOT_MAX_AGE_SECONDS", 0.0)
+    time.sleep(0.01)
+    assert len(columnar_catalog.load(catalog_db, path)) == 2
+
+
+if __name__ == "__main__":
+    sys.exit(pytest.main([__file__, "-q"]))
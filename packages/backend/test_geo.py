@@ -0,0 +1,100 @@
+#!/usr/bin/env python3
+"""
+Tests for offline geocoding (geo.py): place lookup and disambiguation by
+country, the coordinates backfill, and the spatial index against brute force.
+
+Usage:
+    python -m pytest test_geo.py
+"""
+
+import random
+import sys
+
+import pytest
+
+import geo
+import prefilter
+from database import Therapist
+
+
+@pytest.fixture(scope="module")
+def gazetteer():
+    return geo.gazetteer()
+
+
+@pytest.mark.parametrize("city, country, expected", [
+    ("CDMX", "mx", ("Ciudad de México", "México")),
+    ("ciudad de mexico", None, ("Ciudad de México", "México")),
+    ("Quito, Pichincha", None, ("Quito", "Ecuador")),
+    ("Guadalajara Jalisco", None, ("Guadalajara", "México")),
+    ("Valencia", "España", ("Valencia", "España")),
+    ("Valencia", "VE", ("Valencia", "Venezuela")),
+    ("Valencia, España", None, ("Valencia", "España")),
+    ("Santo Domingo", "Ecuador", ("Santo Domingo", "Ecuador")),
+    # Ambiguous without a country, or not in the country given
+    ("Valencia", None, None),
+    ("Valencia", "Ecuador", None),
+    ("Quito", "México", None),
+    ("Atlantis", None, None),
+])
+def test_lookup(gazetteer, city, country, expected):
+    place = gazetteer.lookup(city, country)
+    assert (place and (place.name, place.country)) == (expected or None)
+
+
+def test_find_in_text(gazetteer):
+    assert gazetteer.find_in_text("vivo en valencia") is None
+    assert gazetteer.find_in_text("vivo en valencia", "espana").country == "España"
+    # An ambiguous name does not hide an unambiguous one
+    assert gazetteer.find_in_text("entre valencia y quito").name == "Quito"
+    assert gazetteer.find_country("me mudé a Valencia, España") == "espana"
+    assert gazetteer.find_country("es lo que es") is None
+
+
+def test_patient_place_uses_named_country():
+    def place(*answers):
+        profile = prefilter.patient_profile(
+            [{"question": f"q{i}", "answer": a} for i, a in enumerate(answers)])
+        return profile["place"] and (profile["place"].name, profile["place"].country)
+
+    assert place("Valencia") is None
+    assert place("Valencia", "Me mudé desde Venezuela hace poco") == ("Valencia", "Venezuela")
+    assert place("Quito") == ("Quito", "Ecuador")
+
+
+def test_backfill_corrects_coordinates(engine):
+    therapists = Therapist.__table__
+    with engine.begin() as connection:
+        connection.execute(therapists.insert(), [
+            {"id": "spain", "name": "A", "email": "a@x.com", "city": "Valencia", "country": "España",
+             # Resolved to the first "Valencia" before the country decided
+             "latitude": 10.162, "longitude": -68.0077},
+            {"id": "ambiguous", "name": "B", "email": "b@x.com", "city": "Valencia", "country": None,
+             "latitude": 10.162, "longitude": -68.0077},
+            {"id": "quito", "name": "C", "email": "c@x.com", "city": "Quito", "country": "Ecuador",
+             "latitude": None, "longitude": None},
+        ])
+        assert geo.backfill_coordinates(connection) == 3
+        assert geo.backfill_coordinates(connection) == 0
+        rows = {r.id: (r.latitude, r.longitude) for r in connection.execute(
+            therapists.select())}
+    assert rows == {"spain": (39.4699, -0.3763), "ambiguous": (None, None),
+                    "quito": (-0.1807, -78.4678)}
+
+
+def test_spatial_index_matches_brute_force():
+    rng = random.Random(7)
+    therapists = [{"id": str(i), "on_site": True, "latitude": rng.uniform(-60, 60),
+                   "longitude": rng.uniform(-180, 180)} for i in range(300)]
+    index = geo.SpatialIndex(therapists)
+    for _ in range(20):
+        lat, lon = rng.uniform(-60, 60), rng.uniform(-180, 180)
+        distances = sorted((geo.haversine_km(lat, lon, t["latitude"], t["longitude"]), t["id"])
+                           for t in therapists)
+        within = {t["id"] for t, _ in index.within_km(lat, lon, 2000)}
+        assert within == {i for d, i in distances if d <= 2000}
+        assert [t["id"] for t, _ in index.nearest(lat, lon, 5)] == [i for _, i in distances[:5]]
+
+
+if __name__ == "__main__":
+    sys.exit(pytest.main([__file__, "-q"]))
@@ -0,0 +1,235 @@
+#!/usr/bin/env python3
+"""
+Tests for idempotent submissions (idempotency.py): submission keys,
+replays, in-process and cross-process duplicates, and release of the key
+when the first request fails, also after its client disconnected.
+
+Usage:
+    python -m pytest test_idempotency.py
+"""
+
+import asyncio
+import sys
+import threading
+import time
+from datetime import datetime, timedelta
+
+import pytest
+from sqlalchemy.orm import sessionmaker
+
+import idempotency
+import query_stats
+from database import IdempotencyKey
+
+
+@pytest.fixture
+def sessions(engine):
+    return sessionmaker(autocommit=False, autoflush=False, bind=engine)
+
+
+def _submit(sessions, key, calls, delay=0.0, error=None):
+    async def submit(comparison_id):
+        calls.append(comparison_id)
+        await asyncio.sleep(delay)
+        if error is not None:
+            raise error
+        db = sessions()
+        try:
+            idempotency.mark_done(db, key)
+            db.commit()
+        finally:
+            db.close()
+    return submit
+
+
+def _key_row(sessions, key):
+    db = sessions()
+    try:
+        return db.query(IdempotencyKey.comparison_id, IdempotencyKey.status).filter(
+            IdempotencyKey.key == key).first()
+    finally:
+        db.close()
+
+
+def test_submission_key_ignores_form():
+    answers = {"q1": ["Ansiedad", "Depresión"], "q2": "Hola  mundo", "q3": ""}
+    same = {"q1": ["depresion", "ANSIEDAD"], "q2": "hola mundo"}
+    key, ttl = idempotency.submission_key(None, "Ana@Example.com ", answers)
+    assert ttl == idempotency.IDEMPOTENCY_WINDOW_SECONDS
+    assert idempotency.submission_key(None, "ana@example.com", same)[0] == key
+    assert idempotency.submission_key(None, "ana@example.com", {"q2": "adios"})[0] != key
+
+    header_key, ttl = idempotency.submission_key("abc", "ana@example.com", answers)
+    assert ttl == idempotency.IDEMPOTENCY_KEY_TTL_SECONDS
+    assert header_key != key
+    assert idempotency.submission_key("abc", "otro@example.com", answers)[0] != header_key
+
+
+def test_repeat_is_replayed(sessions):
+    calls = []
+    first = asyncio.run(idempotency.run_once(sessions, "k", 60, _submit(sessions, "k", calls)))
+    second = asyncio.run(idempotency.run_once(sessions, "k", 60, _submit(sessions, "k", calls)))
+    assert first == (calls[0], False)
+    assert second == (calls[0], True)
+    assert len(calls) == 1
+    assert _key_row(sessions, "k") == (calls[0], idempotency.DONE)
+
+
+def test_concurrent_duplicates_wait_for_the_first(sessions):
+    calls = []
+
+    async def submit_all():
+        return await asyncio.gather(*[
+            idempotency.run_once(sessions, "k", 60, _submit(sessions, "k", calls, delay=0.2))
+            for _ in range(4)])
+
+    outcomes = asyncio.run(submit_all())
+    assert len(calls) == 1
+    assert {comparison_id for comparison_id, _ in outcomes} == {calls[0]}
+    assert sorted(replayed for _, replayed in outcomes) == [False, True, True, True]
+
+
+def test_waits_for_owner_in_another_process(sessions):
+    db = sessions()
+    now = datetime.utcnow()
+    db.add(IdempotencyKey(key="k", comparison_id="other", status=idempotency.PENDING,
+                          created_at=now, expires_at=now + timedelta(minutes=5)))
+    db.commit()
+
+    def finish():
+        time.sleep(0.3)
+        idempotency.mark_done(db, "k")
+        db.commit()
+
+    finisher = threading.Thread(target=finish)
+    finisher.start()
+    calls = []
+    outcome = asyncio.run(idempotency.run_once(sessions, "k", 60, _submit(sessions, "k", calls)))
+    finisher.join()
+    db.close()
+    assert outcome == ("other", True)
+    assert calls == []
+
+
+def test_abandoned_key_is_taken_over(sessions):
+    db = sessions()
+    stale = datetime.utcnow() - timedelta(seconds=idempotency.IDEMPOTENCY_PENDING_TIMEOUT_SECONDS + 1)
+    db.add(IdempotencyKey(key="k", comparison_id="crashed", status=idempotency.PENDING,
+                          created_at=stale, expires_at=stale + timedelta(minutes=10)))
+    db.commit()
+    db.close()
+
+    calls = []
+    comparison_id, replayed = asyncio.run(
+        idempotency.run_once(sessions, "k", 60, _submit(sessions, "k", calls)))
+    assert not replayed
+    assert calls == [comparison_id] and comparison_id != "crashed"
+
+
+def test_failure_releases_key(sessions):
+    calls = []
+    with pytest.raises(ValueError):
+        asyncio.run(idempotency.run_once(
+            sessions, "k", 60, _submit(sessions, "k", calls, error=ValueError("boom"))))
+    assert _key_row(sessions, "k") is None
+
+    comparison_id, replayed = asyncio.run(
+        idempotency.run_once(sessions, "k", 60, _submit(sessions, "k", calls)))
+    assert not replayed and calls == [calls[0], comparison_id]
+
+
+def _thread_submit(sessions, key, calls, release, error=None):
+    """Submit that runs in a thread, like the admission pool, until release is set"""
+    def process(comparison_id):
+        release.wait(5)
+        if error is not None:
+            raise error
+        db = sessions()
+        try:
+            idempotency.mark_done(db, key)
+            db.commit()
+        finally:
+            db.close()
+
+    async def submit(comparison_id):
+        calls.append(comparison_id)
+        await asyncio.shield(asyncio.get_running_loop().run_in_executor(None, process, comparison_id))
+    return submit
+
+
+def test_disconnect_keeps_key_until_thread_finishes(sessions):
+    calls = []
+    release = threading.Event()
+
+    async def disconnect_and_retry():
+        task = asyncio.create_task(idempotency.run_once(
+            sessions, "k", 60, _thread_submit(sessions, "k", calls, release)))
+        while not calls:
+            await asyncio.sleep(0.01)
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+
+        # The thread is still running the models: the retry must wait for it
+        assert _key_row(sessions, "k") == (calls[0], idempotency.PENDING)
+        retry = asyncio.create_task(idempotency.run_once(
+            sessions, "k", 60, _thread_submit(sessions, "k", calls, release)))
+        await asyncio.sleep(0.1)
+        assert not retry.done()
+        release.set()
+        return await retry
+
+    assert asyncio.run(disconnect_and_retry()) == (calls[0], True)
+    assert len(calls) == 1
+    assert _key_row(sessions, "k") == (calls[0], idempotency.DONE)
+    assert "k" not in idempotency._in_flight
+
+
+def test_disconnect_then_failure_releases_key(sessions):
+    calls = []
+    release = threading.Event()
+
+    async def disconnect():
+        task = asyncio.create_task(idempotency.run_once(
+            sessions, "k", 60, _thread_submit(sessions, "k", calls, release, ValueError("boom"))))
+        while not calls:
+            await asyncio.sleep(0.01)
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+        assert _key_row(sessions, "k") is not None
+        release.set()
+        while "k" in idempotency._in_flight:
+            await asyncio.sleep(0.01)
+
+    asyncio.run(disconnect())
+    assert _key_row(sessions, "k") is None
+
+
+def test_key_queries_count_for_the_request(engine, sessions):
+    query_stats.instrument_engine(engine)
+
+    async def request():
+        token = query_stats.begin_request()
+        await idempotency.run_once(sessions, "k", 60, _submit(sessions, "k", []))
+        return query_stats.end_request(token, "test")
+
+    # The claim's INSERT runs in the default executor
+    templates = asyncio.run(request()).templates
+    assert any(t.startswith("INSERT INTO idempotency_keys") for t in templates)
+
+
+def test_delete_expired(sessions):
+    db = sessions()
+    now = datetime.utcnow()
+    for i, expires_at in enumerate([now - timedelta(seconds=1)] * 3 + [now + timedelta(minutes=1)]):
+        db.add(IdempotencyKey(key=f"k{i}", comparison_id=f"c{i}", status=idempotency.DONE,
+                              created_at=now, expires_at=expires_at))
+    db.commit()
+    assert idempotency.delete_expired(db, batch_size=2) == 3
+    assert [key for key, in db.query(IdempotencyKey.key)] == ["k3"]
+    db.close()
+
+
+if __name__ == "__main__":
+    sys.exit(pytest.main([__file__, "-q"]))
@@ -0,0 +1,149 @@
+#!/usr/bin/env python3
+"""
+Tests for the matching job queue (job_queue.py): lease claims, takeover of
+expired leases, lease-checked completion, and idempotent result writes.
+
+Usage:
+    python -m pytest test_job_queue.py
+"""
+
+import sys
+from datetime import datetime, timedelta
+
+import pytest
+from sqlalchemy import text, update
+
+import cache_versions
+import job_queue
+import rollups
+from database import MatchingJob, ModelResult
+from matching import save_model_result
+from migrate import add_model_results_unique_index
+
+
+def _expire_lease(db, job_id):
+    db.execute(update(MatchingJob).where(MatchingJob.id == job_id).values(
+        lease_expires_at=datetime.utcnow() - timedelta(seconds=1)))
+    db.commit()
+
+
+def test_claim_holds_job_under_lease(db):
+    job_queue.enqueue_jobs(db, "session-1", ["random"])
+    db.commit()
+
+    job = job_queue.claim_job(db, "worker-a")
+    assert job is not None
+    assert (job.status, job.lease_owner, job.attempts) == (job_queue.RUNNING, "worker-a", 1)
+    assert job_queue.claim_job(db, "worker-b") is None
+    assert job_queue.heartbeat(db, job.id, "worker-a")
+    assert not job_queue.heartbeat(db, job.id, "worker-b")
+
+
+def test_expired_lease_is_reclaimed(db):
+    job_queue.enqueue_jobs(db, "session-1", ["random"])
+    db.commit()
+    job = job_queue.claim_job(db, "worker-a")
+    _expire_lease(db, job.id)
+
+    taken = job_queue.claim_job(db, "worker-b")
+    assert taken is not None and taken.id == job.id
+    assert (taken.lease_owner, taken.attempts) == ("worker-b", 2)
+
+    # The worker that lost the lease can neither extend it nor complete the job
+    assert not job_queue.heartbeat(db, job.id, "worker-a")
+    assert not job_queue.complete_job(db, taken, "worker-a", [{"therapist_id": "a"}], 1.0)
+    assert job_queue.complete_job(db, taken, "worker-b", [{"therapist_id": "b"}], 2.0)
+
+    results = db.query(ModelResult).all()
+    assert [(r.model_name, r.matches) for r in results] == [("random", [{"therapist_id": "b"}])]
+    assert job_queue.pending_job_count(db, "session-1") == 0
+    assert rollups.model_totals(db) == {"random": {"shown": 1, "selected": 0}}
+
+
+def test_results_are_rolled_up_once(db):
+    save_model_result(db, "session-1", "random", [{"therapist_id": "a"}], 10.0)
+    save_model_result(db, "session-1", "random", [{"therapist_id": "b"}], 20.0)
+    save_model_result(db, "session-2", "random", [], 0.0)
+    db.commit()
+
+    stats = rollups.model_stats(db, days=1)["models"]["random"]
+    assert (stats["results"], stats["empty_results"]) == (2, 1)
+    assert rollups.model_totals(db) == {"random": {"shown": 1, "selected": 0}}
+
+
+def test_exhausted_job_is_not_reclaimed(db, monkeypatch):
+    monkeypatch.setattr(job_queue, "JOB_MAX_ATTEMPTS", 1)
+    job_queue.enqueue_jobs(db, "session-1", ["random"])
+    db.commit()
+    job = job_queue.claim_job(db, "worker-a")
+    _expire_lease(db, job.id)
+
+    assert job_queue.claim_job(db, "worker-b") is None
+    assert job_queue.reap_exhausted_jobs(db) == 1
+    db.refresh(job)
+    assert job.status == job_queue.FAILED
+    assert db.query(ModelResult.matches).filter(
+        ModelResult.comparison_id == "session-1").scalar() == []
+
+
+def test_failed_attempt_is_retried_later(db):
+    job_queue.enqueue_jobs(db, "session-1", ["random"])
+    db.commit()
+    job = job_queue.claim_job(db, "worker-a")
+    job_queue.fail_job(db, job, "worker-a", "boom")
+
+    db.refresh(job)
+    assert (job.status, job.last_error, job.lease_owner) == (job_queue.PENDING, "boom", None)
+    assert job.run_after > datetime.utcnow()
+    assert job_queue.claim_job(db, "worker-b") is None
+
+
+def test_save_model_result_overwrites(db):
+    first = save_model_result(db, "session-1", "random", [{"therapist_id": "a"}], 1.0)
+    db.commit()
+    assert cache_versions.current(db, "results") == 0
+
+    second = save_model_result(db, "session-1", "random", [{"therapist_id": "b"}], 2.0)
+    db.commit()
+    assert second == first
+    rows = db.query(ModelResult).all()
+    assert [(r.matches, r.processing_time_ms) for r in rows] == [([{"therapist_id": "b"}], 2.0)]
+    assert cache_versions.current(db, "results") == 1
+
+
+@pytest.fixture
+def legacy_results(engine):
+    """A model_results table created before the unique constraint existed"""
+    with engine.begin() as connection:
+        connection.execute(text("DROP TABLE model_results"))
+        connection.execute(text(
+            "CREATE TABLE model_results (id VARCHAR PRIMARY KEY, comparison_id VARCHAR, "
+            "model_name VARCHAR NOT NULL, matches JSON NOT NULL, processing_time_ms FLOAT, "
+            "created_at DATETIME)"))
+        connection.execute(text(
+            "INSERT INTO model_results VALUES "
+            "('r1', 'session-1', 'random', '[1]', 1.0, '2025-01-01 10:00:00'), "
+            "('r2', 'session-1', 'random', '[2]', 1.0, '2025-01-01 11:00:00'), "
+            "('r3', 'session-1', 'gemini-2.5-flash', '[3]', 1.0, '2025-01-01 10:00:00')"))
+    return engine
+
+
+def test_migration_deduplicates_and_adds_unique_index(legacy_results, db):
+    with legacy_results.begin() as connection:
+        assert add_model_results_unique_index(connection) == 1
+    with legacy_results.begin() as connection:
+        assert add_model_results_unique_index(connection) == -1
+
+    assert sorted(db.query(ModelResult.id)) == [("r2",), ("r3",)]
+    save_model_result(db, "session-1", "random", [4], 1.0)
+    db.commit()
+    assert db.query(ModelResult.matches).filter(ModelResult.id == "r2").scalar() == [4]
+
+
+def test_fresh_table_needs_no_migration(engine):
+    with engine.begin() as connection:
+        assert add_model_results_unique_index(connection) == -1
+
+
+if __name__ == "__main__":
+    sys.exit(pytest.main([__file__, "-q"]))
@@ -0,0 +1,75 @@
+#!/usr/bin/env python3
+"""
+Tests for the event-loop watchdog (loop_watchdog.py): a blocked loop is
+recorded with its duration, the route whose task blocked it, and the stack
+captured while it was blocked.
+
+Usage:
+    python -m pytest test_loop_watchdog.py
+"""
+
+import asyncio
+import logging
+import sys
+import time
+
+import pytest
+
+from loop_watchdog import LoopWatchdog, event_loop_blocked_seconds, event_loop_blocked_total
+
+
+def _blocked_count(route):
+    return event_loop_blocked_total._values.get((route,), 0.0)
+
+
+def block_the_loop(seconds):
+    time.sleep(seconds)
+
+
+def test_records_blocked_loop(caplog):
+    before = _blocked_count("/slow")
+
+    async def scenario():
+        watchdog = LoopWatchdog(interval_ms=10, threshold_ms=100)
+        watchdog.start()
+        forget = watchdog.track({"type": "http", "path": "/slow"})
+        try:
+            await asyncio.sleep(0.05)
+            block_the_loop(0.4)
+            # Let the watchdog see the recovery and report the stall
+            await asyncio.sleep(0.2)
+        finally:
+            forget()
+            watchdog.stop()
+
+    with caplog.at_level(logging.WARNING, logger="loop_watchdog"):
+        asyncio.run(scenario())
+
+    assert _blocked_count("/slow") == before + 1
+    counts, total = event_loop_blocked_seconds._values[("/slow",)]
+    assert 0.25 <= total[0] < 1.0
+    warning = next(r.getMessage() for r in caplog.records if "/slow" in r.getMessage())
+    assert "block_the_loop" in warning
+
+
+def test_ignores_short_pauses():
+    before = _blocked_count("/fast")
+
+    async def scenario():
+        watchdog = LoopWatchdog(interval_ms=10, threshold_ms=300)
+        watchdog.start()
+        forget = watchdog.track({"type": "http", "path": "/fast"})
+        try:
+            for _ in range(5):
+                block_the_loop(0.02)
+                await asyncio.sleep(0.02)
+        finally:
+            forget()
+            watchdog.stop()
+
+    asyncio.run(scenario())
+    assert _blocked_count("/fast") == before
+
+
+if __name__ == "__main__":
+    sys.exit(pytest.main([__file__, "-q"]))
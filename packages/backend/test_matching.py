@@ -0,0 +1,54 @@
+#!/usr/bin/env python3
+"""
+Tests for answer encoding in the matching pipeline (matching.py): decoded
+answers for the matchers and the count of answers that did not fit their
+question.
+
+Usage:
+    python -m pytest test_matching.py
+"""
+
+import sys
+
+import pytest
+
+from matching import encode_answers
+from metrics import answer_errors_total
+
+QUESTIONS = [
+    {"id": "q1", "question_text": "Motivo", "question_type": "single_choice",
+     "options": ["Ansiedad", "Depresión"], "display_order": 1},
+    {"id": "q2", "question_text": "Intensidad", "question_type": "scale",
+     "options": None, "display_order": 2},
+    {"id": "q3", "question_text": "¿Primera vez?", "question_type": "yes_no",
+     "options": None, "display_order": 3},
+]
+
+
+def _errors_counted():
+    return answer_errors_total._values.get((), 0.0)
+
+
+def test_fitting_answers_are_not_counted():
+    before = _errors_counted()
+    user_answers, answer_features = encode_answers(
+        QUESTIONS, {"q1": "ansiedad", "q2": "7", "q3": "Sí"})
+
+    assert answer_features.errors == ()
+    assert _errors_counted() == before
+    assert [a["answer"] for a in user_answers] == ["Ansiedad", 7.0, "yes"]
+
+
+def test_answers_that_do_not_fit_are_counted():
+    before = _errors_counted()
+    _, answer_features = encode_answers(
+        QUESTIONS, {"q1": "Insomnio", "q2": "mucho", "q3": "Sí"})
+
+    assert len(answer_features.errors) == 2
+    assert _errors_counted() == before + 2
+    # Nothing the patient sent is lost
+    assert dict(answer_features.extras)["q1"] == "Insomnio"
+
+
+if __name__ == "__main__":
+    sys.exit(pytest.main([__file__, "-q"]))
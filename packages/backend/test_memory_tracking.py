@@ -0,0 +1,66 @@
+#!/usr/bin/env python3
+"""
+Tests for per-request memory tracking (memory_tracking.py): exact peaks for
+requests that run alone, and peaks that overlapping requests do not wipe.
+
+Usage:
+    python -m pytest test_memory_tracking.py
+"""
+
+import sys
+import tracemalloc
+
+import pytest
+
+from memory_tracking import MemoryTracker
+
+MB = 1024 * 1024
+
+
+@pytest.fixture
+def tracker():
+    tracker = MemoryTracker(frames=1)
+    tracker.start()
+    yield tracker
+    tracker.stop()
+
+
+def _allocate_and_free(size):
+    block = bytearray(size)
+    del block
+
+
+def test_request_alone_gets_its_own_peak(tracker):
+    _allocate_and_free(8 * MB)
+    started = tracker.begin_request()
+    _allocate_and_free(2 * MB)
+    tracker.end_request("/alone", started)
+
+    stats = tracker.route_stats()["/alone"]
+    assert 2 * MB <= stats["last_peak_bytes"] < 4 * MB
+    assert stats["overlapped_requests"] == 0
+
+
+def test_overlapping_request_keeps_earlier_peak(tracker):
+    first = tracker.begin_request()
+    _allocate_and_free(8 * MB)
+    # A request starting now must not reset the peak the first one reached
+    second = tracker.begin_request()
+    _allocate_and_free(1 * MB)
+    tracker.end_request("/second", second)
+    tracker.end_request("/first", first)
+
+    routes = tracker.route_stats()
+    assert routes["/first"]["last_peak_bytes"] >= 8 * MB
+    assert routes["/first"]["overlapped_requests"] == 1
+    assert routes["/second"]["overlapped_requests"] == 1
+
+    # Once nothing is in flight the next request measures from scratch again
+    started = tracker.begin_request()
+    tracker.end_request("/after", started)
+    assert tracker.route_stats()["/after"]["last_peak_bytes"] < 1 * MB
+    assert tracker.route_stats()["/after"]["overlapped_requests"] == 0
+
+
+if __name__ == "__main__":
+    sys.exit(pytest.main([__file__, "-q"]))
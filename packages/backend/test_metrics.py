@@ -0,0 +1,86 @@
+#!/usr/bin/env python3
+"""
+Tests for the metrics registry (metrics.py): counters, gauges and histograms
+with labels, rendered in the Prometheus text exposition format.
+
+Usage:
+    python -m pytest test_metrics.py
+"""
+
+import sys
+
+import pytest
+
+from metrics import Registry
+
+
+@pytest.fixture
+def registry():
+    return Registry()
+
+
+def test_counter_renders_per_label_set(registry):
+    requests = registry.counter("test_requests_total", "Requests", ("route", "status"))
+    requests.inc(route="/a", status="200")
+    requests.inc(2, route="/a", status="200")
+    requests.inc(route='/b"x', status="500")
+
+    assert registry.render().splitlines() == [
+        "# HELP test_requests_total Requests",
+        "# TYPE test_requests_total counter",
+        'test_requests_total{route="/a",status="200"} 3',
+        'test_requests_total{route="/b\\"x",status="500"} 1',
+    ]
+
+
+def test_register_returns_existing_metric(registry):
+    first = registry.counter("test_total", "Test")
+    assert registry.counter("test_total", "Test") is first
+
+
+def test_gauge_set_inc_dec_and_callback(registry):
+    in_flight = registry.gauge("test_in_flight", "In flight")
+    in_flight.inc()
+    in_flight.inc()
+    in_flight.dec()
+    depth = registry.gauge("test_depth", "Depth", ("queue",), callback=lambda: {("jobs",): 4})
+    depth.set(1.5, queue="mail")
+
+    lines = registry.render().splitlines()
+    assert "test_in_flight 1" in lines
+    assert 'test_depth{queue="mail"} 1.5' in lines
+    assert 'test_depth{queue="jobs"} 4' in lines
+
+
+def test_failing_gauge_callback_is_skipped(registry):
+    def broken():
+        raise RuntimeError("gone")
+    gauge = registry.gauge("test_broken", "Broken", callback=broken)
+    gauge.set(2)
+    assert "test_broken 2" in registry.render().splitlines()
+
+
+def test_histogram_buckets_are_cumulative(registry):
+    latency = registry.histogram("test_seconds", "Latency", ("stage",), buckets=(0.1, 1.0))
+    for value in (0.05, 0.1, 0.5, 3.0):
+        latency.observe(value, stage="load")
+
+    assert [l for l in registry.render().splitlines() if not l.startswith("#")] == [
+        'test_seconds_bucket{stage="load",le="0.1"} 2',
+        'test_seconds_bucket{stage="load",le="1"} 3',
+        'test_seconds_bucket{stage="load",le="+Inf"} 4',
+        'test_seconds_sum{stage="load"} 3.65',
+        'test_seconds_count{stage="load"} 4',
+    ]
+
+
+def test_histogram_time_observes_on_error(registry):
+    latency = registry.histogram("test_seconds", "Latency")
+    with pytest.raises(ValueError):
+        with latency.time():
+            raise ValueError("boom")
+    assert "test_seconds_count 1" in registry.render().splitlines()
+
+
+if __name__ == "__main__":
+    sys.exit(pytest.main([__file__, "-q"]))
@@ -0,0 +1,62 @@
+#!/usr/bin/env python3
+"""
+Tests for the sampling profiler (profiler.py): collapsed stacks and the
+limit on concurrent sessions, which holds even when callers disconnect.
+
+Usage:
+    python -m pytest test_profiler.py
+"""
+
+import asyncio
+import sys
+import threading
+
+import pytest
+
+import profiler
+
+
+def busy_work(stop):
+    while not stop.is_set():
+        sum(range(1000))
+
+
+def test_collapsed_stacks_name_the_busy_frame():
+    stop = threading.Event()
+    worker = threading.Thread(target=busy_work, args=(stop,), name="busy")
+    worker.start()
+    try:
+        session = profiler.ProfileSession(interval_ms=2)
+        session.run_for(0.1)
+    finally:
+        stop.set()
+        worker.join()
+
+    assert session.samples > 0
+    lines = session.collapsed().splitlines()
+    assert any(line.startswith("busy;") and "busy_work" in line for line in lines)
+
+
+def test_cancelled_caller_holds_slot_until_sampling_ends():
+    async def scenario():
+        release = threading.Event()
+        first = asyncio.ensure_future(profiler.run_in_slot(release.wait, 5))
+        await asyncio.sleep(0.05)
+        first.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await first
+
+        # The sampler still runs, so no other session may start
+        with pytest.raises(profiler.ProfilerBusy):
+            await profiler.run_in_slot(lambda: None)
+
+        release.set()
+        await asyncio.sleep(0.05)
+        assert await profiler.run_in_slot(lambda: "next") == "next"
+
+    assert profiler.PROFILER_MAX_SESSIONS == 1
+    asyncio.run(scenario())
+
+
+if __name__ == "__main__":
+    sys.exit(pytest.main([__file__, "-q"]))
@@ -0,0 +1,272 @@
+#!/usr/bin/env python3
+"""
+Query-count and latency budgets for every route in main.py.
+
+Runs each route in-process against a temporary SQLite database seeded with
+synthetic data, and checks the number of SQL statements per request (from the
+X-DB-Query-Count header, see query_stats.py) and the median latency against
+query_budgets.json. Listings marked "independent_of_history" are run again
+after loading more history and must issue the same number of statements.
+A route without a budget fails, so new endpoints get one. The SQLite plans of
+attribute filters (attributes.py) are checked with EXPLAIN QUERY PLAN and must
+not scan a table.
+
+Usage:
+    python test_query_budgets.py            # check the budgets
+    python test_query_budgets.py --update   # rewrite query budgets from this run
+    python -m pytest test_query_budgets.py
+"""
+
+import json
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+BUDGETS_FILE = os.path.join(os.path.dirname(
+    os.path.abspath(__file__)), "query_budgets.json")
+RUNS_PER_CASE = 5
+
+# The app reads its configuration at import time
+_tmpdir = tempfile.mkdtemp(prefix="kuna-budgets-")
+os.environ.update({
+    "DATABASE_URL": f"sqlite:///{_tmpdir}/budgets.db",
+    "GEMINI_API_KEY": os.getenv("GEMINI_API_KEY", "budgets"),
+    "GEMINI_SIMULATED_LATENCY_MS": "0",
+    "DEBUG": "1",
+    "MATCHING_MODE": "inline",
+    "MODEL_ALLOCATION": "all",
+})
+
+from fastapi.testclient import TestClient  # noqa: E402
+
+import attributes  # noqa: E402
+import main  # noqa: E402
+import rollups  # noqa: E402
+from database import SessionLocal, engine  # noqa: E402
+from migrate import migrate  # noqa: E402
+from synthetic_data import SyntheticData, load_catalog, load_history  # noqa: E402
+
+THERAPIST = {
+    "name": "Dr. María González López",
+    "email": "maria.gonzalez@ejemplo.com",
+    "specialties": ["Ansiedad y estrés", "Depresión"],
+    "therapeutic_approaches": ["Terapia Cognitivo-Conductual (CBT)"],
+    "session_price": 75.0,
+    "country": "México",
+    "city": "Ciudad de México",
+    "remote": True,
+    "on_site": True,
+    "bio": "Psicóloga clínica con más de 10 años de experiencia.",
+    "years_experience": 10,
+    "languages": ["Español"],
+    "therapeutic_style": ["Contenedor y empático 🫂"],
+    "age_groups": ["Adultos (26–50)"],
+    "weekly_availability": "Lunes: 09:00-17:00",
+}
+
+
+class BudgetRun:
+    def __init__(self):
+        self.data = SyntheticData(seed=7)
+        self.client = TestClient(main.app)
+        self.headers = {}
+        self.state = {}
+
+    def seed(self, sessions: int):
+        load_history(engine, self.data, sessions, days=30)
+        db = SessionLocal()
+        try:
+            rollups.rebuild(db)
+        finally:
+            db.close()
+
+    def setup(self):
+        migrate()
+        load_catalog(engine, self.data, 200, questions=True)
+        self.seed(50)
+        # The lifespan warm-up does not run without a server
+        main._warm_up()
+        token = self.client.post(
+            "/api/admin/login", data={"email": "admin@kuna.com", "password": "secret123"}).json()["access_token"]
+        self.headers = {"Authorization": f"Bearer {token}"}
+        self.state["questions"] = self.client.get("/api/questions").json()
+
+    # Each case returns (method, url, kwargs) for one request; called once per run
+    def cases(self):
+        h = self.headers
+        state = self.state
+        n = iter(range(10 ** 6))
+
+        def submit():
+            return "POST", "/api/submit-questionnaire", {"json": {
+                "email": "paciente@ejemplo.com", "answers": self.data.answers(state["questions"])}}
+
+        def results():
+            if "session_id" not in state:
+                _, url, kwargs = submit()
+                state["session_id"] = self.client.post(
+                    url, **kwargs).json()["session_id"]
+            return "GET", f"/api/results/{state['session_id']}", {}
+
+        def select():
+            results()
+            therapist_id = self.client.get(
+                f"/api/results/{state['session_id']}").json()["results"][0]["matches"][0]["id"]
+            return "POST", "/api/select-therapist", {"json": {
+                "session_id": state["session_id"], "selected_therapist_id": therapist_id,
+                "feedback": "Seleccionado de Model A"}}
+
+        def register():
+            return "POST", "/api/register-therapist", {"json": {
+                **THERAPIST, "email": f"registro{next(n)}@ejemplo.com"}}
+
+        def delete():
+            therapist = {**THERAPIST, "email": f"borrar{next(n)}@ejemplo.com"}
+            therapist_id = self.client.post(
+                "/api/register-therapist", json=therapist).json()["id"]
+            return "DELETE", f"/api/admin/therapists/{therapist_id}", {"headers": h}
+
+        return {
+            "GET /": lambda: ("GET", "/", {}),
+            "GET /health": lambda: ("GET", "/health", {}),
+            "GET /livez": lambda: ("GET", "/livez", {}),
+            "GET /readyz": lambda: ("GET", "/readyz", {}),
+            "GET /metrics": lambda: ("GET", "/metrics", {}),
+            "POST /api/admin/login": lambda: ("POST", "/api/admin/login", {
+                "data": {"email": "admin@kuna.com", "password": "secret123"}}),
+            "GET /api/admin/me": lambda: ("GET", "/api/admin/me", {"headers": h}),
+            "GET /api/questions": lambda: ("GET", "/api/questions", {}),
+            "POST /api/submit-questionnaire": submit,
+            "GET /api/results/{session_id}": results,
+            "POST /api/select-therapist": select,
+            "POST /api/register-therapist": register,
+            "GET /api/admin/therapists": lambda: ("GET", "/api/admin/therapists", {"headers": h}),
+            "DELETE /api/admin/therapists/{therapist_id}": delete,
+            "GET /api/admin/sessions": lambda: ("GET", "/api/admin/sessions", {"headers": h}),
+            "GET /api/admin/model-stats": lambda: ("GET", "/api/admin/model-stats", {"headers": h}),
+            "GET /api/admin/admission": lambda: ("GET", "/api/admin/admission", {"headers": h}),
+            "GET /api/admin/memory": lambda: ("GET", "/api/admin/memory", {"headers": h}),
+            "POST /api/admin/profile": lambda: ("POST", "/api/admin/profile", {
+                "headers": h, "params": {"seconds": 0.05}}),
+            "POST /api/admin/profile/route": lambda: ("POST", "/api/admin/profile/route", {
+                "headers": h, "params": {"route": "/", "timeout_seconds": 0.05}}),
+        }
+
+    def measure(self, case):
+        """Query counts and median latency in ms over RUNS_PER_CASE requests"""
+        counts, latencies = [], []
+        for _ in range(RUNS_PER_CASE):
+            method, url, kwargs = case()
+            started = time.perf_counter()
+            response = self.client.request(method, url, **kwargs)
+            latencies.append((time.perf_counter() - started) * 1000)
+            if response.status_code >= 400:
+                raise AssertionError(
+                    f"{method} {url} returned {response.status_code}: {response.text}")
+            counts.append(int(response.headers["X-DB-Query-Count"]))
+        return counts, statistics.median(latencies)
+
+
+def app_routes():
+    keys = set()
+    for route in main.app.routes:
+        for method in getattr(route, "methods", None) or ():
+            if method != "HEAD" and not route.path.startswith(("/docs", "/redoc", "/openapi")):
+                keys.add(f"{method} {route.path}")
+    return keys
+
+
+# Attribute filters whose plans are checked: one attribute, and an intersection
+PLAN_CASES = [
+    {"languages": attributes.label_filter("languages", ["Inglés"])},
+    {"languages": attributes.label_filter("languages", ["english"]),
+     "specialties": attributes.label_filter("specialties", ["ansiedad", "Depresión"])},
+]
+
+
+def check_plans():
+    """Return attribute filters whose query plan scans a table instead of searching an index"""
+    from sqlalchemy import select
+
+    from database import Therapist
+
+    failures = []
+    with engine.connect() as connection:
+        for required in PLAN_CASES:
+            query = attributes.filter_query(required)
+            # As run by candidate_ids, and as a subquery of the admin listing
+            for statement in (attributes.candidates_query(required),
+                              select(Therapist.id).where(Therapist.id.in_(query))):
+                sql = str(statement.compile(engine, compile_kwargs={"literal_binds": True}))
+                plan = [row[-1] for row in connection.exec_driver_sql(f"EXPLAIN QUERY PLAN {sql}")]
+                if any(step.startswith("SCAN") for step in plan) or not any(
+                        "therapist_attributes USING COVERING INDEX" in step for step in plan):
+                    failures.append(f"attribute filter {sorted(required)} is not indexed: {plan}")
+    return failures
+
+
+def check_budgets(update: bool = False):
+    """Return a list of budget violations (empty when every route is within budget)"""
+    with open(BUDGETS_FILE) as f:
+        budgets = json.load(f)
+
+    run = BudgetRun()
+    run.setup()
+    cases = run.cases()
+    failures = check_plans()
+
+    for key in sorted(app_routes() - set(cases)):
+        failures.append(f"{key}: no budget case in test_query_budgets.py")
+
+    observed = {}
+    for key, case in cases.items():
+        counts, latency_ms = run.measure(case)
+        observed[key] = (max(counts), latency_ms)
+        budget = budgets.get(key)
+        print(f"{key:50} queries {max(counts):>3}  median {latency_ms:>8.1f}ms")
+        if update:
+            budgets.setdefault(key, {"max_ms": 250})[
+                "max_queries"] = max(counts)
+            continue
+        if budget is None:
+            failures.append(f"{key}: missing from {os.path.basename(BUDGETS_FILE)}")
+            continue
+        if max(counts) > budget["max_queries"]:
+            failures.append(
+                f"{key}: {max(counts)} queries, budget {budget['max_queries']}")
+        if latency_ms > budget["max_ms"]:
+            failures.append(
+                f"{key}: median {latency_ms:.1f}ms, budget {budget['max_ms']}ms")
+
+    # Listings must not issue more statements as history grows
+    run.seed(500)
+    for key, budget in budgets.items():
+        if budget.get("independent_of_history") and key in cases:
+            counts, _ = run.measure(cases[key])
+            if max(counts) != observed[key][0]:
+                failures.append(
+                    f"{key}: {observed[key][0]} queries with 50 sessions but {max(counts)} with 550")
+
+    if update:
+        with open(BUDGETS_FILE, "w") as f:
+            json.dump(dict(sorted(budgets.items())), f, indent=2, ensure_ascii=False)
+            f.write("\n")
+        print(f"Query budgets written to {BUDGETS_FILE}")
+    return failures
+
+
+def test_query_budgets():
+    failures = check_budgets()
+    assert not failures, "\n".join(failures)
+
+
+if __name__ == "__main__":
+    failures = check_budgets(update="--update" in sys.argv)
+    if failures:
+        print("\n✗ Budget violations:")
+        for failure in failures:
+            print(f"  {failure}")
+        sys.exit(1)
+    print("\n✓ All routes within budget")
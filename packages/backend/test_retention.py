@@ -0,0 +1,113 @@
+#!/usr/bin/env python3
+"""
+Tests for session retention (retention.py): archiving old sessions into
+partitioned files, reading them back, and rollups that still count them.
+
+Usage:
+    python -m pytest test_retention.py
+"""
+
+import os
+import sys
+from datetime import datetime, timedelta
+
+import pytest
+
+import cache_versions
+import retention
+import rollups
+from database import (ArchivedSession, MatchingJob, ModelAllocation, ModelComparison,
+                      ModelDailyRollup, ModelResult, UserSelection)
+
+NOW = datetime(2025, 6, 1, 12, 0)
+CUTOFF = NOW - timedelta(days=365)
+
+
+@pytest.fixture(autouse=True)
+def archive_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(retention, "ARCHIVE_DIR", str(tmp_path / "archive"))
+    return tmp_path / "archive"
+
+
+def _session(db, session_id, created_at, job_status="done"):
+    db.add(ModelComparison(id=session_id, email=f"{session_id}@x.com",
+                           questionnaire_answers={"q1": "Ansiedad"}, created_at=created_at))
+    db.add(ModelResult(comparison_id=session_id, model_name="random",
+                       matches=[{"therapist_id": "t1"}], processing_time_ms=1.5, created_at=created_at))
+    db.add(ModelResult(comparison_id=session_id, model_name="gemini-2.5-flash",
+                       matches=[], processing_time_ms=900.0, created_at=created_at))
+    db.add(UserSelection(comparison_id=session_id, selected_model="random",
+                         selected_therapist_id="t1", feedback="ok", created_at=created_at))
+    db.add(ModelAllocation(comparison_id=session_id, model_name="random",
+                           inclusion_probability=1.0, allocated=True, created_at=created_at))
+    db.add(MatchingJob(comparison_id=session_id, model_name="random", status=job_status,
+                       created_at=created_at, updated_at=created_at))
+
+
+@pytest.fixture
+def sessions(db):
+    old = CUTOFF - timedelta(days=30)
+    _session(db, "old-1", old)
+    _session(db, "old-2", old + timedelta(hours=1))
+    _session(db, "old-3", old + timedelta(days=2))
+    _session(db, "old-pending", old, job_status="pending")
+    _session(db, "recent", NOW)
+    db.commit()
+
+
+def _rollups(db):
+    return sorted((r.day, r.model_name, r.results_count, r.empty_results_count, r.selections_count,
+                   r.latency_sum_ms) for r in db.query(ModelDailyRollup))
+
+
+def test_archive_moves_old_sessions(engine, db, sessions, archive_dir):
+    assert retention.archive(engine, CUTOFF, batch_size=2) == 3
+
+    live = {c.id for c in db.query(ModelComparison.id)}
+    assert live == {"old-pending", "recent"}
+    for table in (ModelResult, UserSelection, ModelAllocation, MatchingJob):
+        assert {r.comparison_id for r in db.query(table.comparison_id)} == live
+    assert {a.id for a in db.query(ArchivedSession.id)} == {"old-1", "old-2", "old-3"}
+    assert cache_versions.current(db, "sessions") == 2  # One bump per batch
+
+    days = sorted(os.listdir(archive_dir / "sessions"))
+    old = (CUTOFF - timedelta(days=30)).date()
+    assert days == [f"date={old.isoformat()}", f"date={(old + timedelta(days=2)).isoformat()}"]
+
+    # Nothing left to archive
+    assert retention.archive(engine, CUTOFF) == 0
+
+
+def test_read_archived(engine, db, sessions):
+    retention.archive(engine, CUTOFF, batch_size=2)
+
+    record = retention.read_archived(db, "old-2")
+    assert record["id"] == "old-2"
+    assert record["email"] == "old-2@x.com"
+    assert record["questionnaire_answers"] == {"q1": "Ansiedad"}
+    assert [s["selected_therapist_id"] for s in record["selections"]] == ["t1"]
+    assert [a["model_name"] for a in record["allocations"]] == ["random"]
+
+    results = {r.model_name: r for r in retention.archived_results(record)}
+    assert results["random"].matches == [{"therapist_id": "t1"}]
+    assert results["gemini-2.5-flash"].processing_time_ms == 900.0
+    assert results["random"].created_at == CUTOFF - timedelta(days=30, hours=-1)
+
+    assert retention.read_archived(db, "recent") is None
+    assert retention.read_archived(db, "missing") is None
+    assert sorted(r["id"] for r in retention.iter_archive(db)) == ["old-1", "old-2", "old-3"]
+
+
+def test_rollups_count_archived_sessions(engine, db, sessions):
+    rollups.rebuild(db)
+    before = _rollups(db)
+    assert before
+
+    retention.archive(engine, CUTOFF)
+    db.expire_all()
+    rollups.rebuild(db)
+    assert _rollups(db) == before
+
+
+if __name__ == "__main__":
+    sys.exit(pytest.main([__file__, "-q"]))
@@ -0,0 +1,101 @@
+#!/usr/bin/env python3
+"""
+Tests for the per-model rollups (rollups.py): counts kept by the flush
+listener, latency percentiles from buckets, and a rebuild from history that
+matches the incremental counts.
+
+Usage:
+    python -m pytest test_rollups.py
+"""
+
+import sys
+from datetime import datetime, timedelta
+
+import pytest
+from sqlalchemy.orm import sessionmaker
+
+import rollups
+from database import ModelComparison, ModelDailyRollup, ModelLatencyBucket, ModelResult, UserSelection
+from matching import save_model_result
+
+
+# One long-lived factory, like SessionLocal, with the listener installed once
+RollupSession = sessionmaker(autocommit=False, autoflush=False)
+rollups.install(RollupSession)
+
+
+@pytest.fixture
+def session(engine):
+    session = RollupSession(bind=engine)
+    yield session
+    session.close()
+
+
+def _snapshot(db):
+    daily = {(r.day, r.model_name): (r.results_count, r.empty_results_count,
+                                     r.selections_count, round(r.latency_sum_ms, 6))
+             for r in db.query(ModelDailyRollup)}
+    buckets = {(b.day, b.model_name, b.bucket): b.count for b in db.query(ModelLatencyBucket)}
+    return daily, buckets
+
+
+def _write_history(db):
+    yesterday = datetime.utcnow() - timedelta(days=1)
+    for i in range(6):
+        cid = f"session-{i}"
+        db.add(ModelComparison(id=cid, email="a@example.com", questionnaire_answers={}))
+        db.add(ModelResult(comparison_id=cid, model_name="random",
+                           matches=[{"id": "t1"}] if i % 3 else [], processing_time_ms=10.0 * (i + 1),
+                           created_at=yesterday if i < 2 else None))
+        db.flush()
+        save_model_result(db, cid, "local-tfidf", [{"id": "t2"}], 250.0 + i)
+        if i % 2:
+            db.add(UserSelection(comparison_id=cid, selected_model="local-tfidf",
+                                 selected_therapist_id="t2"))
+    db.add(UserSelection(comparison_id="session-0", selected_model=None, selected_therapist_id="t1"))
+    db.commit()
+
+
+def test_listener_counts_results_and_selections(session):
+    _write_history(session)
+
+    assert rollups.model_totals(session) == {
+        "random": {"shown": 4, "selected": 0},
+        "local-tfidf": {"shown": 6, "selected": 3},
+        "unknown": {"shown": 0, "selected": 1},
+    }
+    stats = rollups.model_stats(session, days=7)["models"]
+    assert stats["random"]["results"] == 6
+    assert stats["random"]["empty_results"] == 2
+    assert stats["local-tfidf"]["win_rate"] == 0.5
+    assert stats["local-tfidf"]["avg_processing_time_ms"] == pytest.approx(252.5)
+    assert len(stats["random"]["daily"]) == 2
+
+
+def test_rebuild_matches_incremental_counts(session):
+    _write_history(session)
+    incremental = _snapshot(session)
+    assert incremental[0] and incremental[1]
+
+    # An overwrite by the upsert must not count the result twice either
+    save_model_result(session, "session-0", "local-tfidf", [{"id": "t3"}], 250.0)
+    session.commit()
+
+    rollups.rebuild(session)
+    assert _snapshot(session) == incremental
+
+
+def test_percentile_from_buckets():
+    buckets = [0] * (len(rollups.LATENCY_BUCKET_BOUNDS_MS) + 1)
+    for ms in [1.0] * 50 + [100.0] * 45 + [5000.0] * 5:
+        buckets[rollups.latency_bucket(ms)] += 1
+
+    # Percentiles are reported as the upper bound of their bucket
+    assert 1.0 < rollups.percentile(buckets, 0.50) <= 1.5
+    assert 100.0 < rollups.percentile(buckets, 0.95) <= 150.0
+    assert 5000.0 < rollups.percentile(buckets, 0.99) <= 7500.0
+    assert rollups.percentile([0] * len(buckets), 0.5) is None
+
+
+if __name__ == "__main__":
+    sys.exit(pytest.main([__file__, "-q"]))
@@ -0,0 +1,134 @@
+#!/usr/bin/env python3
+"""
+Tests for the write-behind selection buffer (selection_buffer.py): batched
+flushes, journal segments, replay of segments left by a crashed process, and
+dead-lettering of rows the database rejects.
+
+Usage:
+    python -m pytest test_selection_buffer.py
+"""
+
+import json
+import os
+import sys
+
+import pytest
+from sqlalchemy import func, select
+from sqlalchemy.exc import OperationalError
+
+import selection_buffer
+from database import ModelDailyRollup, UserSelection
+from metrics import selections_flushed_total
+from selection_buffer import SelectionBuffer, make_selection
+
+
+@pytest.fixture
+def journal_dir(tmp_path):
+    return str(tmp_path / "journal")
+
+
+@pytest.fixture
+def buffer(engine, journal_dir):
+    buffer = SelectionBuffer(engine, batch_size=1000, interval_seconds=3600, journal_dir=journal_dir)
+    yield buffer
+    buffer.stop()
+
+
+def _stored(engine):
+    with engine.connect() as connection:
+        ids = {row.id for row in connection.execute(select(UserSelection.id))}
+        rolled_up = connection.execute(select(func.sum(ModelDailyRollup.selections_count))).scalar()
+    return ids, rolled_up or 0
+
+
+def _segments(journal_dir):
+    return sorted(f for f in os.listdir(journal_dir) if f.startswith("selections-"))
+
+
+def _dead_letters(journal_dir):
+    path = os.path.join(journal_dir, selection_buffer.DEAD_LETTER_FILE)
+    if not os.path.exists(path):
+        return []
+    with open(path, encoding="utf-8") as f:
+        return [json.loads(line) for line in f]
+
+
+def test_flush_writes_batch_and_removes_journal(engine, buffer, journal_dir):
+    ids = [buffer.add(make_selection("session-1", "random", f"t{i}", None)) for i in range(3)]
+    assert buffer.add(make_selection("session-1", "random", "t0", None, ids[0])) == ids[0]
+    assert buffer.pending == 3
+    assert len(_segments(journal_dir)) == 1
+
+    assert buffer.flush() == 3
+    assert buffer.pending == 0
+    assert _segments(journal_dir) == []
+    assert _stored(engine) == (set(ids), 3)
+
+
+def test_poison_row_is_dead_lettered(engine, buffer, journal_dir):
+    before = selections_flushed_total._values.get(("dead_letter",), 0)
+    good = [buffer.add(make_selection("session-1", "random", f"t{i}", None)) for i in range(2)]
+    bad = buffer.add(make_selection("session-1", "random", None, "no therapist"))
+
+    assert buffer.flush() == 2
+    assert buffer.pending == 0
+    assert _segments(journal_dir) == []
+    assert _stored(engine) == (set(good), 2)
+    assert [d["selection"]["id"] for d in _dead_letters(journal_dir)] == [bad]
+    assert selections_flushed_total._values[("dead_letter",)] == before + 1
+
+    # Later selections are not held back by it
+    later = buffer.add(make_selection("session-2", "random", "t9", None))
+    assert buffer.flush() == 1
+    assert later in _stored(engine)[0]
+
+
+def test_unavailable_database_keeps_batch(engine, buffer, journal_dir, monkeypatch):
+    def unavailable(engine, selections):
+        raise OperationalError("INSERT", {}, Exception("database is locked"))
+
+    selection_id = buffer.add(make_selection("session-1", "random", "t1", None))
+    monkeypatch.setattr(selection_buffer, "write_selections", unavailable)
+    with pytest.raises(OperationalError):
+        buffer.flush()
+    assert buffer.pending == 1
+    assert len(_segments(journal_dir)) == 1
+    assert _dead_letters(journal_dir) == []
+
+    monkeypatch.undo()
+    assert buffer.flush() == 1
+    assert _stored(engine) == ({selection_id}, 1)
+
+
+def test_replay_orphaned_segment(engine, buffer, journal_dir):
+    written = make_selection("session-1", "random", "t0", None)
+    selection_buffer.write_selections(engine, [written])
+    lost = [make_selection("session-1", "random", f"t{i}", None) for i in range(1, 3)]
+    poison = make_selection("session-1", "random", None, None)
+
+    # A segment left by a crashed process: a selection already written, two
+    # that were not, a bad row and a torn last line
+    os.makedirs(journal_dir)
+    orphan = os.path.join(journal_dir, "selections-1-dead-1.ndjson")
+    with open(orphan, "w", encoding="utf-8") as f:
+        for selection in [written, *lost, poison]:
+            f.write(selection_buffer._encode(selection) + "\n")
+        f.write('{"id": "torn')
+
+    # A segment a live buffer holds is left alone
+    live = SelectionBuffer(engine, batch_size=1000, interval_seconds=3600, journal_dir=journal_dir)
+    held = live.add(make_selection("session-2", "random", "t9", None))
+
+    assert buffer.replay_orphaned() == 4
+    assert not os.path.exists(orphan)
+    assert _stored(engine) == ({written["id"]} | {s["id"] for s in lost}, 3)
+    assert [d["selection"]["id"] for d in _dead_letters(journal_dir)] == [poison["id"]]
+    assert len(_segments(journal_dir)) == 1
+
+    live.stop()
+    assert held in _stored(engine)[0]
+    assert _segments(journal_dir) == []
+
+
+if __name__ == "__main__":
+    sys.exit(pytest.main([__file__, "-q"]))
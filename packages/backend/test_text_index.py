@@ -0,0 +1,124 @@
+#!/usr/bin/env python3
+"""
+Tests for the TF-IDF bio index (text_index.py): tokenizing, ranking order
+against a brute-force cosine, incremental updates, sync and persistence.
+
+Usage:
+    python -m pytest test_text_index.py
+"""
+
+import math
+import random
+import sys
+from collections import Counter
+
+import pytest
+
+from text_index import TextIndex, stem, therapist_text, tokenize
+
+BIOS = {
+    "anxiety": "Acompaño a personas con ansiedad, ataques de pánico y estrés laboral.",
+    "grief": "Trabajo el duelo y las pérdidas, acompañando procesos de despedida.",
+    "couples": "Terapia de pareja y familia; conflictos, comunicación y rupturas.",
+    "teens": "Psicóloga de adolescentes: ansiedad escolar, autoestima y familia.",
+    "trauma": "Especialista en trauma y estrés postraumático con EMDR.",
+}
+
+
+def brute_force(documents, text):
+    """Cosine similarity of text to every document, computed from scratch"""
+    tokenized = {doc_id: Counter(tokenize(t)) for doc_id, t in documents.items()}
+    frequency = Counter(term for counts in tokenized.values() for term in counts)
+
+    def vector(counts):
+        return {term: (1 + math.log(tf)) * (math.log((1 + len(documents)) / (1 + frequency[term])) + 1)
+                for term, tf in counts.items() if term in frequency}
+
+    def norm(v):
+        return math.sqrt(sum(w * w for w in v.values())) or 1.0
+
+    query = vector(Counter(tokenize(text)))
+    scores = {}
+    for doc_id, counts in tokenized.items():
+        document = vector(counts)
+        dot = sum(w * document.get(term, 0.0) for term, w in query.items())
+        if dot:
+            scores[doc_id] = dot / (norm(query) * norm(document))
+    return scores
+
+
+@pytest.fixture
+def index():
+    index = TextIndex(path="")
+    index.sync({"id": doc_id, "bio": bio} for doc_id, bio in BIOS.items())
+    return index
+
+
+def test_tokenize():
+    assert stem("ansiosas") == stem("ansioso") == "ansios"
+    assert stem("conflictos") == stem("conflicto")
+    assert tokenize("Tengo mucha ANSIEDAD desde 2020, y estrés") == ["much", "ansiedad", "estr"]
+    assert therapist_text({"bio": "Hola", "additional_info": None}) == "Hola"
+
+
+def test_ranking_order(index):
+    results = index.search("Tengo ansiedad y estrés en el trabajo", 3)
+    assert [doc_id for doc_id, _ in results][:1] == ["anxiety"]
+    assert [s for _, s in results] == sorted((s for _, s in results), reverse=True)
+    assert index.search("problemas con mi pareja y mi familia", 1)[0][0] == "couples"
+    assert index.search("murió mi padre, estoy en duelo", 1)[0][0] == "grief"
+    assert index.search("xyz", 3) == []
+
+
+def test_scores_match_brute_force(index):
+    for text in ["ansiedad y estrés", "familia y adolescentes", "trauma emdr", "duelo"]:
+        expected = brute_force(BIOS, text)
+        results = dict(index.search(text, len(BIOS)))
+        assert results.keys() == expected.keys()
+        for doc_id, score in expected.items():
+            assert results[doc_id] == pytest.approx(score)
+
+
+def test_incremental_updates(index):
+    index.search("ansiedad", 5)  # Builds the impact list that updates must keep current
+    index.remove("anxiety")
+    assert "anxiety" not in dict(index.search("ansiedad", 5))
+    index.add("panic", "Ansiedad, ansiedad social y crisis de ansiedad")
+    assert index.search("ansiedad", 1)[0][0] == "panic"
+    assert len(index) == len(BIOS)
+
+
+def test_sync_reindexes_only_changes(index):
+    therapists = [{"id": doc_id, "bio": bio} for doc_id, bio in BIOS.items()]
+    assert index.sync(therapists) == 0
+    therapists[0]["bio"] = "Ahora trabajo sobre todo con duelo"
+    assert index.sync(therapists[:4]) == 2  # One changed, one gone
+    assert "trauma" not in dict(index.search("trauma", 5))
+    assert "anxiety" in dict(index.search("duelo", 5))
+
+
+def test_max_postings_keeps_best_documents():
+    rng = random.Random(5)
+    documents = {str(i): " ".join(["ansiedad"] * rng.randint(1, 5) + ["relleno"] * rng.randint(0, 20))
+                 for i in range(50)}
+    full = TextIndex(path="")
+    full.sync({"id": i, "bio": t} for i, t in documents.items())
+    capped = TextIndex(path="", max_postings=10)
+    capped.sync({"id": i, "bio": t} for i, t in documents.items())
+    assert capped.search("ansiedad", 5) == full.search("ansiedad", 5)
+
+
+def test_save_and_load(index, tmp_path):
+    index.path = str(tmp_path / "index.pickle")
+    assert index.save()
+    assert not index.save()  # Unchanged since
+
+    loaded = TextIndex(path=index.path)
+    assert loaded.load()
+    assert len(loaded) == len(index)
+    assert loaded.search("ansiedad familia", 3) == index.search("ansiedad familia", 3)
+    assert not TextIndex(path=str(tmp_path / "missing.pickle")).load()
+
+
+if __name__ == "__main__":
+    sys.exit(pytest.main([__file__, "-q"]))
@@ -0,0 +1,106 @@
+#!/usr/bin/env python3
+"""
+Tests for the concept vocabulary (vocabulary.py): folding, the Aho-Corasick
+automaton's whole-word leftmost-longest matches, and the concepts found in
+labels and patient answers.
+
+Usage:
+    python -m pytest test_vocabulary.py
+"""
+
+import random
+import sys
+
+import pytest
+
+import vocabulary
+from vocabulary import Automaton, Vocabulary, fold
+
+
+def naive_find(patterns, folded):
+    """Leftmost-longest whole-word matches by trying every pattern at every word"""
+    text = f" {folded} "
+    matches = []
+    position = 0
+    while position < len(folded):
+        if position and folded[position - 1] != " ":
+            position += 1
+            continue
+        found = [p for p in patterns if text.startswith(f" {p} ", position)]
+        if found:
+            longest = max(found, key=len)
+            matches.append((position, position + len(longest), tuple(sorted(patterns[longest]))))
+            position += len(longest) + 1
+        else:
+            position += 1
+    return matches
+
+
+def test_fold():
+    assert fold("  Contenedor y Empático 🫂 ") == "contenedor y empatico"
+    assert fold("Terapia Cognitivo-Conductual (CBT)") == "terapia cognitivo conductual cbt"
+    assert fold("snake_case") == "snake case"
+
+
+def test_automaton_leftmost_longest_whole_words():
+    automaton = Automaton({"adultos": ["a"], "adultos mayores": ["b"], "mayores": ["c"],
+                           "act": ["d"], "ansiedad": ["e"]})
+    # The longer match wins where matches overlap; "mayores" is inside it
+    assert [c for _, _, c in automaton.find("adultos mayores y adultos")] == [("b",), ("a",)]
+    # Only whole words: "act" is not found in "actitud" or "impacto"
+    assert automaton.find("mi actitud ante el impacto") == []
+    assert automaton.find("terapia act") == [(8, 11, ("d",))]
+
+
+def test_automaton_matches_naive_search():
+    patterns = {"ansiedad": ["a"], "ansiedad social": ["b"], "social": ["c"], "estres": ["d"],
+                "ataques de panico": ["e"], "panico": ["f"], "de": ["g"], "ataques": ["h"]}
+    automaton = Automaton(patterns)
+    words = ["ansiedad", "social", "estres", "ataques", "de", "panico", "mucho", "ansied", "sociales"]
+    rng = random.Random(3)
+    for _ in range(500):
+        text = " ".join(rng.choice(words) for _ in range(rng.randint(1, 8)))
+        assert automaton.find(text) == naive_find(patterns, text), text
+
+
+@pytest.mark.parametrize("text, expected", [
+    ("Me siento muy ansioso y triste desde el divorcio",
+     ["specialty:ansiedad-y-estres", "specialty:depresion", "specialty:relaciones-vinculos"]),
+    ("Busco alguien empático que use TCC",
+     ["style:contenedor-y-empatico", "approach:terapia-cognitivo-conductual-cbt"]),
+    ("Prefiero sesiones en english", ["language:ingles"]),
+    ("Para adultos mayores", ["age_group:adultos-mayores-50"]),
+    ("Terapia Cognitivo-Conductual (CBT)", ["approach:terapia-cognitivo-conductual-cbt"]),
+    ("Mindfulness", ["approach:mindfulness-aceptacion"]),
+    ("Nada en particular", []),
+])
+def test_concepts(text, expected):
+    assert vocabulary.base().concepts(text) == expected
+
+
+def test_label_concepts():
+    vocab = vocabulary.base()
+    assert vocab.label_concepts("languages", "Inglés") == ["language:ingles"]
+    # A label outside the vocabulary gets the concepts it mentions
+    assert vocab.label_concepts("specialties", "Ansiedad social") == ["specialty:ansiedad-y-estres"]
+    assert vocab.label_concepts("specialties", "Neuropsicología") == []
+
+
+def test_canonical():
+    vocab = vocabulary.base()
+    assert vocab.canonical("CBT") == vocab.canonical("Terapia Cognitivo-Conductual (CBT)")
+    assert vocab.canonical("  INGLÉS ") == "language:ingles"
+    assert vocab.canonical("Hola, mundo") == "hola mundo"
+
+
+def test_catalog_labels_extend_the_vocabulary():
+    labels = vocabulary.catalog_labels([{"specialties": ["Neuropsicología"], "languages": ["Francés"]}])
+    vocab = vocabulary.compiled(labels)
+    assert vocabulary.compiled(labels) is vocab
+    assert vocab.concepts("neuropsicologia en frances") == ["specialty:neuropsicologia", "language:frances"]
+    assert vocab.version != vocabulary.base().version
+    assert Vocabulary(labels).version == vocab.version
+
+
+if __name__ == "__main__":
+    sys.exit(pytest.main([__file__, "-q"]))
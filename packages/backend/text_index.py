@@ -0,0 +1,267 @@
+"""
+Local TF-IDF index over therapist bios.
+
+Each active therapist's bio and additional_info are tokenized (accent-folded,
+Spanish stopwords removed, plurals and gender endings stripped) into a sparse
+vector with sublinear term frequency and smoothed idf. search() returns the
+top-k therapists by cosine similarity to a patient's answers.
+
+The index is inverted (term -> therapist -> weight) and updated in place:
+registration and deletion add or remove one document, and sync() brings it
+in line with a loaded catalog by re-indexing only therapists whose text
+changed. Document norms are computed with the idf at the time and refreshed
+for the whole index when the document count drifts by more than
+NORM_REFRESH_RATIO. Queries read each term's postings in impact order, at
+most TEXT_INDEX_MAX_POSTINGS per term, so their cost does not grow with the
+catalog.
+
+With TEXT_INDEX_PATH set, the index is saved there (atomically) after it
+changes at warm-up and at shutdown, and loaded at startup, so a restart only
+re-indexes what changed in the meantime.
+"""
+
+import bisect
+import heapq
+import logging
+import math
+import os
+import pickle
+import threading
+import time
+import zlib
+from collections import Counter
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+import vocabulary
+from metrics import text_index_documents, text_index_search_seconds
+
+logger = logging.getLogger(__name__)
+
+# Empty disables persistence; the index is then rebuilt at every start
+TEXT_INDEX_PATH = os.getenv("TEXT_INDEX_PATH", "")
+TEXT_INDEX_MAX_POSTINGS = int(os.getenv("TEXT_INDEX_MAX_POSTINGS", 2000))
+NORM_REFRESH_RATIO = 0.1
+FORMAT_VERSION = 1
+
+STOPWORDS = frozenset("""
+a al algo algun alguna algunas alguno algunos ante antes aqui asi aun bien cada casi como con
+contra cual cuales cuando de del desde donde dos e el ella ellas ello ellos en entre era eran es
+esa esas ese eso esos esta estaba estan estar estas este esto estos estoy fue fueron ha hace
+hacer han hasta hay he la las le les lo los mas me mi mis mismo mucho muy nada ni no nos nuestra
+nuestro o otra otras otro otros para pero poco por porque que quien se sea ser si sido siempre
+sin sobre son su sus tambien tan tanto te tengo tiene tienen todo todos tu tus un una uno unos
+usted y ya yo
+""".split())
+
+
+def stem(word: str) -> str:
+    """Strip plural and gender endings: "ansiosas" and "ansioso" both become "ansios" """
+    if len(word) > 4 and word.endswith("es") and word[-3] not in "aeiou":
+        word = word[:-2]
+    elif len(word) > 3 and word.endswith("s"):
+        word = word[:-1]
+    if len(word) > 4 and word[-1] in "aoe":
+        word = word[:-1]
+    return word
+
+
+def tokenize(text: Optional[str]) -> List[str]:
+    return [stem(w) for w in vocabulary.fold(text or "").split()
+            if w not in STOPWORDS and len(w) > 1 and not w.isdigit()]
+
+
+def therapist_text(therapist: Dict[str, Any]) -> str:
+    """The text of a therapist dict that is indexed"""
+    return "\n".join(t for t in (therapist.get("bio"), therapist.get("additional_info")) if t)
+
+
+def _fingerprint(text: str) -> int:
+    return zlib.crc32(text.encode("utf-8"))
+
+
+class TextIndex:
+    def __init__(self, path: str = TEXT_INDEX_PATH, max_postings: int = TEXT_INDEX_MAX_POSTINGS):
+        self.path = path
+        self.max_postings = max_postings
+        self._lock = threading.Lock()
+        self._reset()
+
+    def _reset(self) -> None:
+        # Term counts and text fingerprint of each document, by therapist id
+        self._documents: Dict[str, Dict[str, int]] = {}
+        self._fingerprints: Dict[str, int] = {}
+        # term -> therapist id -> 1 + ln(tf)
+        self._postings: Dict[str, Dict[str, float]] = {}
+        self._norms: Dict[str, float] = {}
+        self._norm_documents = 0
+        # term -> [(-weight / norm, therapist id)], best first, built on first query of the term
+        self._impacts: Dict[str, List[Tuple[float, str]]] = {}
+        self.dirty = False
+
+    def __len__(self) -> int:
+        return len(self._documents)
+
+    def _idf(self, term: str) -> float:
+        return math.log((1 + len(self._documents)) / (1 + len(self._postings.get(term, ())))) + 1
+
+    def _norm(self, counts: Dict[str, int]) -> float:
+        return math.sqrt(sum(((1 + math.log(tf)) * self._idf(term)) ** 2
+                             for term, tf in counts.items())) or 1.0
+
+    def _add(self, doc_id: str, text: str) -> None:
+        self._remove(doc_id)
+        counts = Counter(tokenize(text))
+        self._documents[doc_id] = dict(counts)
+        self._fingerprints[doc_id] = _fingerprint(text)
+        norm = self._norms[doc_id] = self._norm(counts)
+        for term, tf in counts.items():
+            weight = self._postings.setdefault(term, {})[doc_id] = 1 + math.log(tf)
+            impacts = self._impacts.get(term)
+            if impacts is not None:
+                bisect.insort(impacts, (-weight / norm, doc_id))
+                del impacts[self.max_postings:]
+
+    def _remove(self, doc_id: str) -> bool:
+        counts = self._documents.pop(doc_id, None)
+        if counts is None:
+            return False
+        self._fingerprints.pop(doc_id, None)
+        self._norms.pop(doc_id, None)
+        for term in counts:
+            postings = self._postings.get(term)
+            if postings is not None:
+                postings.pop(doc_id, None)
+                if not postings:
+                    del self._postings[term]
+            impacts = self._impacts.get(term)
+            if impacts is not None:
+                if len(impacts) >= self.max_postings:
+                    # Truncated: the next best posting is not in the list
+                    del self._impacts[term]
+                else:
+                    impacts[:] = [entry for entry in impacts if entry[1] != doc_id]
+        return True
+
+    def _refresh_norms_if_drifted(self) -> None:
+        if abs(len(self._documents) - self._norm_documents) <= NORM_REFRESH_RATIO * self._norm_documents:
+            return
+        self._norms = {doc_id: self._norm(counts) for doc_id, counts in self._documents.items()}
+        self._norm_documents = len(self._documents)
+        self._impacts.clear()
+
+    def _changed(self) -> None:
+        self._refresh_norms_if_drifted()
+        self.dirty = True
+        text_index_documents.set(len(self._documents))
+
+    def add(self, doc_id: str, text: str) -> None:
+        """Index or re-index one therapist"""
+        with self._lock:
+            self._add(doc_id, text)
+            self._changed()
+
+    def remove(self, doc_id: str) -> None:
+        with self._lock:
+            if self._remove(doc_id):
+                self._changed()
+
+    def sync(self, therapists: Iterable[Dict[str, Any]]) -> int:
+        """Make the index hold exactly these therapists; returns the number of documents changed"""
+        wanted = {t["id"]: therapist_text(t) for t in therapists}
+        with self._lock:
+            stale = [doc_id for doc_id in self._documents if doc_id not in wanted]
+            for doc_id in stale:
+                self._remove(doc_id)
+            changed = len(stale)
+            for doc_id, text in wanted.items():
+                if self._fingerprints.get(doc_id) != _fingerprint(text):
+                    self._add(doc_id, text)
+                    changed += 1
+            if changed:
+                self._changed()
+        return changed
+
+    def _impact_list(self, term: str) -> List[Tuple[float, str]]:
+        impacts = self._impacts.get(term)
+        if impacts is None:
+            postings = self._postings.get(term, {})
+            norms = self._norms
+            impacts = heapq.nsmallest(
+                self.max_postings, ((-w / norms[d], d) for d, w in postings.items()))
+            self._impacts[term] = impacts
+        return impacts
+
+    def search(self, text: str, k: int) -> List[Tuple[str, float]]:
+        """(therapist id, cosine similarity) of the k documents most similar to text, best first"""
+        started = time.perf_counter()
+        query = Counter(tokenize(text))
+        scores: Dict[str, float] = {}
+        with self._lock:
+            weights = {term: (1 + math.log(tf)) * self._idf(term)
+                       for term, tf in query.items() if term in self._postings}
+            query_norm = math.sqrt(sum(w * w for w in weights.values())) or 1.0
+            for term, weight in weights.items():
+                # The document side's idf factor is applied here, once per term
+                factor = weight * self._idf(term) / query_norm
+                for impact, doc_id in self._impact_list(term):
+                    scores[doc_id] = scores.get(doc_id, 0.0) - factor * impact
+        best = heapq.nlargest(k, scores.items(), key=lambda item: item[1])
+        text_index_search_seconds.observe(time.perf_counter() - started)
+        return best
+
+    def save(self) -> bool:
+        """Write the index to path if it changed; returns whether it was written"""
+        if not self.path or not self.dirty:
+            return False
+        started = time.perf_counter()
+        with self._lock:
+            state = {
+                "format": FORMAT_VERSION,
+                "documents": self._documents,
+                "fingerprints": self._fingerprints,
+                "postings": self._postings,
+                "norms": self._norms,
+                "norm_documents": self._norm_documents,
+            }
+            data = pickle.dumps(state, protocol=pickle.HIGHEST_PROTOCOL)
+            self.dirty = False
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        temporary = f"{self.path}.{os.getpid()}.tmp"
+        with open(temporary, "wb") as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        # Other processes may save the same index; the last complete file wins
+        os.replace(temporary, self.path)
+        logger.info(
+            f"Saved text index ({len(self)} documents) in {(time.perf_counter() - started) * 1000:.0f}ms")
+        return True
+
+    def load(self) -> bool:
+        """Replace the index with the saved one; returns False if there is none or it is unreadable"""
+        if not self.path or not os.path.exists(self.path):
+            return False
+        started = time.perf_counter()
+        try:
+            with open(self.path, "rb") as f:
+                state = pickle.load(f)
+            if state.get("format") != FORMAT_VERSION:
+                logger.info("Saved text index has an old format, rebuilding")
+                return False
+        except Exception as e:
+            logger.warning(f"Could not load text index from {self.path}, rebuilding: {str(e)}")
+            return False
+        with self._lock:
+            self._reset()
+            self._documents = state["documents"]
+            self._fingerprints = state["fingerprints"]
+            self._postings = state["postings"]
+            self._norms = state["norms"]
+            self._norm_documents = state["norm_documents"]
+        text_index_documents.set(len(self))
+        logger.info(
+            f"Loaded text index ({len(self)} documents) in {(time.perf_counter() - started) * 1000:.0f}ms")
+        return True
+
+
+index = TextIndex()
@@ -0,0 +1,266 @@
+"""
+Canonical concepts for therapist labels and patient answers.
+
+Therapist fields hold Spanish labels with accents, punctuation and emoji
+("Contenedor y empático 🫂", "Terapia Cognitivo-Conductual (CBT)") and patients
+answer in choices or free text. Every label is a concept with an id like
+"approach:terapia-cognitivo-conductual-cbt"; its folded text (accents, case,
+punctuation and emoji removed), the parts between "/" or in parentheses, and
+the SYNONYMS of the concept are compiled into one Aho-Corasick automaton, so
+any text maps to concept ids in a single pass over it. Patterns match whole
+words only; where matches overlap the leftmost, then longest, wins ("adultos
+mayores" is not also "adultos").
+
+The vocabulary is the registration form's (BASE_VOCABULARIES) plus any other
+label found in the catalog. compiled() keeps the last automaton and rebuilds it
+only when the labels change. Cache keys use base() instead, so every process
+computes the same key for the same answers whatever catalog it has loaded.
+"""
+
+import hashlib
+import json
+import logging
+import re
+import threading
+import time
+import unicodedata
+from collections import deque
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Therapist fields with a vocabulary, and the prefix of their concept ids
+FIELD_PREFIXES = {
+    "specialties": "specialty",
+    "therapeutic_approaches": "approach",
+    "therapeutic_style": "style",
+    "age_groups": "age_group",
+    "languages": "language",
+}
+
+# Options of the therapist registration form
+BASE_VOCABULARIES = {
+    "specialties": ["Ansiedad y estrés", "Depresión", "Relaciones / vínculos", "Duelo y pérdidas",
+                    "Trauma / TEPT", "Autoestima", "Adolescencia", "Sexualidad",
+                    "Trastornos alimenticios"],
+    "therapeutic_approaches": ["Terapia Cognitivo-Conductual (CBT)", "Humanista / centrada en la persona",
+                               "Psicoanálisis / psicodinámica", "Sistémica", "EMDR",
+                               "Mindfulness / aceptación", "Espiritual / transpersonal"],
+    "therapeutic_style": ["Contenedor y empático 🫂", "Directo y confrontativo ⚡",
+                          "Espiritual y profundo 🌱", "Analítico y reflexivo 🧠",
+                          "Práctico y orientado a soluciones 🛠️", "Flexible y adaptativo 🌀"],
+    "age_groups": ["Adolescentes (13–17)", "Jóvenes (18–25)", "Adultos (26–50)",
+                   "Adultos mayores (50+)", "Todos los anteriores"],
+    "languages": ["Español", "Inglés"],
+}
+
+# Other ways patients say the same thing, by concept id; folded like the text
+SYNONYMS = {
+    "specialty:ansiedad-y-estres": ["ansiedad", "ansioso", "ansiosa", "estres", "estresado",
+                                    "estresada", "angustia", "nervios", "panico", "ataques de panico",
+                                    "preocupacion", "preocupaciones"],
+    "specialty:depresion": ["deprimido", "deprimida", "tristeza", "triste", "sin energia",
+                            "desanimo", "desmotivacion"],
+    "specialty:relaciones-vinculos": ["pareja", "familia", "ruptura", "divorcio", "conflictos",
+                                      "vinculo", "relacion"],
+    "specialty:duelo-y-perdidas": ["duelo", "perdida", "perdi", "fallecimiento", "ser querido"],
+    "specialty:trauma-tept": ["traumatica", "traumatico", "abuso", "estres postraumatico"],
+    "specialty:autoestima": ["inseguridad", "me comparo", "valorarme", "confianza en mi"],
+    "specialty:adolescencia": ["adolescente", "adolescentes", "mi hijo", "mi hija"],
+    "specialty:sexualidad": ["sexual", "sexuales", "identidad de genero", "orientacion sexual"],
+    "specialty:trastornos-alimenticios": ["alimentacion", "la comida", "anorexia", "bulimia",
+                                          "atracones", "trastorno alimenticio"],
+    "approach:terapia-cognitivo-conductual-cbt": ["tcc", "cognitivo conductual", "cognitiva",
+                                                  "conductual"],
+    "approach:humanista-centrada-en-la-persona": ["humanista", "rogeriana", "gestalt"],
+    "approach:psicoanalisis-psicodinamica": ["psicoanalisis", "psicoanalitica", "psicodinamica",
+                                             "psicoanalista"],
+    "approach:sistemica": ["sistemico", "terapia familiar", "terapia de pareja"],
+    "approach:mindfulness-aceptacion": ["meditacion", "atencion plena", "act", "aceptacion y compromiso"],
+    "approach:espiritual-transpersonal": ["espiritualidad", "transpersonal"],
+    "style:contenedor-y-empatico": ["empatico", "empatica", "empatia", "contenedor", "contencion",
+                                    "calido", "calida", "comprensivo", "comprensiva"],
+    "style:directo-y-confrontativo": ["directo", "directa", "confrontativo", "confrontativa",
+                                      "franco", "franca"],
+    "style:espiritual-y-profundo": ["profundo", "profunda"],
+    "style:analitico-y-reflexivo": ["analitico", "analitica", "reflexivo", "reflexiva"],
+    "style:practico-y-orientado-a-soluciones": ["practico", "practica", "soluciones", "herramientas"],
+    "style:flexible-y-adaptativo": ["flexible", "adaptativo", "adaptativa"],
+    "age_group:adolescentes-13-17": ["adolescente"],
+    "age_group:jovenes-18-25": ["joven", "jovenes", "universitario", "universitaria"],
+    "age_group:adultos-26-50": ["adulto", "adulta"],
+    "age_group:adultos-mayores-50": ["adulto mayor", "adulta mayor", "tercera edad"],
+    "language:espanol": ["castellano"],
+    "language:ingles": ["english"],
+}
+
+
+def fold(text: str) -> str:
+    """Lowercase, strip accents, punctuation and emoji, collapse whitespace"""
+    text = unicodedata.normalize("NFKD", text or "")
+    text = "".join(c for c in text if not unicodedata.combining(c))
+    text = re.sub(r"[^\w\s]|_", " ", text.casefold())
+    return " ".join(text.split())
+
+
+def concept_id(field: str, label: str) -> str:
+    return f"{FIELD_PREFIXES[field]}:{fold(label).replace(' ', '-')}"
+
+
+def label_patterns(label: str) -> Set[str]:
+    """Folded texts that mean a label: itself, its "/" parts and parenthesized parts"""
+    patterns = {fold(label), fold(re.sub(r"\(.*?\)", " ", label))}
+    for part in re.split(r"/|\(|\)", label):
+        patterns.add(fold(part))
+    # "(13–17)" alone is not a reference to the label
+    return {p for p in patterns if p and not p.replace(" ", "").isdigit()}
+
+
+class Automaton:
+    """Aho-Corasick matcher of whole-word patterns over folded text"""
+
+    def __init__(self, patterns: Dict[str, Iterable[str]]):
+        # Patterns are matched with a space on each side, which is a word boundary in folded text
+        self._goto: List[Dict[str, int]] = [{}]
+        self._fail: List[int] = [0]
+        self._out: List[Tuple[Tuple[int, Tuple[str, ...]], ...]] = [()]
+        for pattern, concepts in patterns.items():
+            node = 0
+            for char in f" {pattern} ":
+                next_node = self._goto[node].get(char)
+                if next_node is None:
+                    next_node = len(self._goto)
+                    self._goto[node][char] = next_node
+                    self._goto.append({})
+                    self._fail.append(0)
+                    self._out.append(())
+                node = next_node
+            self._out[node] = ((len(pattern) + 2, tuple(sorted(concepts))),)
+        # Failure links, breadth first so a node's fallback is linked before it
+        queue = deque(self._goto[0].values())
+        while queue:
+            node = queue.popleft()
+            for char, child in self._goto[node].items():
+                queue.append(child)
+                fallback = self._fail[node]
+                while fallback and char not in self._goto[fallback]:
+                    fallback = self._fail[fallback]
+                target = self._goto[fallback].get(char, 0)
+                self._fail[child] = target if target != child else 0
+                self._out[child] += self._out[self._fail[child]]
+
+    def __len__(self) -> int:
+        return len(self._goto)
+
+    def find(self, folded: str) -> List[Tuple[int, int, Tuple[str, ...]]]:
+        """(start, end, concept ids) of each leftmost-longest match in folded text"""
+        goto, fail, out = self._goto, self._fail, self._out
+        matches = []
+        node = 0
+        for end, char in enumerate(f" {folded} ", 1):
+            while node and char not in goto[node]:
+                node = fail[node]
+            node = goto[node].get(char, 0)
+            for length, concepts in out[node]:
+                # Word span without the surrounding spaces
+                matches.append((end - length, end - 2, concepts))
+        matches.sort(key=lambda m: (m[0], m[0] - m[1]))
+        chosen = []
+        covered_to = -1
+        for start, stop, concepts in matches:
+            if start > covered_to:
+                chosen.append((start, stop, concepts))
+                covered_to = stop
+        return chosen
+
+
+class Vocabulary:
+    def __init__(self, labels: Dict[str, Iterable[str]]):
+        started = time.perf_counter()
+        self.labels = {field: sorted(set(values)) for field, values in labels.items()}
+        self.version = vocabulary_hash(self.labels)
+        self._label_sets = {field: set(values) for field, values in self.labels.items()}
+        self._label_concepts: Dict[Tuple[str, str], List[str]] = {}
+        patterns: Dict[str, Set[str]] = {}
+        for field, values in self.labels.items():
+            for label in values:
+                for pattern in label_patterns(label):
+                    patterns.setdefault(pattern, set()).add(concept_id(field, label))
+        for concept, synonyms in SYNONYMS.items():
+            for synonym in synonyms:
+                patterns.setdefault(fold(synonym), set()).add(concept)
+        self.automaton = Automaton(patterns)
+        # Whole folded texts that name exactly one concept
+        self._exact = {p: next(iter(c)) for p, c in patterns.items() if len(c) == 1}
+        logger.info(
+            f"Compiled vocabulary {self.version[:12]}: {len(patterns)} patterns, "
+            f"{len(self.automaton)} states in {(time.perf_counter() - started) * 1000:.1f}ms")
+
+    def concepts(self, text: str) -> List[str]:
+        """Concept ids mentioned in a text, in order of first mention"""
+        found: Dict[str, None] = {}
+        for _, _, concepts in self.automaton.find(fold(text)):
+            for concept in concepts:
+                found[concept] = None
+        return list(found)
+
+    def label_concepts(self, field: str, label: str) -> List[str]:
+        """Concept ids of a therapist's label; labels outside the vocabulary get the ones they mention"""
+        key = (field, label)
+        concepts = self._label_concepts.get(key)
+        if concepts is None:
+            if field in FIELD_PREFIXES and label in self._label_sets.get(field, ()):
+                concepts = [concept_id(field, label)]
+            else:
+                concepts = self.concepts(label)
+            self._label_concepts[key] = concepts
+        return concepts
+
+    def canonical(self, text: str) -> str:
+        """The concept id when the whole text names one concept, else the folded text"""
+        folded = fold(text)
+        return self._exact.get(folded, folded)
+
+
+def vocabulary_hash(labels: Dict[str, Iterable[str]]) -> str:
+    payload = json.dumps({"labels": {f: sorted(set(v)) for f, v in labels.items()},
+                          "synonyms": SYNONYMS}, sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+
+def catalog_labels(therapists: Iterable[Dict]) -> Dict[str, Set[str]]:
+    """The base vocabularies plus every label found in therapist dicts"""
+    labels = {field: set(values) for field, values in BASE_VOCABULARIES.items()}
+    for therapist in therapists:
+        for field in FIELD_PREFIXES:
+            labels[field].update(
+                v for v in therapist.get(field) or () if isinstance(v, str))
+    return labels
+
+
+_lock = threading.Lock()
+_base: Optional[Vocabulary] = None
+_last: Optional[Vocabulary] = None
+
+
+def base() -> Vocabulary:
+    """The registration form's vocabulary, the same in every process"""
+    global _base
+    if _base is None:
+        with _lock:
+            if _base is None:
+                _base = Vocabulary(BASE_VOCABULARIES)
+    return _base
+
+
+def compiled(labels: Dict[str, Iterable[str]]) -> Vocabulary:
+    """Vocabulary for these labels, reusing the last one compiled when they have not changed"""
+    global _last
+    version = vocabulary_hash(labels)
+    last = _last
+    if last is None or last.version != version:
+        with _lock:
+            if _last is None or _last.version != version:
+                _last = Vocabulary(labels)
+            last = _last
+    return last
@@ -0,0 +1,200 @@
+#!/usr/bin/env python3
+"""
+Standalone matching worker.
+
+Claims matching jobs enqueued by the web tier and runs them in a loop:
+
+    python -m worker --concurrency 4
+
+Several workers can run on separate nodes against the same database.
+"""
+
+import argparse
+import logging
+import os
+import signal
+import socket
+import sys
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from database import SessionLocal, ModelComparison
+from gemini_service import get_matching_service
+from job_queue import (
+    claim_job, heartbeat, complete_job, fail_job, reap_exhausted_jobs, JOB_LEASE_SECONDS
+)
+from matching import run_model
+import attributes
+import catalog_cache
+import features
+import rollups
+import text_index
+from metrics import REGISTRY, time_stage, model_failures_total
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+class MatchingWorker:
+    def __init__(self, worker_id: str, concurrency: int, lease_seconds: int, poll_interval: float):
+        self.worker_id = worker_id
+        self.concurrency = concurrency
+        self.lease_seconds = lease_seconds
+        self.poll_interval = poll_interval
+        self.matching_service = get_matching_service()
+        self._stop = threading.Event()
+
+    def run(self):
+        """Run worker slots until stopped"""
+        logger.info(
+            f"Matching worker {self.worker_id} started with {self.concurrency} slot(s)")
+        threads = [
+            threading.Thread(target=self._slot_loop, args=(
+                slot,), name=f"matching-slot-{slot}")
+            for slot in range(self.concurrency)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        logger.info(f"Matching worker {self.worker_id} stopped")
+
+    def stop(self):
+        """Finish running jobs and exit"""
+        self._stop.set()
+
+    def _slot_loop(self, slot: int):
+        slot_id = f"{self.worker_id}/{slot}"
+        while not self._stop.is_set():
+            db = SessionLocal()
+            try:
+                if slot == 0:
+                    reap_exhausted_jobs(db)
+                job = claim_job(db, slot_id, self.lease_seconds)
+                if job is None:
+                    self._stop.wait(self.poll_interval)
+                    continue
+                self._process(db, job, slot_id)
+            except Exception as e:
+                logger.error(f"Worker slot {slot_id} error: {str(e)}")
+                self._stop.wait(self.poll_interval)
+            finally:
+                db.close()
+
+    def _process(self, db, job, slot_id: str):
+        logger.info(
+            f"{slot_id} running {job.model_name} for session {job.comparison_id} (attempt {job.attempts})")
+        lease_lost = threading.Event()
+        done = threading.Event()
+        beat = threading.Thread(target=self._heartbeat_loop, args=(
+            job.id, slot_id, done, lease_lost), daemon=True)
+        beat.start()
+
+        try:
+            comparison = db.get(ModelComparison, job.comparison_id)
+            with time_stage("catalog_load"):
+                therapist_dicts = catalog_cache.therapists.get(db)
+            # Validated and counted at submission; decoded the same way here
+            extractor, answer_features = features.extract(
+                catalog_cache.questions.get(db), comparison.questionnaire_answers)
+            user_answers = extractor.user_answers(answer_features)
+            matches, processing_time = run_model(
+                self.matching_service, therapist_dicts, user_answers, job.model_name,
+                answer_features,
+                attributes.candidate_ids(db, user_answers) if job.model_name != "random" else None)
+        except Exception as e:
+            done.set()
+            logger.error(
+                f"Error with model {job.model_name} for session {job.comparison_id}: {str(e)}")
+            model_failures_total.inc(model=job.model_name)
+            db.rollback()
+            fail_job(db, job, slot_id, str(e))
+            return
+        done.set()
+        beat.join()
+
+        if lease_lost.is_set():
+            logger.warning(
+                f"{slot_id} lost lease on job {job.id} while running")
+        complete_job(db, job, slot_id, matches, processing_time)
+
+    def _heartbeat_loop(self, job_id: str, slot_id: str, done: threading.Event, lease_lost: threading.Event):
+        interval = max(self.lease_seconds / 3, 1)
+        while not done.wait(interval):
+            db = SessionLocal()
+            try:
+                if not heartbeat(db, job_id, slot_id, self.lease_seconds):
+                    lease_lost.set()
+                    return
+            except Exception as e:
+                logger.error(f"Heartbeat failed for job {job_id}: {str(e)}")
+            finally:
+                db.close()
+
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    """Serves the worker's metrics at /metrics"""
+
+    def do_GET(self):
+        if self.path != "/metrics":
+            self.send_error(404)
+            return
+        body = REGISTRY.render().encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def main(argv=None):
+    """Main function"""
+    parser = argparse.ArgumentParser(description="Kuna matching worker")
+    parser.add_argument("--concurrency", type=int,
+                        default=int(os.getenv("MATCHING_WORKER_CONCURRENCY", 2)),
+                        help="Number of jobs to run in parallel")
+    parser.add_argument("--lease-seconds", type=int, default=JOB_LEASE_SECONDS,
+                        help="Lease duration before another worker may retake a job")
+    parser.add_argument("--poll-interval", type=float,
+                        default=float(
+                            os.getenv("MATCHING_WORKER_POLL_INTERVAL", 1.0)),
+                        help="Seconds to wait when the queue is empty")
+    parser.add_argument("--worker-id",
+                        default=f"{socket.gethostname()}-{os.getpid()}",
+                        help="Identifier recorded on claimed jobs")
+    parser.add_argument("--metrics-port", type=int,
+                        default=int(os.getenv("MATCHING_WORKER_METRICS_PORT", 0)),
+                        help="Serve Prometheus metrics on this port (0 disables)")
+    args = parser.parse_args(argv)
+
+    rollups.install(SessionLocal)
+    worker = MatchingWorker(args.worker_id, args.concurrency,
+                            args.lease_seconds, args.poll_interval)
+
+    def handle_signal(signum, frame):
+        logger.info("Shutdown requested, finishing running jobs")
+        worker.stop()
+
+    signal.signal(signal.SIGTERM, handle_signal)
+    signal.signal(signal.SIGINT, handle_signal)
+
+    if args.metrics_port:
+        server = ThreadingHTTPServer(("0.0.0.0", args.metrics_port), MetricsHandler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        logger.info(f"Serving worker metrics on port {args.metrics_port}")
+
+    # Drop the cached catalog when a web process registers or deletes a therapist
+    catalog_cache.poller.poll_once()
+    catalog_cache.poller.start()
+    text_index.index.load()
+    worker.run()
+    catalog_cache.poller.stop()
+    text_index.index.save()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())